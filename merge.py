@@ -1,41 +1,211 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
 import sys
+import zlib
+import struct
+import getopt
+import concurrent.futures
+from collections import deque
 from PIL import Image
+import numpy
+from typing import Any, Deque, Iterator, Tuple, List, Optional
+
+
+Image.MAX_IMAGE_PIXELS = None
+default_quality = 95
+default_compress_level = 6 # PNG를 입력 이미지 단위로 나눠서 압축할 때의 zlib 압축 수준
+default_decode_workers = min(4, os.cpu_count() or 1) # 동시에 디코딩하는 입력 이미지의 최대 갯수
+streaming_formats = {"PNG", "PPM"} # 전체 캔버스를 만들지 않고 입력 이미지 단위로 나눠서 쓸 수 있는 포맷
 
 
 def print_usage():
-	print("Usage: %s new old..." % (sys.argv[0]))
-	
-			
-def main():
-    count = len(sys.argv[2:])
-    im = []
-    total_width = 0
-    total_height = 0
-    for i in range(count):
-        print(sys.argv[i + 2])
-        i = Image.open(sys.argv[i + 2])
-        width, height = i.size
-        im.append(i)
-        print("%d %d %s" % (width, height, i.format))
-        if total_width < width:
-            total_width = width
-        total_height += height
+	print("Usage: %s [-f <format>] [-q <quality>] [-j <workers>] new old..." % (sys.argv[0]))
+	print("\t-f <format>: output format, e.g. PNG, JPEG, WEBP, PPM (default: format of the last input)")
+	print("\t\tonly PNG and PPM are written slice by slice without allocating the whole canvas;")
+	print("\t\tother formats (JPEG, WEBP, ...) are pasted on a canvas of the full size (4 bytes per pixel)")
+	print("\t-q <quality>: quality of JPEG or WEBP output (default %d)" % (default_quality))
+	print("\t-j <workers>: number of input images decoded concurrently (default %d)" % (default_decode_workers))
 
-    print("%d %d" % (total_width, total_height))
-    new_im = Image.new("RGB", (total_width, total_height), "white");
+
+def read_headers(image_files) -> List[Tuple[str, int, int, Optional[str]]]:
+    # 헤더만 읽어서 입력 이미지의 크기와 포맷을 알아냄 (픽셀은 디코딩하지 않음)
+    headers = []
+    for image_file in image_files:
+        print(image_file)
+        with Image.open(image_file) as im:
+            (width, height) = im.size
+            headers.append((image_file, width, height, im.format))
+        print("%d %d %s" % (width, height, im.format))
+    return headers
+
+
+def decode_slice(image_file, width) -> Image.Image:
+    # 입력 이미지를 RGB로 디코딩하고, 너비가 모자라면 오른쪽을 흰색으로 채움
+    im: Image.Image
+    with Image.open(image_file) as source:
+        source.load()
+        im = source if source.mode == "RGB" else source.convert("RGB")
+    if im.size[0] < width:
+        padded = Image.new("RGB", (width, im.size[1]), "white")
+        padded.paste(im, (0, 0))
+        return padded
+    return im
+
+
+def encode_png_slice(image_file, width, compress_level) -> Tuple[bytes, int, int, int]:
+    # 입력 이미지를 디코딩해서 PNG 행 필터를 적용하고 독립된 deflate 블록들로 압축함
+    # 입력 이미지마다 따로 압축할 수 있도록 첫 행은 필터 없이, 나머지 행은 Up 필터(바로 윗 행과의 차)로 저장함
+    im = decode_slice(image_file, width)
+    rows = numpy.asarray(im).reshape(im.size[1], -1)
+    filtered = numpy.empty((rows.shape[0], rows.shape[1] + 1), dtype=numpy.uint8)
+    filtered[0, 0] = 0
+    filtered[1:, 0] = 2
+    filtered[0, 1:] = rows[0]
+    numpy.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+    data = filtered.tobytes()
+    # Z_FULL_FLUSH로 끝내면 바이트 경계에서 끝나고 앞의 데이터를 참조하지 않으므로 그대로 이어 붙일 수 있음
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush(zlib.Z_FULL_FLUSH)
+    return (compressed, zlib.adler32(data), len(data), im.size[1])
+
+
+def encode_ppm_slice(image_file, width) -> Tuple[bytes, int]:
+    im = decode_slice(image_file, width)
+    return (im.tobytes(), im.size[1])
+
+
+def map_in_order(function, image_files, num_workers, *args) -> Iterator[Any]:
+    # 입력 이미지마다 function을 스레드 풀에서 실행하되 (Pillow의 디코더와 zlib은 GIL을 놓고 동작함),
+    # 결과는 순서대로 반환하고 실행 중이거나 끝난 결과는 num_workers 개까지만 유지함
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending: Deque[concurrent.futures.Future] = deque()
+        remaining = iter(image_files)
+        for image_file in remaining:
+            pending.append(executor.submit(function, image_file, *args))
+            if len(pending) >= num_workers:
+                break
+        while pending:
+            result = pending.popleft().result()
+            for image_file in remaining:
+                pending.append(executor.submit(function, image_file, *args))
+                break
+            yield result
+
+
+def adler32_combine(adler1, adler2, length2) -> int:
+    # adler32(A)와 adler32(B), len(B)로 adler32(A + B)를 계산함 (zlib의 adler32_combine())
+    base = 65521
+    remainder = length2 % base
+    sum1 = adler1 & 0xffff
+    sum2 = (remainder * sum1) % base
+    sum1 = (sum1 + (adler2 & 0xffff) + base - 1) % base
+    sum2 = (sum2 + ((adler1 >> 16) & 0xffff) + ((adler2 >> 16) & 0xffff) + base - remainder) % base
+    return sum1 | (sum2 << 16)
+
+
+class PngWriter:
+    # 입력 이미지마다 따로 압축한 deflate 블록들을 하나의 zlib 스트림으로 이어서 쓰는 PNG (8비트 RGB) 출력
+    def __init__(self, f, width, height) -> None:
+        self.f = f
+        self.f.write(b"\x89PNG\r\n\x1a\n")
+        self.write_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        self.header = b"\x78\x9c" # zlib 헤더 (deflate, 32K 윈도우)
+        self.adler = 1
+
+    def write_chunk(self, chunk_type, data) -> None:
+        self.f.write(struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data)))
+
+    def write_slice(self, compressed, adler, length) -> None:
+        self.write_chunk(b"IDAT", self.header + compressed)
+        self.header = b""
+        self.adler = adler32_combine(self.adler, adler, length)
+
+    def close(self) -> None:
+        # 빈 마지막 블록과 adler32 체크섬으로 zlib 스트림을 끝냄
+        self.write_chunk(b"IDAT", self.header + b"\x03\x00" + struct.pack(">I", self.adler))
+        self.write_chunk(b"IEND", b"")
+
+
+def merge_streaming(output_file, image_files, total_width, total_height, format, num_workers) -> None:
+    # 입력 이미지를 디코딩하고 압축하는 대로 출력 파일에 이어서 씀 (전체 캔버스를 만들지 않음)
+    with open(output_file, "wb") as f:
+        total_height_written = 0
+        if format == "PNG":
+            writer = PngWriter(f, total_width, total_height)
+            for (compressed, adler, length, height) in map_in_order(encode_png_slice, image_files, num_workers, total_width, default_compress_level):
+                writer.write_slice(compressed, adler, length)
+                total_height_written += height
+                print("box=", (0, total_height_written))
+            writer.close()
+        else:
+            f.write(b"P6\n%d %d\n255\n" % (total_width, total_height))
+            for (data, height) in map_in_order(encode_ppm_slice, image_files, num_workers, total_width):
+                f.write(data)
+                total_height_written += height
+                print("box=", (0, total_height_written))
+
+
+def warn_canvas(total_width, total_height, format, is_format_given) -> None:
+    # Pillow의 JPEG, WebP 인코더는 이미지 전체를 메모리에 올려야 하므로 행 단위로 나눠서 쓸 수 없음
+    reason = "the output format" if is_format_given else "the format of the last input"
+    sys.stderr.write("Warning: %s output (%s) can't be written slice by slice; allocating a %dx%d canvas (%d MB), use -f png or -f ppm to avoid it\n" % (format, reason, total_width, total_height, total_width * total_height * 4 // (1024 * 1024)))
+
+
+def merge_on_canvas(output_file, image_files, total_width, total_height, format, quality, num_workers) -> None:
+    # 전체 캔버스에 입력 이미지를 붙인 후 한 번에 저장함 (붙인 입력 이미지는 바로 해제함)
+    new_im = Image.new("RGB", (total_width, total_height), "white")
     box = (0, 0)
     total_height = 0
-    for a_im in im:
-        new_im.paste(a_im, box)
-        width, height = a_im.size
-        total_height += height
+    for im in map_in_order(decode_slice, image_files, num_workers, total_width):
+        new_im.paste(im, box)
+        total_height += im.size[1]
         box = (0, total_height)
         print("box=", box)
-    new_im.save(sys.argv[1], quality=95, format=i.format)
+    new_im.save(output_file, quality=quality, format=format)
+
+
+def main() -> int:
+    format: Optional[str] = None
+    quality = default_quality
+    num_workers = default_decode_workers
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hf:q:j:")
+    except getopt.GetoptError:
+        print_usage()
+        sys.stderr.write("Error: invaild option definition\n")
+        return -1
+    for o, a in opts:
+        if o == "-f":
+            format = a.upper()
+        elif o == "-q":
+            quality = int(a)
+        elif o == "-j":
+            num_workers = max(1, int(a))
+        else:
+            print_usage()
+            return -1
+    if len(args) < 2:
+        print_usage()
+        return -1
+
+    (output_file, image_files) = (args[0], args[1:])
+    headers = read_headers(image_files)
+    total_width = max(width for (_, width, _, _) in headers)
+    total_height = sum(height for (_, _, height, _) in headers)
+    print("%d %d" % (total_width, total_height))
+    is_format_given = format is not None
+    if format is None:
+        # 지정하지 않으면 마지막 입력 이미지의 포맷으로 저장함
+        format = headers[-1][3]
+    if format in streaming_formats:
+        merge_streaming(output_file, image_files, total_width, total_height, format, num_workers)
+    else:
+        warn_canvas(total_width, total_height, format, is_format_given)
+        merge_on_canvas(output_file, image_files, total_width, total_height, format, quality, num_workers)
+    return 0
+
 
-        
 if __name__ == "__main__":
-	main()
+	sys.exit(main())
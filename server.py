@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import getopt
+import threading
+import concurrent.futures
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+from typing import Any, Deque, Dict, Optional, Tuple
+import split
+
+
+default_host = "127.0.0.1"
+default_port = 8790
+default_workers = os.cpu_count() or 1 # 미리 띄워 두는 작업 프로세스의 갯수
+default_queue_size = 64 # 처리 중이거나 기다리는 작업의 최대 갯수 (넘으면 503으로 거절함)
+latency_samples = 1000 # 지연 시간 통계에 쓰는 최근 작업의 갯수
+
+
+def print_usage():
+	print("Usage: %s [-H <host>] [-p <port>] [-j <workers>] [-Q <queue size>]" % (sys.argv[0]))
+	print("\t-H <host>: address to listen on (default %s, only local clients should be allowed)" % (default_host))
+	print("\t-p <port>: port to listen on (default %d)" % (default_port))
+	print("\t-j <workers>: worker processes kept running (default %d)" % (default_workers))
+	print("\t-Q <queue size>: jobs running or waiting before new jobs are rejected with 503 (default %d)" % (default_queue_size))
+	print("\tPOST /split {\"file\": <path>, \"args\": [<split.py options>...]}: split the file and return the cutting points and pieces")
+	print("\tGET /stats: queue depth, job counts and latency percentiles")
+
+
+def warm_up() -> int:
+    # 작업 프로세스에서 PIL의 이미지 플러그인을 미리 불러옴
+    Image.init()
+    return os.getpid()
+
+
+def parse_job(job) -> Tuple[str, split.SplitOptions]:
+    # 요청 본문의 파일 경로와 split.py 옵션 목록을 SplitOptions로 바꿈 (잘못되면 ValueError)
+    if not isinstance(job, dict) or not isinstance(job.get("file"), str):
+        raise ValueError("'file' is not specified")
+    options = split.SplitOptions()
+    opts, args = getopt.getopt([str(arg) for arg in job.get("args", [])], split.split_short_options, split.split_long_options)
+    if args:
+        raise ValueError("unexpected arguments %s" % args)
+    for o, a in opts:
+        split.set_split_option(options, o, a)
+    if options.archive == "-":
+        raise ValueError("'--archive -' can't be used by the server")
+    if options.archive is not None and options.preview_sizes:
+        raise ValueError("--previews can't be used with --archive or --cbz")
+    return (os.path.abspath(job["file"]), options)
+
+
+def get_percentile(values, ratio) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+class SplitServer(ThreadingHTTPServer):
+    # 작업 프로세스 풀을 띄워 두고 HTTP 요청마다 split_report_file()을 풀에서 실행함
+    daemon_threads = True
+
+    def __init__(self, address, num_workers, queue_size) -> None:
+        super().__init__(address, SplitRequestHandler)
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+        self.num_queued = 0
+        self.num_completed = 0
+        self.num_failed = 0
+        self.num_rejected = 0
+        self.latencies: Deque[float] = deque(maxlen=latency_samples)
+        self.executor = self.start_workers()
+
+    def start_workers(self) -> concurrent.futures.ProcessPoolExecutor:
+        # 작업 프로세스를 모두 미리 띄워서 첫 작업부터 인터프리터 시작과 모듈 임포트 비용이 들지 않게 함
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.num_workers)
+        for future in [executor.submit(warm_up) for _ in range(self.num_workers)]:
+            future.result()
+        return executor
+
+    def run_job(self, image_file, options) -> Optional[Dict[str, Any]]:
+        # 큐에 자리가 없으면 None을 반환함
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.num_rejected += 1
+            return None
+        start_time = time.time()
+        report: Dict[str, Any] = {"file": image_file, "result": -1, "pixels": 0, "elapsed": 0.0, "error": "job was not run"}
+        with self.lock:
+            self.num_queued += 1
+        try:
+            with self.lock:
+                executor = self.executor
+            future = executor.submit(split.split_report_file, image_file, options)
+            try:
+                report = future.result()
+            except concurrent.futures.process.BrokenProcessPool:
+                # 작업 프로세스가 죽으면 풀을 다시 띄움 (이미 다른 요청이 다시 띄웠으면 그대로 사용함)
+                with self.lock:
+                    if self.executor is executor:
+                        self.executor = self.start_workers()
+                report["error"] = "worker process died"
+            except Exception as e:
+                # 작업을 보내거나 결과를 받지 못한 경우 (피클링 오류, split_report_file()의 예기치 않은 예외 등)
+                report["error"] = "%s: %s" % (type(e).__name__, e)
+        finally:
+            self.slots.release()
+            # 어떤 경우에도 큐 깊이와 작업 통계를 정리함
+            report["latency"] = time.time() - start_time
+            with self.lock:
+                self.num_queued -= 1
+                self.num_completed += 1
+                if report["result"] != 0:
+                    self.num_failed += 1
+                self.latencies.append(report["latency"])
+        status = "ok" if report["result"] == 0 else "error"
+        print("%s %s (%.1f MP, %.2fs, queue %d)%s" % (status, image_file, report["pixels"] / 1000000, report["latency"], self.num_queued, " " + report["error"] if report["error"] else ""), flush=True)
+        return report
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            latencies = sorted(self.latencies)
+            return {
+                "uptime": time.time() - self.start_time,
+                "workers": self.num_workers,
+                "queue_size": self.queue_size,
+                "queue_depth": self.num_queued,
+                # 처리 중인 작업과 작업 프로세스를 기다리는 작업의 갯수
+                "running": min(self.num_queued, self.num_workers),
+                "waiting": max(0, self.num_queued - self.num_workers),
+                "completed": self.num_completed,
+                "failed": self.num_failed,
+                "rejected": self.num_rejected,
+                "latency_mean": sum(latencies) / len(latencies) if latencies else 0.0,
+                "latency_p50": get_percentile(latencies, 0.5),
+                "latency_p95": get_percentile(latencies, 0.95),
+                "latency_max": latencies[-1] if latencies else 0.0,
+            }
+
+
+class SplitRequestHandler(BaseHTTPRequestHandler):
+    server: SplitServer
+
+    def send_json(self, status, body, headers=()) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for (name, value) in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path == "/stats":
+            self.send_json(200, self.server.get_stats())
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        if self.path != "/split":
+            self.send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            (image_file, options) = parse_job(json.loads(self.rfile.read(length) or b"{}"))
+        except (ValueError, getopt.GetoptError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        report = self.server.run_job(image_file, options)
+        if report is None:
+            # 큐가 가득 차면 바로 거절해서 클라이언트가 잠시 후 다시 보내게 함
+            self.send_json(503, {"error": "queue is full"}, [("Retry-After", "1")])
+            return
+        self.send_json(200, report)
+
+    def log_message(self, format, *args) -> None:
+        # 요청마다 run_job()이 한 줄씩 출력하므로 기본 접근 로그는 출력하지 않음
+        pass
+
+
+def main() -> int:
+    host = default_host
+    port = default_port
+    num_workers = default_workers
+    queue_size = default_queue_size
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hH:p:j:Q:")
+    except getopt.GetoptError:
+        print_usage()
+        sys.stderr.write("Error: invaild option definition\n")
+        return -1
+    for o, a in opts:
+        if o == "-H":
+            host = a
+        elif o == "-p":
+            port = int(a)
+        elif o == "-j":
+            num_workers = max(1, int(a))
+        elif o == "-Q":
+            queue_size = max(1, int(a))
+        else:
+            print_usage()
+            return -1
+
+    server = SplitServer((host, port), num_workers, queue_size)
+    print("listening on http://%s:%d/ with %d workers" % (host, server.server_address[1], num_workers))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.executor.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
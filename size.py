@@ -1,18 +1,139 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
 import sys
+import csv
+import json
+import getopt
+import concurrent.futures
 from PIL import Image
+from typing import Any, Dict, Iterator, List, Optional
+import split
+
+
+Image.MAX_IMAGE_PIXELS = None
+default_probe_workers = 16 # 동시에 헤더를 읽는 스레드의 갯수 (디코딩하지 않으므로 대부분 I/O 대기)
+probe_chunk_size = 1024 # 한 번에 스레드 풀에 넣는 파일의 갯수 (결과는 입력 순서대로 출력함)
+output_formats = ("text", "csv", "json")
+fields = ["path", "width", "height", "format", "mode", "bytes", "webp_width", "webp_height", "webp_downscale", "min_units", "error"]
 
 
 def print_usage():
-	print("Usage: %s imagefile" % (sys.argv[0]))
-	
-			
-def main():
-	im = Image.open(sys.argv[1])
-	print("%d %d %s" % (im.size[0], im.size[1], im.format))
-
-        
+	print("Usage: %s [-f text|csv|json] [-j <workers>] imagefile|directory..." % (sys.argv[0]))
+	print("\t-f <format>: output format (default text)")
+	print("\t-j <workers>: number of files probed concurrently (default %d)" % (default_probe_workers))
+	print("\tdirectories are scanned recursively for image files (pieces saved by split.py are skipped)")
+	print("\tonly the headers are read; webp_downscale marks images beyond the recommended WebP size (see split.py --fit-webp)")
+	print("\tand min_units is the smallest '-n' whose nominal pieces fit in the WebP limits")
+
+
+def iterate_image_files(args) -> Iterator[str]:
+    # 파일은 그대로, 디렉토리는 하위 디렉토리까지 이미지 파일을 찾아서 반환함
+    for arg in args:
+        if not os.path.isdir(arg):
+            yield arg
+            continue
+        for (dir_path, dir_names, file_names) in os.walk(arg):
+            dir_names.sort()
+            for name in sorted(file_names):
+                path = os.path.join(dir_path, name)
+                if os.path.splitext(name)[1].lower() in split.image_extensions and not split.is_split_piece(path):
+                    yield path
+
+
+def get_min_units(width, height) -> Optional[int]:
+    # split.py가 자르는 방향으로 나눠서 조각이 WebP 제한 안에 들어가는 최소한의 조각 갯수 (불가능하면 None)
+    (length, breadth) = (width, height) if width > height else (height, width)
+    if breadth > split.WEBP_MAX_DIMENSION:
+        return None
+    unit_length = min(split.WEBP_MAX_DIMENSION, split.WEBP_MAX_PIXELS // breadth)
+    return -(-length // unit_length)
+
+
+def probe_image(path) -> Dict[str, Any]:
+    # 픽셀은 디코딩하지 않고 헤더만 읽어서 크기, 포맷, 모드를 알아냄
+    result: Dict[str, Any] = dict.fromkeys(fields)
+    result["path"] = path
+    try:
+        result["bytes"] = os.path.getsize(path)
+        with Image.open(path) as im:
+            (width, height) = im.size
+            result.update(width=width, height=height, format=im.format, mode=im.mode)
+    except Exception as e:
+        result["error"] = str(e)
+        return result
+    (webp_width, webp_height) = split.get_webp_size(width, height)
+    result.update(webp_width=webp_width, webp_height=webp_height, webp_downscale=(webp_width, webp_height) != (width, height),
+                  min_units=get_min_units(width, height))
+    return result
+
+
+def probe_images(paths, num_workers) -> Iterator[Dict[str, Any]]:
+    # 파일들의 헤더를 스레드 풀에서 동시에 읽되, 결과는 입력 순서대로 반환함
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        chunk: List[str] = []
+        for path in paths:
+            chunk.append(path)
+            if len(chunk) >= probe_chunk_size:
+                yield from executor.map(probe_image, chunk)
+                chunk = []
+        yield from executor.map(probe_image, chunk)
+
+
+def format_text(result, with_path) -> str:
+    if result["error"] is not None:
+        return "%s: %s" % (result["path"], result["error"])
+    line = "%d %d %s" % (result["width"], result["height"], result["format"])
+    if with_path:
+        line = "%s %s %s %d" % (result["path"], line, result["mode"], result["bytes"])
+        if result["webp_downscale"]:
+            line += " webp_downscale=%dx%d" % (result["webp_width"], result["webp_height"])
+    return line
+
+
+def main() -> int:
+    output_format = "text"
+    num_workers = default_probe_workers
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hf:j:")
+    except getopt.GetoptError:
+        print_usage()
+        sys.stderr.write("Error: invaild option definition\n")
+        return -1
+    for o, a in opts:
+        if o == "-f" and a.lower() in output_formats:
+            output_format = a.lower()
+        elif o == "-j":
+            num_workers = max(1, int(a))
+        else:
+            print_usage()
+            return -1
+    if len(args) < 1:
+        print_usage()
+        return -1
+
+    # 파일 하나만 주면 예전처럼 "너비 높이 포맷"만 출력함
+    with_path = len(args) > 1 or os.path.isdir(args[0])
+    num_failed = 0
+    writer = csv.DictWriter(sys.stdout, fieldnames=fields)
+    if output_format == "csv":
+        writer.writeheader()
+    elif output_format == "json":
+        sys.stdout.write("[")
+    for (i, result) in enumerate(probe_images(iterate_image_files(args), num_workers)):
+        if result["error"] is not None:
+            num_failed += 1
+        if output_format == "csv":
+            writer.writerow(result)
+        elif output_format == "json":
+            sys.stdout.write("%s\n%s" % ("," if i > 0 else "", json.dumps(result)))
+        else:
+            print(format_text(result, with_path))
+    if output_format == "json":
+        sys.stdout.write("\n]\n")
+    return 0 if num_failed == 0 else -1
+
+
 if __name__ == "__main__":
-	main()
+	sys.exit(main())
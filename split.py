@@ -3,11 +3,25 @@
 
 import os
 import sys
+import io
+import glob
+import hashlib
+import json
+import time
+import zlib
+import struct
 import getopt
-from PIL import Image
-import operator
+import zipfile
+import threading
+import contextlib
+import concurrent.futures
+from dataclasses import dataclass, field, replace
+from PIL import Image, ImageChops
+import numpy
+from collections import OrderedDict, deque
+from bisect import bisect_right
 from math import pow
-from typing import Tuple, List, Dict, Optional
+from typing import Any, Deque, Iterator, Tuple, List, Dict, Optional
 
 
 Image.MAX_IMAGE_PIXELS = None
@@ -18,22 +32,180 @@ default_diff_threshold = 0.05 # 5%, 띠를 구성하는 픽셀들의 불일치 
 default_size_threshold = 0 # 0 pixel, 분할 대상으로 간주할 최소한의 크기
 default_acceptable_diff_of_color_value = 1
 default_quality = 90
+default_dominant_samples = 100 # dominant, fuzzy 배경색을 정할 때 가로, 세로 각각 표본을 뽑는 갯수 (0이면 모든 픽셀)
+default_save_workers = min(4, os.cpu_count() or 1) # 조각을 동시에 인코딩하고 저장하는 스레드의 갯수
+profile_chunk_pixels = 4000000 # 불일치 프로파일 계산 시 한 번에 배열로 변환할 픽셀 수
+sample_reject_ratio = 0.25 # 불일치 픽셀이 이 비율 이상인 줄은 표본만으로 걸러낼 수 있도록 표본 간격을 정함
+max_sample_stride = 16 # 표본 픽셀의 최대 간격
+min_sample_reject_ratio = 0.5 # 표본으로 걸러낸 줄이 이 비율보다 적으면 다음 묶음은 표본 없이 계산함
+sample_run_gap = 16 # 표본을 통과한 줄 사이의 간격이 이보다 좁으면 그 사이의 줄도 함께 계산함
+native_modes = ("L", "P") # RGB로 변환하지 않고 원래 모드 그대로 띠를 찾고 자르는 이미지 모드 (흑백 스캔, 팔레트 이미지)
 
 # WebP 최적화 상수
 WEBP_MAX_DIMENSION = 8000  # WebP 권장 최대 크기
 WEBP_MAX_PIXELS = 32000000  # 32MP (약 8000x4000)
 WEBP_MEMORY_MULTIPLIER = 8  # WebP 인코딩에 필요한 메모리 배수
 
+# 메모리 추정 상수 (--memory-limit)
+profile_bytes_per_pixel = 16 # 불일치 프로파일 계산 중 행 묶음의 픽셀당 메모리 (잘라낸 영역, 거리 이미지, 마스크)
+image_bytes_per_pixel = {"1": 1, "L": 1, "P": 1, "I;16": 2, "LA": 4, "PA": 4, "RGB": 4, "RGBA": 4, "RGBX": 4, "CMYK": 4, "YCbCr": 4, "I": 4, "F": 4} # Pillow가 메모리에 저장하는 픽셀당 바이트 수 (RGB도 4바이트)
+
+# 스트리밍 모드 상수
+default_memory_budget = 256 # MB, 스트리밍 모드에서 디코딩된 띠를 보관하는 데 쓸 메모리 크기
+strip_cache_size = 4 # 스트리밍 모드에서 캐싱하는 띠의 갯수
+raw_bytes_per_pixel = {"RGB": 3, "BGR": 3, "RGBX": 4, "RGBA": 4, "BGRX": 4, "BGRA": 4, "L": 1, "P": 1, "LA": 2}
+png_stream_modes = {"L": 1, "LA": 2, "RGB": 3, "RGBA": 4, "P": 1} # 스트리밍 모드에서 행 단위로 디코딩하는 8비트 PNG의 모드와 픽셀당 바이트 수
+png_read_size = 16384 # 스트리밍 모드에서 PNG의 IDAT를 한 번에 읽는 크기
+
+# 자르는 위치 캐시 상수
+default_cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "cartoonsplit")
+default_cache_size = 16 # MB, 캐시 디렉토리의 최대 크기 (넘으면 오래 사용하지 않은 항목부터 지움)
+cache_version = 1 # 캐시 항목의 형식이나 띠 탐색 결과가 바뀌면 올림
+
+# 이어서 자르기 상수
+manifest_suffix = ".split.json" # --incremental에서 자른 위치와 조각을 기록하는 파일 (name.split.json)
+manifest_version = 1 # 기록 형식이나 띠 탐색 결과가 바뀌면 올림
+
+# 조각 저장 상수
+default_output_preset = "balanced"
+output_presets: Dict[str, Dict[str, Dict[str, Any]]] = { # 포맷별 인코더 옵션 (balanced는 Pillow의 기본값)
+    "fast": {"PNG": {"compress_level": 1}, "WEBP": {"method": 0}},
+    "balanced": {},
+    "small": {"JPEG": {"optimize": True, "progressive": True}, "PNG": {"optimize": True}, "WEBP": {"method": 6}, "GIF": {"optimize": True}},
+}
+output_format_limits = { # 포맷별 최대 가로, 세로 크기와 저장할 수 있는 모드 (None이면 Pillow가 변환해서 저장함)
+    "JPEG": (65535, {"1", "L", "RGB", "RGBX", "CMYK", "YCbCr"}),
+    "WEBP": (16383, None),
+    "GIF": (65535, None),
+    "PNG": (None, {"1", "L", "LA", "I", "I;16", "P", "RGB", "RGBA"}),
+    "BMP": (None, {"1", "L", "P", "RGB", "RGBA"}),
+    "PPM": (None, {"1", "L", "I", "RGB"}),
+}
+
+# 압축 파일 출력 상수
+compressed_signatures = (b"\xff\xd8\xff", b"\x89PNG", b"GIF8", b"RIFF") # 이미 압축된 조각 포맷 (JPEG, PNG, GIF, WebP)의 시작 바이트
+
+# 일괄 처리 상수
+image_extensions = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff", ".ppm"} # 일괄 처리 시 디렉토리에서 찾을 이미지 확장자
+
+
+class Tracer:
+    # --profile, --trace에서 단계별 소요 시간과 검사한 픽셀 수, 띠 검사 횟수 등을 기록함
+    # 단계는 중첩될 수 있고, count()는 현재 스레드에서 가장 안쪽에 열린 단계에 더함
+    def __init__(self) -> None:
+        self.start_time = time.perf_counter()
+        self.events: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def get_stack(self) -> List[Dict[str, Any]]:
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    @contextlib.contextmanager
+    def stage(self, name, **fields) -> Iterator[Dict[str, Any]]:
+        stack = self.get_stack()
+        event = dict(stage=name, depth=len(stack), start=time.perf_counter() - self.start_time, **fields)
+        stack.append(event)
+        try:
+            yield event
+        except BaseException:
+            event["failed"] = True
+            raise
+        finally:
+            event["elapsed"] = time.perf_counter() - self.start_time - event["start"]
+            stack.pop()
+            with self.lock:
+                self.events.append(event)
+
+    def count(self, name, value=1) -> None:
+        stack = self.get_stack()
+        if stack:
+            stack[-1][name] = stack[-1].get(name, 0) + value
+
+    def get_summary(self) -> Dict[str, Dict[str, Any]]:
+        # 단계 이름별로 횟수, 소요 시간, 카운터를 합침
+        summary: Dict[str, Dict[str, Any]] = {}
+        with self.lock:
+            events = list(self.events)
+        for event in events:
+            total = summary.setdefault(event["stage"], {"count": 0, "elapsed": 0.0})
+            total["count"] += 1
+            for (key, value) in event.items():
+                if key in ("elapsed", "pixels", "checks", "scanned", "bytes"):
+                    total[key] = total.get(key, 0) + value
+        return summary
+
+    def get_trace(self) -> Dict[str, Any]:
+        with self.lock:
+            events = sorted(self.events, key=lambda event: event["start"])
+        return {"elapsed": time.perf_counter() - self.start_time, "events": events, "summary": self.get_summary()}
+
+
+class NullTracer(Tracer):
+    # 추적하지 않을 때 쓰는 Tracer (시간을 재거나 기록하지 않음)
+    @contextlib.contextmanager
+    def stage(self, name, **fields) -> Iterator[Dict[str, Any]]:
+        yield {}
+
+    def count(self, name, value=1) -> None:
+        pass
+
+
+no_trace = NullTracer()
+
+
+def get_mode_colors(im) -> numpy.ndarray:
+    # L, P 모드 이미지의 픽셀 값 0~255를 각각 RGB로 변환했을 때의 색 (256, 3) (Pillow의 convert("RGB")와 같은 결과)
+    ramp = Image.frombytes(im.mode, (256, 1), bytes(range(256)))
+    if im.mode == "P":
+        ramp.putpalette(im.getpalette())
+    return numpy.asarray(ramp.convert("RGB"))[0]
+
+
+def get_rgb_pixels(region, pixels=None) -> numpy.ndarray:
+    # region의 픽셀 배열 (pixels가 주어지면 region에서 뽑은 픽셀 배열)을 (..., 3) 형태의 RGB 배열로 반환함
+    if pixels is None:
+        pixels = numpy.asarray(region)
+    if region.mode in native_modes:
+        return get_mode_colors(region)[pixels]
+    return pixels
+
+
+def get_black_index(im) -> int:
+    # P 이미지의 팔레트에서 검은색의 번호 (없으면 팔레트 끝에 추가하고, 팔레트가 가득 차면 검은색에 가장 가까운 색)
+    palette = im.getpalette() or []
+    colors = numpy.array(palette, dtype=numpy.int64).reshape(-1, 3)
+    black = numpy.flatnonzero(~colors.any(axis=1))
+    if len(black) > 0:
+        return int(black[0])
+    if len(colors) < 256:
+        im.putpalette(palette + [0, 0, 0])
+        return len(colors)
+    return int(numpy.argmin((colors * colors).sum(axis=1)))
+
+
+def crop_piece(im, box) -> Image.Image:
+    # 조각의 영역을 잘라냄 (기본 자르는 위치를 쓴 다음 조각은 x0 = -1처럼 이미지 밖을 포함할 수 있음)
+    # Pillow는 이미지 밖을 0으로 채우는데, P 이미지에서는 팔레트 0번 색이 되므로 RGB로 자를 때처럼 검은색으로 채움
+    piece = im.crop(box)
+    (x0, y0, x1, y1) = box
+    (width, height) = im.size
+    if piece.mode != "P" or (x0 >= 0 and y0 >= 0 and x1 <= width and y1 <= height):
+        return piece
+    piece.paste(get_black_index(piece), (0, 0) + piece.size)
+    inner = (max(x0, 0), max(y0, 0), min(x1, width), min(y1, height))
+    if inner[0] < inner[2] and inner[1] < inner[3]:
+        piece.paste(im.crop(inner), (inner[0] - x0, inner[1] - y0))
+    return piece
+
 
 def sumup_pixels_in_box(im, sum_pixel, pixel_count, x1, y1, bandwidth) -> Tuple[List[int], int]:
-    for i in range(x1, x1 + bandwidth):
-        for j in range(y1, y1 + bandwidth):
-            pixel = im.getpixel((i, j))
-            sum_pixel[0] += pixel[0]
-            sum_pixel[1] += pixel[1]
-            sum_pixel[2] += pixel[2]
-            pixel_count += 1
-    return sum_pixel, pixel_count
+    pixels = get_rgb_pixels(im.crop((x1, y1, x1 + bandwidth, y1 + bandwidth))).reshape(-1, 3)
+    channel_sums = pixels.sum(axis=0, dtype=numpy.int64)
+    sum_pixel = [sum_pixel[0] + int(channel_sums[0]), sum_pixel[1] + int(channel_sums[1]), sum_pixel[2] + int(channel_sums[2])]
+    return sum_pixel, pixel_count + len(pixels)
         
 
 def determine_bgcolor(im, bandwidth) -> Tuple[int, int, int]:
@@ -47,18 +219,25 @@ def determine_bgcolor(im, bandwidth) -> Tuple[int, int, int]:
     return int(sum_pixel[0] / pixel_count), int(sum_pixel[1] / pixel_count), int(sum_pixel[2] / pixel_count)
 
 
-def determine_dominant_color(im) -> Tuple[int, int, int]:
+def determine_dominant_color(im, num_samples=default_dominant_samples) -> Tuple[int, int, int]:
+    # 가로, 세로 각각 num_samples 개 간격의 격자에서 (0이면 모든 픽셀에서) 가장 많이 나타나는 색상
     (width, height) = im.size
-    color_counter: Dict[Tuple[int, int, int], int] = {}
-    for i in range(0, width, max(int(width / 100), 1)):
-        for j in range(0, height, max(int(height / 100), 1)):
-            color = im.getpixel((i, j))
-            if color in color_counter:
-                color_counter[color] = color_counter[color] + 1
-            else:
-                color_counter[color] = 1
-                sorted_counter = sorted(iter(color_counter.items()), key=operator.itemgetter(1))
-    return sorted_counter[-1][0]
+    (step_x, step_y) = (1, 1)
+    if num_samples > 0:
+        (step_x, step_y) = (max(int(width / num_samples), 1), max(int(height / num_samples), 1))
+    colors: List[numpy.ndarray] = []
+    counts: List[numpy.ndarray] = []
+    # 행 묶음 단위로 표본을 뽑아서 RGB를 24비트 정수로 합친 뒤 색상별 갯수를 셈
+    chunk_height = max(step_y, int(profile_chunk_pixels / max(width, 1)) // step_y * step_y)
+    for y in range(0, height, chunk_height):
+        region = im.crop((0, y, width, min(height, y + chunk_height)))
+        pixels = get_rgb_pixels(region, numpy.asarray(region)[::step_y, ::step_x]).reshape(-1, 3).astype(numpy.uint32)
+        chunk_colors, chunk_counts = numpy.unique((pixels[:, 0] << 16) | (pixels[:, 1] << 8) | pixels[:, 2], return_counts=True)
+        colors.append(chunk_colors)
+        counts.append(chunk_counts)
+    all_colors, inverse = numpy.unique(numpy.concatenate(colors), return_inverse=True)
+    color = int(all_colors[numpy.argmax(numpy.bincount(inverse, weights=numpy.concatenate(counts)))])
+    return (color >> 16, (color >> 8) & 255, color & 255)
 
 
 def get_euclidean_distance(a, b) -> float:
@@ -83,96 +262,614 @@ def get_color_distance(color_a, color_b, is_fuzzy) -> float:
     return distance
 
 
-def check_horizontal_band(im, x1, y1, bandwidth, bgcolor, margin, diff_threshold, acceptable_diff_of_color_value, is_fuzzy) -> Tuple[bool, int]:
-    #print "check_horizontal_band(%d, %d)" % (x1, y1)
-    (width, height) = im.size
-    for j in range(y1, y1 + bandwidth):
-        if j >= height:
-            return (False, j - y1 + 1)
-        diff_count = 0
-        for i in range(x1 + margin, x1 + width - margin):
-            pixel = im.getpixel((i, j))
-            #print (i, j), pixel
-            # 배경색과 불일치할 때 색상이 크게 차이나지 않으면 무시함
-            if bgcolor == (-1, -1, -1):
-                # blackorwhite
-                if pixel == (0, 0, 0) or pixel == (255, 255, 255):
-                    is_same = True
-                else:
-                    is_same = False
-            else:
-                # specific color
-                if pixel == bgcolor:
-                    is_same = True
-                else:
-                    is_same = False
-            if not is_same:
-                distance = get_color_distance(pixel, bgcolor, is_fuzzy)
-                if distance > 3 * pow(acceptable_diff_of_color_value, 2):
-                    diff_count += 1
-                    #print "y1=%d, diff_count=%d, converted_threshold=%f" % (y1, diff_count, (width - 2 * margin) * diff_threshold)
-                    # threshold 미만으로 불일치가 존재하면 false 반환
-                    if diff_count > (width - 2 * margin) * diff_threshold:
-                        return (False, j - y1 + 1)
-    return (True, 0)
-
-
-def check_vertical_band(im, x1, y1, bandwidth, bgcolor, margin, diff_threshold, acceptable_diff_of_color_value, is_fuzzy) -> Tuple[bool, int]:
-    #print("check_vertical_band(%d, %d)" % (x1, y1))
+def get_color_distance_array(pixels, bgcolor, is_fuzzy) -> numpy.ndarray:
+    # get_color_distance()를 (..., 3) 형태의 픽셀 배열에 일괄 적용
+    pixels = pixels.astype(numpy.int32)
+    if bgcolor == (-1, -1, -1) or is_fuzzy:
+        distance_white = ((pixels - 255) ** 2).sum(axis=-1)
+        distance_black = (pixels ** 2).sum(axis=-1)
+    if bgcolor == (-1, -1, -1):
+        # blackorwhite: get_color_distance()와 동일하게 (g + g + b) / 3 < 128 이면 검은색 기준
+        shade_of_pixels = pixels[..., 1] + pixels[..., 1] + pixels[..., 2]
+        distance = numpy.where(shade_of_pixels < 384, distance_black, distance_white)
+    else:
+        distance = ((pixels - numpy.array(bgcolor, dtype=numpy.int32)) ** 2).sum(axis=-1)
+    if is_fuzzy == True:
+        distance = numpy.minimum(distance, numpy.minimum(distance_white, distance_black))
+    return distance
+
+
+def get_distance_image(region, color, saturation) -> Image.Image:
+    # 채널별 거리 제곱을 saturation에서 포화시킨 뒤 합산한 거리 이미지 (합산 결과는 255에서 포화됨)
+    lut: List[int] = []
+    for c in color:
+        lut.extend(min((v - c) * (v - c), saturation) for v in range(256))
+    return region.point(lut).convert("L", (1, 1, 1, 0))
+
+
+def get_mismatch_mask(region, bgcolor, is_fuzzy, color_threshold) -> numpy.ndarray:
+    # 각 픽셀의 get_color_distance()가 color_threshold를 넘는지 여부
+    if region.mode in native_modes:
+        # L, P 모드는 픽셀 값 256개의 불일치 여부를 먼저 계산하고 픽셀 값으로 찾음
+        return (get_color_distance_array(get_mode_colors(region), bgcolor, is_fuzzy) > color_threshold)[numpy.asarray(region)]
+    if color_threshold >= 255:
+        # 8비트 거리 이미지로 비교할 수 없는 큰 허용치는 정수 배열로 계산함
+        return get_color_distance_array(numpy.asarray(region), bgcolor, is_fuzzy) > color_threshold
+    # 채널별 값이 color_threshold + 1에서 포화되어도 color_threshold와의 대소 관계는 유지됨
+    saturation = int(color_threshold) + 1
+    if bgcolor == (-1, -1, -1) or is_fuzzy:
+        distance_white = get_distance_image(region, (255, 255, 255), saturation)
+        distance_black = get_distance_image(region, (0, 0, 0), saturation)
+    if bgcolor == (-1, -1, -1):
+        # blackorwhite: get_color_distance()와 동일하게 (g + g + b) / 3 < 128 이면 검은색 기준
+        green = numpy.asarray(region.getchannel(1)).astype(numpy.uint16)
+        blue = numpy.asarray(region.getchannel(2))
+        distance = numpy.where(green + green + blue < 384, numpy.asarray(distance_black), numpy.asarray(distance_white))
+        if is_fuzzy == True:
+            distance = numpy.minimum(distance, numpy.minimum(numpy.asarray(distance_white), numpy.asarray(distance_black)))
+        return distance > color_threshold
+    distance_image = get_distance_image(region, bgcolor, saturation)
+    if is_fuzzy == True:
+        distance_image = ImageChops.darker(distance_image, ImageChops.darker(distance_white, distance_black))
+    return numpy.asarray(distance_image) > color_threshold
+
+
+def count_mismatches(im, box, orientation, bgcolor, is_fuzzy, color_threshold, stride=1) -> Tuple[numpy.ndarray, int]:
+    # box 안에서 세로 이미지는 행마다, 가로 이미지는 열마다 배경색과 불일치하는 픽셀 수와 검사한 픽셀 수를 계산
+    # stride가 1보다 크면 반대 방향으로 stride 간격의 표본 픽셀만 셈 (실제 불일치 픽셀 수의 하한)
+    (x0, y0, x1, y1) = box
+    if stride > 1:
+        if orientation == "vertical":
+            size = (-(-(x1 - x0) // stride), y1 - y0)
+        else:
+            size = (x1 - x0, -(-(y1 - y0) // stride))
+        if isinstance(im, Image.Image):
+            region = im.resize(size, Image.Resampling.NEAREST, box=box)
+        else:
+            region = im.crop(box).resize(size, Image.Resampling.NEAREST)
+    else:
+        region = im.crop(box)
+    mismatch = get_mismatch_mask(region, bgcolor, is_fuzzy, color_threshold)
+    return (numpy.count_nonzero(mismatch, axis=1 if orientation == "vertical" else 0), mismatch.size)
+
+
+def get_sample_stride(span, reject_limit) -> int:
+    # 불일치 픽셀이 sample_reject_ratio 이상인 줄은 표본에서도 reject_limit을 넘도록 표본 간격을 정함
+    return max(1, min(max_sample_stride, int(span * sample_reject_ratio / (reject_limit + 1))))
+
+
+def get_sample_passed_runs(is_rejected) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    # 표본으로 걸러내지 못한 줄들의 구간 (간격이 sample_run_gap보다 좁은 구간은 합침)
+    (starts, ends) = get_runs(~is_rejected)
+    if len(starts) > 1:
+        is_separate = starts[1:] - ends[:-1] >= sample_run_gap
+        (starts, ends) = (starts[numpy.concatenate(([True], is_separate))], ends[numpy.concatenate((is_separate, [True]))])
+    return (starts, ends)
+
+
+def get_rows_profile(im, box, bgcolor, is_fuzzy, color_threshold, stride, reject_limit) -> Tuple[numpy.ndarray, bool, int]:
+    # 세로 이미지에서 행 묶음 하나의 불일치 프로파일, 다음 묶음에서 표본을 쓸지 여부, 검사한 픽셀 수
+    # stride가 1보다 크면 표본만으로 reject_limit을 넘는 것이 확실한 행은 표본의 불일치 수를 쓰고 나머지 행만 모든 픽셀을 검사함
+    (x0, y0, x1, y1) = box
+    (profile, num_pixels) = count_mismatches(im, box, "vertical", bgcolor, is_fuzzy, color_threshold, stride)
+    if stride <= 1:
+        return (profile, True, num_pixels)
+    is_rejected = profile > reject_limit
+    for (a, b) in zip(*get_sample_passed_runs(is_rejected)):
+        (profile[a:b], run_pixels) = count_mismatches(im, (x0, y0 + a, x1, y0 + b), "vertical", bgcolor, is_fuzzy, color_threshold)
+        num_pixels += run_pixels
+    # 불일치 줄이 드문 구간에서는 표본 검사가 낭비이므로 다음 묶음은 표본 없이 계산함
+    return (profile, bool(numpy.count_nonzero(is_rejected) >= min_sample_reject_ratio * len(is_rejected)), num_pixels)
+
+
+def get_mismatch_profile(im, orientation, bgcolor, margin, acceptable_diff_of_color_value, is_fuzzy, trace=no_trace, reject_limit=None) -> numpy.ndarray:
+    # 세로 이미지는 행마다, 가로 이미지는 열마다 margin을 제외하고 배경색과 불일치하는 픽셀 수를 계산
+    # reject_limit이 주어지면 표본 픽셀만으로 불일치 픽셀이 reject_limit을 넘는 것이 확실한 줄은 표본의 불일치 수를 그대로 쓰고
+    # 나머지 줄만 모든 픽셀을 검사함 (reject_limit 이하의 값과 비교한 결과는 정확히 계산한 경우와 같음)
     (width, height) = im.size
-    for i in range(x1, x1 + bandwidth):
-        if i >= width:
-            return (False, i - x1 + 1)
-        diff_count = 0
-        for j in range(y1 + margin, y1 + height - margin):
-            pixel = im.getpixel((i, j))
-            #print (i, j), pixel
-            # 배경색과 불일치할 때 색상이 크게 차이나지 않으면 무시함
-            if bgcolor == (-1, -1, -1):
-                # blackorwhite
-                if pixel == (0, 0, 0) or pixel == (255, 255, 255):
-                    is_same = True
-                else:
-                    is_same = False
-            else:
-                # specific color
-                if pixel == bgcolor:
-                    is_same = True
-                else:
-                    is_same = False
-            if not is_same:
-                distance = get_color_distance(pixel, bgcolor, is_fuzzy)
-                if distance > 3 * pow(acceptable_diff_of_color_value, 2):
-                    diff_count += 1
-                    #print("x1=%d, distance=%d, diff_count=%d, converted_threshold=%f" % (x1, distance, diff_count, (height - 2 * margin) * diff_threshold))
-                    # threshold 미만으로 불일치가 존재하면 false 반환
-                    if diff_count > (height - 2 * margin) * diff_threshold:
-                        return (False, i - x1 + 1)
-    return (True, 0)
-
-
-def find_bgcolor_band(im, bgcolor, orientation, bandwidth, x1, y1, margin, diff_threshold, acceptable_diff_of_color_value, is_fuzzy) -> Tuple[int, int]:
-    print("find_bgcolor_band(bgcolor=%s, orientation=%s, bandwidth=%d, x1=%d, y1=%d, diff_threshold=%f, is_fuzzy=%s)" % (bgcolor, orientation, bandwidth, x1, y1, diff_threshold, is_fuzzy))
+    color_threshold = 3 * pow(acceptable_diff_of_color_value, 2)
+    if orientation == "vertical":
+        profile = numpy.zeros(height, dtype=numpy.int64)
+        (col_start, col_end) = (margin, width - margin)
+        if col_start >= col_end:
+            return profile
+        stride = get_sample_stride(col_end - col_start, reject_limit) if reject_limit is not None else 1
+    else:
+        profile = numpy.zeros(width, dtype=numpy.int64)
+        (col_start, col_end) = (0, width)
+        stride = get_sample_stride(height - 2 * margin, reject_limit) if reject_limit is not None else 1
+    # 이미지 전체를 한꺼번에 배열로 바꾸지 않고 행 묶음 단위로 처리함
+    chunk_height = max(1, int(profile_chunk_pixels / max(width, 1)))
+    chunks = []
+    for y in range(0, height, chunk_height):
+        (row_start, row_end) = (y, min(height, y + chunk_height))
+        if orientation == "horizontal":
+            (row_start, row_end) = (max(row_start, margin), min(row_end, height - margin))
+            if row_start >= row_end:
+                continue
+        chunks.append((row_start, row_end))
+    num_pixels = 0
+    if orientation == "vertical":
+        do_sample = True
+        for (row_start, row_end) in chunks:
+            (profile[row_start:row_end], do_sample, chunk_pixels) = get_rows_profile(im, (col_start, row_start, col_end, row_end), bgcolor, is_fuzzy, color_threshold, stride if do_sample else 1, reject_limit)
+            num_pixels += chunk_pixels
+    else:
+        boxes = [(col_start, row_start, col_end, row_end) for (row_start, row_end) in chunks]
+        if stride > 1:
+            # 가로 이미지는 모든 행 묶음의 표본을 합친 뒤, 걸러내지 못한 열만 다시 모든 행에서 계산함
+            for box in boxes:
+                (counts, box_pixels) = count_mismatches(im, box, orientation, bgcolor, is_fuzzy, color_threshold, stride)
+                profile += counts
+                num_pixels += box_pixels
+            runs = list(zip(*get_sample_passed_runs(profile > reject_limit)))
+            for (a, b) in runs:
+                profile[a:b] = 0
+            boxes = [(a, row_start, b, row_end) for (row_start, row_end) in chunks for (a, b) in runs]
+        for box in boxes:
+            (counts, box_pixels) = count_mismatches(im, box, orientation, bgcolor, is_fuzzy, color_threshold)
+            profile[box[0]:box[2]] += counts
+            num_pixels += box_pixels
+    trace.count("pixels", num_pixels)
+    return profile
+
+
+def get_diff_limit(im, orientation, margin, diff_threshold) -> float:
+    # 한 줄에서 허용되는 불일치 픽셀 수
     (width, height) = im.size
     if orientation == "vertical":
-        # 세로 이미지인 경우
-        i = 0
-        while y1 + i < height:
-            # 가로 띠가 배경색으로만 구성되었는지 확인
-            (flag, offset) = check_horizontal_band(im, x1, y1 + i, bandwidth, bgcolor, margin, diff_threshold, acceptable_diff_of_color_value, is_fuzzy)
-            if flag:
-                return (x1, int(y1 + i + bandwidth / 2))
-            i += offset
-    elif orientation == "horizontal":
-        # 가로 이미지인 경우
-        i = 0
-        while x1 + i < width:
-            # 세로 띠가 배경색으로만 구성되었는지 확인
-            (flag, offset) = check_vertical_band(im, x1 + i, y1, bandwidth, bgcolor, margin, diff_threshold, acceptable_diff_of_color_value, is_fuzzy)
-            if flag:
-                return (int(x1 + i + bandwidth / 2), y1)
-            i += offset
-    return (-1, -1)
+        return (width - 2 * margin) * diff_threshold
+    return (height - 2 * margin) * diff_threshold
+
+
+def get_band_index(profile, bandwidth, diff_limit) -> numpy.ndarray:
+    # 각 위치 p에 대해, p 이후 처음으로 [s, s + bandwidth)가 모두 배경색인 띠의 시작 위치 s (없으면 len(profile))
+    length = len(profile)
+    # threshold 초과로 불일치가 존재하는 줄의 누적 개수
+    bad_prefix = numpy.zeros(length + 1, dtype=numpy.int64)
+    numpy.cumsum(profile > max(diff_limit, 0), out=bad_prefix[1:])
+    band_index = numpy.full(length + 1, length, dtype=numpy.int64)
+    num_starts = length - bandwidth + 1 if bandwidth > 0 else length
+    if num_starts > 0:
+        # [s, s + bandwidth) 구간에 불일치 줄이 없는 시작 위치들
+        is_band = bad_prefix[bandwidth:bandwidth + num_starts] == bad_prefix[:num_starts]
+        starts = numpy.where(is_band, numpy.arange(num_starts), length)
+        band_index[:num_starts] = numpy.minimum.accumulate(starts[::-1])[::-1]
+    return band_index
+
+
+def check_horizontal_band(band_index, y1) -> Tuple[bool, int]:
+    #print "check_horizontal_band(%d)" % (y1)
+    # y1에서 시작하는 띠가 아니면 다음 띠 후보까지의 거리를 반환
+    next_y = band_index[y1]
+    if next_y == y1:
+        return (True, 0)
+    return (False, int(next_y - y1))
+
+
+def check_vertical_band(band_index, x1) -> Tuple[bool, int]:
+    #print("check_vertical_band(%d)" % (x1))
+    # x1에서 시작하는 띠가 아니면 다음 띠 후보까지의 거리를 반환
+    next_x = band_index[x1]
+    if next_x == x1:
+        return (True, 0)
+    return (False, int(next_x - x1))
+
+
+def find_bgcolor_band(im, bgcolor, orientation, bandwidth, x1, y1, margin, diff_threshold, acceptable_diff_of_color_value, is_fuzzy, band_index=None, log=print, trace=no_trace, origin=0) -> Tuple[int, int]:
+    # origin은 메시지에 출력할 때 y 좌표에 더하는 값 (이미지의 아랫부분만 잘라서 찾을 때 전체 이미지의 좌표로 출력함)
+    log("find_bgcolor_band(bgcolor=%s, orientation=%s, bandwidth=%d, x1=%d, y1=%d, diff_threshold=%f, is_fuzzy=%s)" % (bgcolor, orientation, bandwidth, x1, y1 + origin, diff_threshold, is_fuzzy))
+    (width, height) = im.size
+    if band_index is None:
+        diff_limit = get_diff_limit(im, orientation, margin, diff_threshold)
+        profile = get_mismatch_profile(im, orientation, bgcolor, margin, acceptable_diff_of_color_value, is_fuzzy, trace, int(max(diff_limit, 0)))
+        band_index = get_band_index(profile, bandwidth, diff_limit)
+    # 띠를 검사한 횟수와 띠를 찾을 때까지 건너뛴 줄 수를 기록함
+    (i, num_checks) = (0, 0)
+    try:
+        if orientation == "vertical":
+            # 세로 이미지인 경우
+            while y1 + i < height:
+                # 가로 띠가 배경색으로만 구성되었는지 확인
+                num_checks += 1
+                (flag, offset) = check_horizontal_band(band_index, y1 + i)
+                if flag:
+                    return (x1, int(y1 + i + bandwidth / 2))
+                i += offset
+        elif orientation == "horizontal":
+            # 가로 이미지인 경우
+            while x1 + i < width:
+                # 세로 띠가 배경색으로만 구성되었는지 확인
+                num_checks += 1
+                (flag, offset) = check_vertical_band(band_index, x1 + i)
+                if flag:
+                    return (int(x1 + i + bandwidth / 2), y1)
+                i += offset
+        return (-1, -1)
+    finally:
+        trace.count("checks", num_checks)
+        trace.count("scanned", i)
+
+
+def get_raw_strip_tiles(im) -> Optional[List[Tuple[int, int, int, str, int, int]]]:
+    # 비압축 이미지라면 타일별 (y0, y1, offset, rawmode, stride, ystep) 목록을 반환함 (임의의 행 범위만 읽을 수 있음)
+    (width, height) = im.size
+    raw_tiles = []
+    for (decoder_name, extents, offset, args) in im.tile:
+        if decoder_name != "raw" or extents[0] != 0 or extents[2] != width:
+            return None
+        if isinstance(args, str):
+            args = (args,)
+        rawmode = args[0]
+        stride = args[1] if len(args) > 1 else 0
+        ystep = args[2] if len(args) > 2 else 1
+        if rawmode not in raw_bytes_per_pixel or stride < 0:
+            return None
+        if stride == 0:
+            stride = width * raw_bytes_per_pixel[rawmode]
+        raw_tiles.append((extents[1], extents[3], offset, rawmode, stride, ystep))
+    if len(raw_tiles) == 0:
+        return None
+    return raw_tiles
+
+
+def is_png_streamable(image_file, im) -> bool:
+    # 8비트, 인터레이스가 아닌 PNG인지 확인 (PngRowReader로 행 단위로 디코딩할 수 있음)
+    if im.format != "PNG" or im.mode not in png_stream_modes or len(im.tile) != 1 or im.tile[0][0] != "zip":
+        return False
+    args = im.tile[0][3]
+    if (args[0] if isinstance(args, tuple) else args) != im.mode:
+        return False
+    with open(image_file, "rb") as f:
+        header = f.read(29)
+    # IHDR의 비트 깊이와 인터레이스 방식
+    return len(header) == 29 and header[12:16] == b"IHDR" and header[24] == 8 and header[28] == 0
+
+
+def is_strip_decodable(image_file, im) -> bool:
+    # 스트리밍 모드에서 전체를 디코딩하지 않고 띠 단위로 읽을 수 있는 이미지인지 확인
+    return get_raw_strip_tiles(im) is not None or is_png_streamable(image_file, im)
+
+
+class PngRowReader:
+    # 8비트, 인터레이스가 아닌 PNG의 IDAT를 조금씩 풀어서 띠 단위로 디코딩함 (merge.py가 PNG를 입력 이미지 단위로 나눠서 쓰는 것의 반대)
+    # 띠마다 시작할 때의 (파일 위치, 현재 IDAT 청크의 남은 크기, zlib 상태, 직전 행)을 기록해 두고, 앞쪽의 띠는 거기서부터 다시 디코딩함
+    def __init__(self, image_file, im, strip_height) -> None:
+        self.image_file = image_file
+        self.size = im.size
+        self.mode = im.mode
+        self.palette = im.palette if im.mode == "P" else None
+        self.strip_height = strip_height
+        self.row_bytes = im.size[0] * png_stream_modes[im.mode]
+        self.checkpoints: List[Tuple[int, int, Any, bytes]] = [(8, 0, zlib.decompressobj(), b"")]
+
+    def read_strip(self, index) -> Image.Image:
+        while len(self.checkpoints) <= index:
+            # 앞의 띠를 아직 디코딩하지 않았으면 차례로 디코딩해서 시작 위치를 기록함
+            self.read_strip(len(self.checkpoints) - 1)
+        (width, height) = self.size
+        num_rows = min(height, (index + 1) * self.strip_height) - index * self.strip_height
+        (position, chunk_left, decompressor, prior) = self.checkpoints[index]
+        decompressor = decompressor.copy()
+        need = num_rows * (self.row_bytes + 1)
+        data = bytearray()
+        with open(self.image_file, "rb") as f:
+            f.seek(position)
+            while len(data) < need:
+                if decompressor.unconsumed_tail:
+                    data += decompressor.decompress(decompressor.unconsumed_tail, need - len(data))
+                    continue
+                if chunk_left == 0:
+                    chunk_header = f.read(8)
+                    if len(chunk_header) < 8 or chunk_header[4:] == b"IEND" or decompressor.eof:
+                        raise OSError("image file is truncated")
+                    (length, chunk_type) = struct.unpack(">I4s", chunk_header)
+                    if chunk_type == b"IDAT":
+                        chunk_left = length
+                    else:
+                        f.seek(length + 4, os.SEEK_CUR)
+                    continue
+                compressed = f.read(min(chunk_left, png_read_size))
+                if not compressed:
+                    raise OSError("image file is truncated")
+                chunk_left -= len(compressed)
+                if chunk_left == 0:
+                    # CRC
+                    f.seek(4, os.SEEK_CUR)
+                data += decompressor.decompress(compressed, need - len(data))
+            position = f.tell()
+        # 직전 행을 필터 없이 앞에 붙여서 첫 행의 Up, Average, Paeth 필터가 참조하게 하고, 필터는 Pillow의 PNG 디코더로 되돌림
+        num_prior_rows = 1 if prior else 0
+        scanlines = (b"\x00" + prior if prior else b"") + bytes(data)
+        strip = Image.frombytes(self.mode, (width, num_prior_rows + num_rows), zlib.compress(scanlines, 0), "zip", self.mode)
+        if prior:
+            strip = strip.crop((0, 1, width, num_rows + 1))
+        if self.palette is not None:
+            (rawmode, palette) = self.palette.getdata()
+            strip.putpalette(palette, rawmode)
+        if len(self.checkpoints) == index + 1:
+            self.checkpoints.append((position, chunk_left, decompressor, strip.crop((0, num_rows - 1, width, num_rows)).tobytes()))
+        return strip
+
+
+class StripImage:
+    # 큰 이미지를 가로 띠 단위로 디코딩해서 최근 띠 몇 개만 RGB로 캐싱함
+    # 비압축 이미지는 필요한 행 범위만 읽고, 8비트 PNG는 PngRowReader로 앞에서부터 풀어서 읽음
+    # main()에서 사용하는 size, mode, format, crop(), getpixel()만 제공함
+    def __init__(self, image_file, memory_budget) -> None:
+        im = Image.open(image_file)
+        self.image_file = image_file
+        self.size = im.size
+        self.format = im.format
+        self.info = dict(im.info)
+        self.mode = "RGB"
+        (width, height) = self.size
+        # 띠 캐시가 memory_budget의 절반을 넘지 않도록 띠의 높이를 정함
+        self.strip_height = max(1, int(memory_budget / 2 / strip_cache_size / max(width * 3, 1)))
+        self.strips: OrderedDict[int, Image.Image] = OrderedDict()
+        self.raw_tiles = get_raw_strip_tiles(im)
+        self.png_rows: Optional[PngRowReader] = None
+        self.source: Optional[Image.Image] = None
+        if self.raw_tiles is None and is_png_streamable(image_file, im):
+            self.png_rows = PngRowReader(image_file, im, self.strip_height)
+        if self.raw_tiles is None and self.png_rows is None:
+            # 행 단위로 디코딩할 수 없는 포맷 (JPEG, WebP, 16비트나 인터레이스 PNG 등)은 원래 모드 그대로 한 번만 디코딩하고,
+            # RGB 변환은 잘라낸 영역에만 적용함 (--memory-budget으로 메모리를 제한할 수 없음)
+            sys.stderr.write("Warning: --stream can't decode %s images strip by strip, decoding %s whole\n" % (im.format, image_file))
+            im.load()
+            self.source = im
+        else:
+            im.close()
+
+    def load_rows(self, y0, y1) -> Image.Image:
+        # 파일에서 [y0, y1) 행만 디코딩함
+        assert self.raw_tiles is not None
+        (width, height) = self.size
+        raw_strip = Image.open(self.image_file)
+        tiles: List[Any] = []
+        for (tile_y0, tile_y1, offset, rawmode, stride, ystep) in self.raw_tiles:
+            (row_start, row_end) = (max(y0, tile_y0), min(y1, tile_y1))
+            if row_start >= row_end:
+                continue
+            if ystep < 0:
+                # 아래쪽 행부터 저장된 경우 (BMP)
+                row_offset = offset + (tile_y1 - row_end) * stride
+            else:
+                row_offset = offset + (row_start - tile_y0) * stride
+            tiles.append(("raw", (0, row_start - y0, width, row_end - y0), row_offset, (rawmode, stride, ystep)))
+        raw_strip._size = (width, y1 - y0)
+        raw_strip.tile = tiles
+        raw_strip.load()
+        if raw_strip.mode != "RGB":
+            return raw_strip.convert("RGB")
+        return raw_strip
+
+    def get_strip(self, index) -> Image.Image:
+        if index in self.strips:
+            self.strips.move_to_end(index)
+            return self.strips[index]
+        (width, height) = self.size
+        if self.png_rows is not None:
+            strip = self.png_rows.read_strip(index)
+            if strip.mode != "RGB":
+                strip = strip.convert("RGB")
+        else:
+            strip = self.load_rows(index * self.strip_height, min(height, (index + 1) * self.strip_height))
+        self.strips[index] = strip
+        while len(self.strips) > strip_cache_size:
+            self.strips.popitem(last=False)
+        return strip
+
+    def crop(self, box) -> Image.Image:
+        (x0, y0, x1, y1) = box
+        if self.source is not None:
+            region = self.source.crop(box)
+            if region.mode != "RGB":
+                region = region.convert("RGB")
+            return region
+        (width, height) = self.size
+        (first, last) = (max(0, y0) // self.strip_height, (min(y1, height) - 1) // self.strip_height)
+        if first == last:
+            strip_y = first * self.strip_height
+            return self.get_strip(first).crop((x0, y0 - strip_y, x1, y1 - strip_y))
+        region = Image.new("RGB", (x1 - x0, y1 - y0))
+        region.info.update(self.info)
+        for index in range(first, last + 1):
+            strip_y = index * self.strip_height
+            region.paste(self.get_strip(index).crop((x0, max(y0, strip_y) - strip_y, x1, min(y1, strip_y + self.strip_height) - strip_y)), (0, max(y0, strip_y) - y0))
+        return region
+
+    def getpixel(self, xy):
+        (x, y) = xy
+        return self.crop((x, y, x + 1, y + 1)).getpixel((0, 0))
+
+    def get_strip_end(self, y) -> int:
+        # y행이 포함된 띠의 끝 행
+        return min(self.size[1], (y // self.strip_height + 1) * self.strip_height)
+
+
+class SliceImage:
+    # 여러 이미지를 merge.py처럼 세로로 이어 붙인 (너비가 모자라면 오른쪽을 흰색으로 채운) 이미지로 동작함
+    # 이어 붙인 이미지를 만들지 않고, 입력 이미지를 필요할 때 디코딩해서 최근 몇 개만 RGB로 캐싱함
+    def __init__(self, image_files) -> None:
+        self.image_files = list(image_files)
+        # 각 입력 이미지가 시작하는 행 (마지막은 전체 높이)
+        self.offsets = [0]
+        width = 0
+        self.format: Optional[str] = None
+        for image_file in self.image_files:
+            with Image.open(image_file) as im:
+                width = max(width, im.size[0])
+                self.offsets.append(self.offsets[-1] + im.size[1])
+                self.format = im.format
+        self.size = (width, self.offsets[-1])
+        self.info: Dict[str, Any] = {}
+        self.mode = "RGB"
+        self.slices: OrderedDict[int, Image.Image] = OrderedDict()
+
+    def get_slice(self, index) -> Image.Image:
+        if index in self.slices:
+            self.slices.move_to_end(index)
+            return self.slices[index]
+        im: Image.Image
+        with Image.open(self.image_files[index]) as source:
+            source.load()
+            im = source if source.mode == "RGB" else source.convert("RGB")
+        if im.size[0] < self.size[0]:
+            padded = Image.new("RGB", (self.size[0], im.size[1]), "white")
+            padded.paste(im, (0, 0))
+            im = padded
+        self.slices[index] = im
+        while len(self.slices) > strip_cache_size:
+            self.slices.popitem(last=False)
+        return im
+
+    def crop(self, box) -> Image.Image:
+        (x0, y0, x1, y1) = box
+        (first, last) = (bisect_right(self.offsets, y0) - 1, bisect_right(self.offsets, y1 - 1) - 1)
+        if first == last:
+            slice_y = self.offsets[first]
+            return self.get_slice(first).crop((x0, y0 - slice_y, x1, y1 - slice_y))
+        # 입력 이미지의 경계에 걸친 영역은 각 입력 이미지에서 잘라서 붙임
+        region = Image.new("RGB", (x1 - x0, y1 - y0))
+        for index in range(first, last + 1):
+            (slice_y, slice_end) = (self.offsets[index], self.offsets[index + 1])
+            region.paste(self.get_slice(index).crop((x0, max(y0, slice_y) - slice_y, x1, min(y1, slice_end) - slice_y)), (0, max(y0, slice_y) - y0))
+        return region
+
+    def getpixel(self, xy):
+        (x, y) = xy
+        return self.crop((x, y, x + 1, y + 1)).getpixel((0, 0))
+
+    def get_strip_end(self, y) -> int:
+        # y행이 포함된 입력 이미지의 끝 행
+        return self.offsets[bisect_right(self.offsets, y)]
+
+
+class StreamingBandIndex:
+    # 세로 이미지에서 get_band_index()의 결과를 필요한 행까지만 읽어서 계산함
+    # 아직 읽지 않은 행은 배경색 띠로 인정하지 않으므로, 읽은 범위 안에서 찾은 띠는 전체를 읽고 찾은 띠와 같음
+    def __init__(self, im, bgcolor, margin, acceptable_diff_of_color_value, is_fuzzy, bandwidth, diff_limit, trace=no_trace) -> None:
+        (width, height) = im.size
+        self.im = im
+        self.trace = trace
+        self.bgcolor = bgcolor
+        self.margin = margin
+        self.acceptable_diff_of_color_value = acceptable_diff_of_color_value
+        self.is_fuzzy = is_fuzzy
+        self.bandwidth = bandwidth
+        self.diff_limit = diff_limit
+        self.profile = numpy.zeros(height, dtype=numpy.int64)
+        self.num_scanned_rows = 0
+
+    def __len__(self) -> int:
+        return len(self.profile) + 1
+
+    def __getitem__(self, y) -> int:
+        height = len(self.profile)
+        while True:
+            local_index = get_band_index(self.profile[y:self.num_scanned_rows], self.bandwidth, self.diff_limit)
+            if local_index[0] < len(local_index) - 1:
+                return y + int(local_index[0])
+            if self.num_scanned_rows >= height:
+                return height
+            self.scan_more_rows()
+
+    def scan_more_rows(self) -> None:
+        (width, height) = self.im.size
+        (y0, y1) = (self.num_scanned_rows, self.im.get_strip_end(self.num_scanned_rows))
+        self.profile[y0:y1] = get_mismatch_profile(self.im.crop((0, y0, width, y1)), "vertical", self.bgcolor, self.margin, self.acceptable_diff_of_color_value, self.is_fuzzy, self.trace, int(max(self.diff_limit, 0)))
+        self.num_scanned_rows = y1
+
+
+def get_runs(mask) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    # mask에서 True가 연속된 구간들의 시작 위치와 끝 위치
+    padded = numpy.concatenate(([False], mask, [False]))
+    changes = numpy.flatnonzero(padded[1:] != padded[:-1])
+    return (changes[0::2], changes[1::2])
+
+
+def get_coarse_scale(coarse_scale, bandwidth, span, diff_limit) -> int:
+    # 모든 띠가 축소 이미지의 행(또는 열)을 하나 이상 온전히 포함하도록 축소 배율을 제한함
+    scale = max(1, min(coarse_scale, (bandwidth + 1) // 2))
+    # 축소 줄의 허용 불일치 수(scale * 원래 허용 불일치 수)가 축소 줄의 길이 이상이면 후보를 걸러낼 수 없음
+    while scale > 1 and scale * int(max(diff_limit, 0)) >= span // scale:
+        scale -= 1
+    return scale
+
+
+class CoarseBandIndex:
+    # 축소한 이미지에서 배경색 띠의 후보를 찾고, 후보 줄만 원래 해상도에서 검사해서 get_band_index()와 같은 결과를 반환함
+    # 축소 이미지의 픽셀은 scale x scale 영역의 평균이고, 배경색과의 거리 제곱은 볼록 함수이므로
+    # 영역 안의 픽셀이 모두 배경색과 일치하면 평균도 허용치를 1 늘려서 비교했을 때 일치함 (반올림 오차 포함)
+    # 따라서 원래 해상도에서 배경색인 줄로만 이뤄진 축소 줄은 불일치 픽셀이 scale * (허용 불일치 수) 이하이고,
+    # 그런 축소 줄과 그 앞뒤 축소 줄만 후보로 삼아도 bandwidth >= 2 * scale - 1 인 띠는 모두 후보 안에 있음
+    # 평균으로 판단할 수 없는 blackorwhite, fuzzy와 픽셀 값이 팔레트 번호인 P 모드 이미지에는 사용하지 않음
+    def __init__(self, im, orientation, bgcolor, margin, acceptable_diff_of_color_value, bandwidth, diff_limit, scale, trace=no_trace) -> None:
+        (width, height) = im.size
+        self.im = im
+        self.trace = trace
+        self.orientation = orientation
+        self.bgcolor = bgcolor
+        self.margin = margin
+        self.acceptable_diff_of_color_value = acceptable_diff_of_color_value
+        self.bandwidth = bandwidth
+        self.diff_limit = diff_limit
+        (self.length, span) = (height, width) if orientation == "vertical" else (width, height)
+
+        # 가장자리 여백의 픽셀이 섞이지 않은 축소 열(가로 이미지에서는 행)만 사용함
+        coarse = im.reduce(scale)
+        (first, last) = (-(-margin // scale), -(-span // scale) if margin == 0 else (span - margin) // scale)
+        allowed_mismatches = int(max(diff_limit, 0))
+        if last > first:
+            if orientation == "vertical":
+                region = coarse.crop((first, 0, last, coarse.size[1]))
+            else:
+                region = coarse.crop((0, first, coarse.size[0], last))
+            is_clean = get_mismatch_profile(region, orientation, bgcolor, 0, acceptable_diff_of_color_value + 1, False, trace, scale * allowed_mismatches) <= scale * allowed_mismatches
+        else:
+            is_clean = numpy.ones(-(-self.length // scale), dtype=bool)
+        is_candidate = is_clean.copy()
+        is_candidate[1:] |= is_clean[:-1]
+        is_candidate[:-1] |= is_clean[1:]
+        self.is_candidate = numpy.repeat(is_candidate, scale)[:self.length]
+
+        # 후보가 아닌 줄은 불일치 줄로 간주함
+        self.profile = numpy.where(self.is_candidate, 0, allowed_mismatches + 1)
+        self.is_verified = ~self.is_candidate
+        (self.run_starts, self.run_ends) = get_runs(self.is_candidate)
+
+    def __len__(self) -> int:
+        return self.length + 1
+
+    def __getitem__(self, p) -> int:
+        # 후보 구간 사이에는 불일치 줄이 있으므로 띠는 후보 구간 하나 안에서만 찾으면 됨
+        for i in range(int(numpy.searchsorted(self.run_ends, p, side="right")), len(self.run_starts)):
+            (start, end) = (max(p, int(self.run_starts[i])), int(self.run_ends[i]))
+            if end - start < self.bandwidth:
+                continue
+            # 긴 후보 구간은 앞에서부터 조금씩 늘려 가며 검사함
+            (verified_end, chunk) = (start, max(self.bandwidth, 64))
+            while verified_end < end:
+                verified_end = min(end, verified_end + chunk)
+                self.verify(start, verified_end)
+                local_index = get_band_index(self.profile[start:verified_end], self.bandwidth, self.diff_limit)
+                if local_index[0] < verified_end - start:
+                    return start + int(local_index[0])
+                chunk *= 2
+        return self.length
+
+    def verify(self, start, end) -> None:
+        # [start, end)에서 아직 검사하지 않은 줄의 불일치 픽셀 수를 원래 해상도에서 계산함
+        (width, height) = self.im.size
+        (run_starts, run_ends) = get_runs(~self.is_verified[start:end])
+        for (a, b) in zip(run_starts + start, run_ends + start):
+            if self.orientation == "vertical":
+                region = self.im.crop((0, a, width, b))
+            else:
+                region = self.im.crop((a, 0, b, height))
+            self.profile[a:b] = get_mismatch_profile(region, self.orientation, self.bgcolor, self.margin, self.acceptable_diff_of_color_value, False, self.trace, int(max(self.diff_limit, 0)))
+            self.is_verified[a:b] = True
 
 
 def determine_color_option(a) -> Optional[Tuple[Optional[Tuple[int, int, int]], bool, bool]]:
@@ -209,158 +906,266 @@ def check_proportion(width, height, unit_width, orientation) -> bool:
     return False
 
 
-def optimize_image_for_webp(subIm):
-    """Optimize image to ensure WebP compatibility"""
-    try:
-        # Ensure image is in RGB mode
-        if subIm.mode != 'RGB':
-            subIm = subIm.convert('RGB')
-        
-        width, height = subIm.size
-        total_pixels = width * height
-        
-        # Check if image needs optimization
-        needs_resize = False
-        new_width, new_height = width, height
-        
-        # Check dimension limits
-        if width > WEBP_MAX_DIMENSION or height > WEBP_MAX_DIMENSION:
-            needs_resize = True
-            if width > height:
-                new_width = WEBP_MAX_DIMENSION
-                new_height = int(height * WEBP_MAX_DIMENSION / width)
-            else:
-                new_height = WEBP_MAX_DIMENSION
-                new_width = int(width * WEBP_MAX_DIMENSION / height)
-        
-        # Check pixel count limits
-        elif total_pixels > WEBP_MAX_PIXELS:
-            needs_resize = True
-            scale_factor = (WEBP_MAX_PIXELS / total_pixels) ** 0.5
-            new_width = int(width * scale_factor)
-            new_height = int(height * scale_factor)
-        
-        # Apply resize if needed
-        if needs_resize:
-            print(f"Optimizing image from {width}x{height} to {new_width}x{new_height} for WebP compatibility")
-            subIm = subIm.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        
-        return subIm
-        
-    except Exception as e:
-        print(f"Error optimizing image: {e}")
-        return subIm
+def get_webp_size(width, height) -> Tuple[int, int]:
+    # WebP 권장 크기 (WEBP_MAX_DIMENSION, WEBP_MAX_PIXELS) 안에 들어가도록 줄인 크기 (줄일 필요가 없으면 원래 크기)
+    if width > WEBP_MAX_DIMENSION or height > WEBP_MAX_DIMENSION:
+        if width > height:
+            return (WEBP_MAX_DIMENSION, int(height * WEBP_MAX_DIMENSION / width))
+        return (int(width * WEBP_MAX_DIMENSION / height), WEBP_MAX_DIMENSION)
+    if width * height > WEBP_MAX_PIXELS:
+        scale_factor = (WEBP_MAX_PIXELS / (width * height)) ** 0.5
+        return (int(width * scale_factor), int(height * scale_factor))
+    return (width, height)
+
+
+@dataclass
+class OutputPlan:
+    # plan_piece_output()가 인코딩하기 전에 정한 조각의 포맷과 인코더 옵션
+    format: str
+    params: Dict[str, Any] = field(default_factory=dict)
+    reason: str = "" # 원래 포맷으로 저장하지 않는 이유
+
+
+def can_save_piece(format, size, mode) -> bool:
+    # Pillow에 그 포맷의 인코더가 있고, 조각의 크기와 모드가 포맷의 제한 안에 있는지 확인
+    if format is None or format.upper() not in Image.SAVE:
+        return False
+    (max_size, modes) = output_format_limits.get(format.upper(), (None, None))
+    if max_size is not None and max(size) > max_size:
+        return False
+    return modes is None or mode in modes
+
+
+def plan_piece_output(size, mode, format, preset=default_output_preset) -> OutputPlan:
+    # 원래 포맷, WebP, JPEG, PNG 중 조각의 크기와 모드로 저장할 수 있는 첫 번째 포맷과 preset의 인코더 옵션을 정함
+    # 실패할 인코딩을 차례로 시도하지 않고 한 번만 인코딩하기 위함
+    Image.init()
+    reasons: List[str] = []
+    tried = set()
+    for (candidate, quality) in ((format, default_quality), ("WEBP", 80), ("JPEG", 85), ("PNG", None)):
+        if candidate is None:
+            reasons.append("no original format")
+            continue
+        candidate = candidate.upper()
+        if candidate in tried:
+            continue
+        tried.add(candidate)
+        if not can_save_piece(candidate, size, mode):
+            reasons.append("%s can't store %dx%d %s" % (candidate, size[0], size[1], mode))
+            continue
+        params = dict(output_presets[preset].get(candidate, {}))
+        if quality is not None:
+            params["quality"] = quality
+        return OutputPlan(candidate, params, ", ".join(reasons))
+    raise SplitError("no output format can store %dx%d %s" % (size[0], size[1], mode))
 
 
-def save_webp_guaranteed(subIm, sub_img_name):
-    """Save image as WebP with guaranteed success using multiple fallback strategies"""
+def get_save_messages(size, mode, format, name, preset=default_output_preset) -> List[str]:
+    # 조각을 저장하는 데 성공했을 때 save_piece()가 반환하는 메시지 (포맷을 바꾼 이유와 저장한 조각)
     try:
-        # Strategy 1: Try with optimized image and conservative settings
-        optimized_im = optimize_image_for_webp(subIm)
-        final_width, final_height = optimized_im.size
-        print(f"Attempting WebP save: {sub_img_name} ({final_width}x{final_height})")
-        
-        try:
-            optimized_im.save(
-                sub_img_name, 
-                format='WEBP', 
-                quality=80,      # Lower quality for better compatibility
-                method=0,        # Most reliable method
-                lossless=False,
-                exact=False
-            )
-            print(f"Successfully saved WebP: {sub_img_name}")
-            return True
-        except Exception as e1:
-            print(f"WebP method=0 failed: {e1}")
-            
-        # Strategy 2: Try with even lower quality
-        try:
-            optimized_im.save(
-                sub_img_name, 
-                format='WEBP', 
-                quality=70,
-                method=1,
-                lossless=False,
-                exact=False
-            )
-            print(f"Successfully saved WebP (method=1): {sub_img_name}")
-            return True
-        except Exception as e2:
-            print(f"WebP method=1 failed: {e2}")
-            
-        # Strategy 3: Try with lossless compression
-        try:
-            optimized_im.save(
-                sub_img_name, 
-                format='WEBP', 
-                lossless=True,
-                method=0
-            )
-            print(f"Successfully saved lossless WebP: {sub_img_name}")
-            return True
-        except Exception as e3:
-            print(f"Lossless WebP failed: {e3}")
-            
-        # Strategy 4: Try with original image (no optimization)
+        plan = plan_piece_output(size, mode, format, preset)
+    except SplitError:
+        return []
+    return ([f"Saving as {plan.format}: {plan.reason}"] if plan.reason else []) + ["save: %s" % name]
+
+
+def save_piece(subIm, sub_img_name, format, trace=no_trace, name=None, preset=default_output_preset, do_omit_success=False) -> Tuple[bool, List[str], Dict[str, Any]]:
+    # plan_piece_output()가 정한 포맷으로 한 번만 인코딩해서 저장하고 (성공 여부, 출력할 메시지 목록, 포맷과 크기와 인코딩 시간)을 반환함
+    # sub_img_name은 파일 이름 대신 쓰기 가능한 파일 객체일 수도 있음 (name이 주어지면 메시지와 기록에 씀)
+    # do_omit_success이면 get_save_messages()의 메시지는 이미 출력했다고 보고 실패 메시지만 반환함
+    messages: List[str] = []
+    stats: Dict[str, Any] = {}
+    if name is None:
+        name = str(sub_img_name)
+    with trace.stage("save", file=name):
         try:
-            if subIm.mode != 'RGB':
-                subIm = subIm.convert('RGB')
-            subIm.save(
-                sub_img_name, 
-                format='WEBP', 
-                quality=60,
-                method=0
-            )
-            print(f"Successfully saved WebP (original): {sub_img_name}")
-            return True
-        except Exception as e4:
-            print(f"Original image WebP failed: {e4}")
-            
-        # Strategy 5: Try with PNG as fallback (WebP-like compression)
+            plan = plan_piece_output(subIm.size, subIm.mode, format, preset)
+        except SplitError as e:
+            messages.append(f"Failed to save {name}: {e}")
+            return (False, messages, stats)
+        if plan.reason and not do_omit_success:
+            messages.append(f"Saving as {plan.format}: {plan.reason}")
+        start_time = time.perf_counter()
         try:
-            png_name = sub_img_name.replace('.webp', '.png')
-            optimized_im.save(png_name, format='PNG', optimize=True)
-            print(f"Saved as PNG fallback: {png_name}")
-            return True
-        except Exception as e5:
-            print(f"PNG fallback failed: {e5}")
-            
-        return False
-        
-    except Exception as e:
-        print(f"WebP save completely failed for {sub_img_name}: {e}")
-        return False
+            with trace.stage("encode", format=plan.format, **plan.params):
+                subIm.save(sub_img_name, format=plan.format, **plan.params)
+                stats = {"format": plan.format, "bytes": os.path.getsize(sub_img_name) if isinstance(sub_img_name, str) else sub_img_name.tell(),
+                         "encode_time": time.perf_counter() - start_time}
+                trace.count("bytes", stats["bytes"])
+        except Exception as e:
+            messages.append(f"Failed to save as {plan.format}: {e}")
+            return (False, messages, stats)
+    if not do_omit_success:
+        messages.append("save: %s" % name)
+    return (True, messages, stats)
+
+
+def estimate_encode_memory(pixels) -> int:
+    # 조각 하나를 인코딩하는 동안의 최대 메모리 (save_piece()가 시도하는 포맷 중 가장 많이 쓰는 WebP 인코딩 기준)
+    return pixels * WEBP_MEMORY_MULTIPLIER
+
+
+def estimate_piece_memory(pixels, mode) -> int:
+    # 조각 하나를 잘라서 인코딩하는 동안의 최대 메모리 (잘라낸 이미지와 인코딩)
+    return pixels * image_bytes_per_pixel.get(mode, 4) + estimate_encode_memory(pixels)
+
+
+def get_estimated_piece_pixels(width, height, options) -> int:
+    # 조각의 최대 픽셀 수 추정 (-n이면 띠의 위치에 따라 조각이 기준 크기의 두 배까지 길어진다고 봄)
+    (length, breadth) = (width, height) if width > height or options.do_split_vertically else (height, width)
+    max_length = get_max_piece_length(options, breadth)
+    if max_length > 0:
+        return breadth * min(length, max_length)
+    return breadth * min(length, 2 * -(-length // max(options.num_units, 1)))
+
+
+def get_split_mode(mode, options) -> str:
+    # 헤더의 모드로 추정한 띠를 찾고 조각을 자르는 이미지의 모드 (open_image()가 변환한 후의 모드, 스트리밍 모드의 파일은 항상 RGB)
+    if mode != "RGB" and (options.do_stream or options.do_convert_rgb or mode not in native_modes):
+        return "RGB"
+    return mode
+
+
+def estimate_load_memory(size, mode, options, is_streamed=False) -> int:
+    # 디코딩한 이미지, RGB 변환, 불일치 프로파일 계산에 쓰는 최대 메모리를 바이트 단위로 추정함
+    # is_streamed는 스트리밍 모드에서 띠 단위로 디코딩할 수 있는 이미지인지 여부 (is_strip_decodable())
+    (width, height) = size
+    pixels = width * height
+    decoded = pixels * image_bytes_per_pixel.get(mode, 4)
+    if is_streamed:
+        # 스트리밍 모드에서는 디코딩한 띠만 보관하고 RGB 변환도 띠 단위로 함
+        decoded = min(decoded, options.memory_budget * 1024 * 1024)
+    elif get_split_mode(mode, options) != mode:
+        decoded += pixels * image_bytes_per_pixel["RGB"]
+    scanning = min(pixels, profile_chunk_pixels) * profile_bytes_per_pixel
+    return decoded + scanning
+
+
+def estimate_split_memory(size, mode, options, is_streamed=False) -> int:
+    # 헤더의 크기와 모드만으로 이미지 하나를 자르는 동안의 최대 메모리를 바이트 단위로 추정함
+    # estimate_load_memory()와 동시에 잘라서 인코딩하는 조각들 (인코딩 중인 save_workers 개와 잘라서 기다리는 하나)의 합
+    (width, height) = size
+    piece_pixels = min(width * height, get_estimated_piece_pixels(width, height, options))
+    saving = estimate_piece_memory(piece_pixels, get_split_mode(mode, options)) * (max(1, options.save_workers) + 1)
+    return estimate_load_memory(size, mode, options, is_streamed) + saving
+
 
+def get_encode_budget(im, options) -> int:
+    # --memory-limit에서 디코딩한 이미지와 불일치 프로파일 계산의 추정 메모리를 빼고 남은, 조각들을 동시에 인코딩하는 데 쓸 메모리
+    # 일괄 처리에서 이 이미지에 잡아 둔 인코딩 메모리를 넘지 않고, 남은 메모리가 없어도 조각 하나씩은 인코딩함 (한도가 없으면 0)
+    if options.memory_limit <= 0:
+        return 0
+    is_streamed = isinstance(im, StripImage) and im.source is None
+    loading = estimate_load_memory(im.size, im.mode, options, is_streamed)
+    saving = estimate_split_memory(im.size, im.mode, options, is_streamed) - loading
+    return max(1, min(options.memory_limit * 1024 * 1024 - loading, saving))
 
-def save_image_safely(subIm, sub_img_name, original_format):
-    """Save image with guaranteed success using multiple formats"""
+
+def get_archive_compression(data) -> int:
+    # 이미 압축된 포맷의 조각은 다시 압축하지 않고 그대로 저장함
+    return zipfile.ZIP_STORED if data.startswith(compressed_signatures) else zipfile.ZIP_DEFLATED
+
+
+def write_archive_entry(archive, name, data) -> None:
+    entry = zipfile.ZipInfo(name, time.localtime()[:6])
+    entry.compress_type = get_archive_compression(data)
+    archive.writestr(entry, data)
+
+
+def open_archive(archive_file) -> zipfile.ZipFile:
+    # 조각을 쓸 ZIP(CBZ) 파일을 엶 ("-"이면 표준 출력, 파일이면 임시 파일에 쓴 후 close_archive()에서 이름을 바꿈)
+    if archive_file == "-":
+        return zipfile.ZipFile(sys.stdout.buffer, "w")
+    return zipfile.ZipFile("%s.%d.tmp" % (archive_file, os.getpid()), "w")
+
+
+def close_archive(archive, archive_file, succeeded) -> None:
+    # 실패하거나 닫는 중에 예외가 나면 쓰던 임시 파일을 지움 (표준 출력에 쓴 내용은 되돌릴 수 없음)
+    if archive is None:
+        return
+    temp_path = "%s.%d.tmp" % (archive_file, os.getpid())
     try:
-        # Try WebP first with multiple fallback strategies
-        if save_webp_guaranteed(subIm, sub_img_name):
-            return True
-        
-        # If WebP completely fails, use original format
-        print(f"WebP failed, using original format {original_format} for {sub_img_name}")
-        
-        # Ensure image is in correct mode
-        if subIm.mode != 'RGB':
-            subIm = subIm.convert('RGB')
-        
-        if original_format and original_format.upper() in ['JPEG', 'JPG']:
-            subIm.save(sub_img_name, quality=85, format='JPEG', optimize=True)
-        elif original_format and original_format.upper() == 'PNG':
-            subIm.save(sub_img_name, format='PNG', optimize=True)
-        else:
-            # Default to JPEG if original format is not supported
-            subIm.save(sub_img_name, quality=85, format='JPEG', optimize=True)
-        
-        print(f"Successfully saved as {original_format or 'JPEG'}: {sub_img_name}")
-        return True
-        
-    except Exception as e:
-        print(f"All save methods failed for {sub_img_name}: {e}")
-        return False
+        archive.close()
+        if archive_file == "-":
+            sys.stdout.buffer.flush()
+        elif succeeded:
+            os.replace(temp_path, archive_file)
+    finally:
+        if archive_file != "-" and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class PieceSaver:
+    # 조각의 인코딩과 저장을 스레드 풀에서 처리함 (Pillow의 인코더는 GIL을 놓고 동작함)
+    # 저장 중인 조각은 num_workers 개까지만 유지함
+    # 스레드 풀에서는 인코딩이 끝나는 순서와 상관없이 동기 저장과 같은 위치에 메시지가 나오도록 성공 메시지는 조각을 넘길 때 출력하고,
+    # 실패 메시지만 인코딩이 끝난 뒤 조각 순서대로 출력함
+    # archive(zipfile.ZipFile)가 주어지면 조각을 파일 대신 메모리에 인코딩해서 조각 순서대로 압축 파일의 항목으로 씀
+    # memory_budget이 0보다 크면 인코딩 중인 조각들의 추정 메모리가 이를 넘지 않을 때만 다음 조각을 시작함 (하나는 항상 시작함)
+    # submit()에 piece_report를 주면 저장한 조각의 포맷, 바이트 수, 인코딩 시간을 채움
+    def __init__(self, num_workers, log=print, trace=no_trace, archive=None, memory_budget=0, preset=default_output_preset) -> None:
+        self.num_workers = max(1, num_workers)
+        self.log = log
+        self.trace = trace
+        self.archive = archive
+        self.memory_budget = memory_budget
+        self.preset = preset
+        self.executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        if self.num_workers > 1:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.num_workers)
+        self.pending: Deque[Tuple[concurrent.futures.Future, str, Any, int, Optional[Dict[str, Any]]]] = deque()
+        self.pending_memory = 0
+        self.succeeded = True
+
+    def submit(self, subIm, sub_img_name, format, piece_report=None) -> bool:
+        # 앞서 저장한 조각이 실패했으면 False 반환
+        output = io.BytesIO() if self.archive is not None else sub_img_name
+        if self.archive is not None:
+            sub_img_name = os.path.basename(sub_img_name)
+        if self.executor is None:
+            return self.report(save_piece(subIm, output, format, self.trace, sub_img_name, self.preset), sub_img_name, output, piece_report)
+        memory = estimate_piece_memory(subIm.size[0] * subIm.size[1], subIm.mode)
+        while len(self.pending) >= self.num_workers or (self.pending and self.memory_budget > 0 and self.pending_memory + memory > self.memory_budget):
+            self.wait_oldest()
+        if self.succeeded:
+            for message in get_save_messages(subIm.size, subIm.mode, format, sub_img_name, self.preset):
+                self.log(message)
+            future = self.executor.submit(save_piece, subIm, output, format, self.trace, sub_img_name, self.preset, True)
+            self.pending.append((future, sub_img_name, output, memory, piece_report))
+            self.pending_memory += memory
+        return self.succeeded
+
+    def report(self, result, sub_img_name, output, piece_report=None) -> bool:
+        (succeeded, messages, stats) = result
+        if piece_report is not None:
+            piece_report.update(stats)
+        if succeeded and self.succeeded and self.archive is not None:
+            try:
+                with self.trace.stage("archive", file=sub_img_name):
+                    write_archive_entry(self.archive, sub_img_name, output.getvalue())
+            except OSError as e:
+                (succeeded, messages) = (False, messages + [f"Failed to write {sub_img_name} to the archive: {e}"])
+        for message in messages:
+            self.log(message)
+        self.succeeded = self.succeeded and succeeded
+        return self.succeeded
+
+    def wait_oldest(self) -> None:
+        (future, sub_img_name, output, memory, piece_report) = self.pending.popleft()
+        self.pending_memory -= memory
+        try:
+            self.report(future.result(), sub_img_name, output, piece_report)
+        except Exception as e:
+            self.report((False, [f"Failed to save the split image: {e}"], {}), sub_img_name, output, piece_report)
+
+    def close(self) -> bool:
+        # 저장 중인 조각을 모두 기다리고, 모든 조각의 저장에 성공했는지 반환함
+        while self.pending:
+            self.wait_oldest()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        return self.succeeded
 
 
 def print_usage(program_name: str) -> None:
@@ -368,7 +1173,12 @@ def print_usage(program_name: str) -> None:
     print("          [-b <bandwidth>] [-m <margin>]")
     print("          [-c <bgcolor or method>] [-t <diff threshold>]")
     print("          [-s <size_threshold] [-a <acceptable diff of color value>]")
-    print("          [-v] [-w] <image file>")
+    print("          [-v] [-w] [-j <workers>] [--stream] [--memory-budget <MB>] [--memory-limit <MB>]")
+    print("          [--dominant-samples <n>] [--save-workers <n>] [--coarse <factor>] [-q] [--json]")
+    print("          [--cache] [--cache-dir <dir>] [--no-cache] [--refresh-cache] [--clear-cache] [--merge <name>]")
+    print("          [--max-length <pixels>] [--max-pixels <pixels>] [--fit-webp] [--rgb]")
+    print("          [--profile] [--trace <file>] [--incremental] [--preset fast|balanced|small] [--previews <sizes>] [--archive <file>] [--cbz]")
+    print("          <image file, glob or directory>...")
     print("\t-n <num units>: more than 2")
     print("\t-b <bandwidth>: (default %d)" % (default_bandwidth))
     print("\t-m <margin>: (default %d)" % (default_margin))
@@ -381,288 +1191,1078 @@ def print_usage(program_name: str) -> None:
     print("\t-a <diff of color value>: acceptable diff of color value (default %d)" % (default_acceptable_diff_of_color_value))
     print("\t-v: split vertically")
     print("\t-w: scan range wider than fixed unit edge")
+    print("\t-q, --quiet: don't print diagnostic messages")
+    print("\t--json: print only one JSON result with the pieces and their boxes")
+    print("\t-j <workers>: split multiple images in a pool of worker processes (default: number of CPUs)")
+    print("\t--stream: decode the image strip by strip to bound memory usage (uncompressed images and 8-bit non-interlaced PNG;")
+    print("\t\tother formats such as JPEG and WebP are still decoded whole, with a warning)")
+    print("\t--memory-budget <MB>: memory for decoded strips in stream mode (default %d)" % (default_memory_budget))
+    print("\t--memory-limit <MB>: start images (with -j) and piece encodes only while their memory, estimated from the image headers")
+    print("\t\t(decode, RGB conversion, crops and WebP encoding at %dx the pixels), fits in the limit (default: no limit)" % (WEBP_MEMORY_MULTIPLIER))
+    print("\t\tpieces are encoded concurrently only within what the decoded image and the profile scan leave of the limit")
+    print("\t--dominant-samples <n>: samples per axis for 'dominant' and 'fuzzy', 0 for every pixel (default %d)" % (default_dominant_samples))
+    print("\t--save-workers <n>: threads encoding and saving pieces concurrently, 1 to save synchronously (default %d)" % (default_save_workers))
+    print("\t--coarse <factor>: find band candidates on an image reduced by the factor, then check them at full resolution")
+    print("\t\t(same cutting points; not used for 'blackorwhite' and 'fuzzy', lowered for a small bandwidth or a large diff threshold)")
+    print("\t--max-length <pixels>: instead of -n, split into the fewest pieces not longer than this along the split direction,")
+    print("\t\tchoosing the background bands over the whole image so that the pieces are balanced")
+    print("\t--max-pixels <pixels>: instead of -n, split into the fewest pieces with at most this many pixels")
+    print("\t--fit-webp: same as --max-length %d --max-pixels %d, so every piece is saved as WebP without downscaling" % (WEBP_MAX_DIMENSION, WEBP_MAX_PIXELS))
+    print("\t--merge <name>: split the images stacked vertically as merge.py would, saving name.N.ext without the merged image")
+    print("\t--rgb: convert grayscale (L) and palette (P) images to RGB instead of splitting and saving them in their own mode")
+    print("\t--profile: print the time, pixels examined and band checks of each stage (decode, convert, bgcolor, band, crop, save, ...)")
+    print("\t--trace <file>: write every timed stage as JSON to the file ('-' for stderr)")
+    print("\t--incremental: record the pieces in name%s and, when the image has only grown at the bottom since then," % (manifest_suffix))
+    print("\t\tkeep the pieces above the last cut and split only the rest with the same piece length")
+    print("\t--preset <name>: encoder effort of the pieces, 'fast', 'balanced' or 'small' (default %s)" % (default_output_preset))
+    print("\t\teach piece is encoded once, in the original format or else WebP, JPEG or PNG, whichever can store its size and mode")
+    print("\t--previews <sizes>: also save name.N.pSIZE.ext previews of each piece, SIZE pixels wide (high for a horizontal split),")
+    print("\t\tand a name.pSIZE.ext overview of the whole image in the smallest size, e.g. '--previews 1080,240'")
+    print("\t\t(made from the decoded pieces by reduce(), not with --archive or --cbz)")
+    print("\t--archive <file>: write the pieces into a ZIP (CBZ) file instead of separate files, '-' for stdout")
+    print("\t\t(JPEG, PNG, GIF and WebP pieces are stored without recompression; diagnostics go to stderr with '-')")
+    print("\t--cbz: write the pieces of each image into name.cbz")
+    print("\t--cache: cache the cutting points per image content and options in %s (default: no cache)" % (default_cache_dir))
+    print("\t--cache-dir <dir>: cache the cutting points in the directory instead")
+    print("\t--no-cache: neither read nor write the cache")
+    print("\t--refresh-cache: with --cache or --cache-dir, detect the cutting points again and overwrite the cached ones")
+    print("\t--clear-cache: remove all cached cutting points")
     
             
-def main() -> int:
-    # 옵션 처리
+@dataclass
+class SplitOptions:
+    # main()의 명령행 옵션 (일괄 처리 시 작업 프로세스에 그대로 전달됨)
     bandwidth: int = default_bandwidth
     num_units: int = default_num_units
     margin: int = default_margin
-    diff_threshold: float = default_diff_threshold;
-    size_threshold: float = default_size_threshold;
+    diff_threshold: float = default_diff_threshold
+    size_threshold: float = default_size_threshold
     acceptable_diff_of_color_value: int = default_acceptable_diff_of_color_value
     bgcolor: Optional[Tuple[int, int, int]] = None
     do_use_dominant_color: bool = False
     is_fuzzy: bool = False
     do_split_vertically: bool = False
-    do_scan_wider:bool = False
+    do_scan_wider: bool = False
+    do_stream: bool = False
+    memory_budget: int = default_memory_budget
+    memory_limit: int = 0 # MB, 0보다 크면 일괄 처리와 조각 인코딩을 추정 메모리가 이를 넘지 않는 만큼만 동시에 실행함
+    save_workers: int = default_save_workers
+    dominant_samples: int = default_dominant_samples
+    max_piece_length: int = 0 # 0보다 크면 -n 대신 조각이 이 길이를 넘지 않도록 자름 (자르는 방향의 길이)
+    max_piece_pixels: int = 0 # 0보다 크면 -n 대신 조각이 이 픽셀 수를 넘지 않도록 자름
+    coarse_scale: int = 1 # 1보다 크면 이 배율로 축소한 이미지에서 띠의 후보를 찾음
+    do_convert_rgb: bool = False # True이면 L, P 모드 이미지도 RGB로 변환해서 자르고 저장함
+    archive: Optional[str] = None # 주어지면 조각을 이 ZIP(CBZ) 파일에 씀 ("-"이면 표준 출력, 빈 문자열이면 name.cbz)
+    output_preset: str = default_output_preset # 조각을 인코딩할 때의 속도와 크기 (output_presets의 이름)
+    preview_sizes: List[int] = field(default_factory=list) # 조각마다 이 크기(큰 것부터)의 미리보기를 만들고, 가장 작은 크기로 전체 개요도 만듦
+    do_incremental: bool = False # True이면 name.split.json에 자른 결과를 기록하고, 이미지가 아래로 늘어났으면 늘어난 부분만 자름
+    cache_dir: Optional[str] = None # 자르는 위치를 캐시할 디렉토리 (None이면 캐시하지 않음)
+    do_refresh_cache: bool = False
+
+
+@dataclass
+class SplitResult:
+    # split_image()의 결과
+    size: Tuple[int, int]
+    format: Optional[str]
+    orientation: str
+    bgcolor: Tuple[int, int, int]
+    cutting_points: List[Tuple[int, int, int, int]] = field(default_factory=list) # 조각의 영역 (x0, y0, x1, y1)
+    pieces: List[Any] = field(default_factory=list) # 잘라낸 이미지 또는 인코딩한 바이트
+
+
+class SplitError(Exception):
+    # 이미지를 자르거나 조각을 저장할 수 없는 경우
+    pass
+
+
+def log_nothing(*args) -> None:
+    # 진단 메시지를 출력하지 않을 때 print 대신 사용함
+    pass
+
+
+def log_to_stderr(*args) -> None:
+    # 표준 출력에 다른 내용을 쓰는 동안 print 대신 사용함
+    print(*args, file=sys.stderr)
+
+
+class MessageRecorder:
+    # log 대신 사용해서 진단 메시지를 출력하면서 기록함 (캐시에서 읽어 올 때 같은 메시지를 다시 출력하기 위함)
+    def __init__(self, log=print) -> None:
+        self.log = log
+        self.events: List[Any] = []
+
+    def __call__(self, *args) -> None:
+        message = " ".join(str(arg) for arg in args)
+        self.events.append(message)
+        self.log(message)
+
+
+def record_cutting_points(boxes, recorder) -> Iterator[Tuple[int, int, int, int]]:
+    # 조각의 영역을 진단 메시지 사이의 순서대로 기록함
+    for box in boxes:
+        recorder.events.append(list(box))
+        yield box
+
+
+def replay_cutting_points(events, log=print) -> Iterator[Tuple[int, int, int, int]]:
+    # 기록된 진단 메시지를 다시 출력하면서 조각의 영역을 반환함
+    for event in events:
+        if isinstance(event, str):
+            log(event)
+        else:
+            yield (event[0], event[1], event[2], event[3])
+
+
+def get_split_parameters(options) -> List[Any]:
+    # 자르는 위치에 영향을 주는 옵션
+    return [options.bandwidth, options.num_units, options.max_piece_length, options.max_piece_pixels, options.margin, options.diff_threshold, options.size_threshold,
+            options.acceptable_diff_of_color_value, options.bgcolor, options.do_use_dominant_color, options.is_fuzzy, options.do_split_vertically,
+            options.do_scan_wider, options.dominant_samples]
+
+
+def get_cache_key(image_file, options) -> str:
+    # 이미지 파일 내용의 해시와 자르는 위치에 영향을 주는 옵션으로 캐시 키를 만듦
+    content_hash = hashlib.sha256()
+    with open(image_file, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            content_hash.update(chunk)
+    parameters = [cache_version, content_hash.hexdigest()] + get_split_parameters(options)
+    return hashlib.sha256(json.dumps(parameters).encode()).hexdigest()
+
+
+def load_cached_cutting_points(cache_dir, key) -> Optional[Dict[str, Any]]:
+    path = os.path.join(cache_dir, key + ".json")
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+        # 최근에 사용한 항목이 늦게 지워지도록 수정 시각을 갱신함
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    if entry.get("version") != cache_version:
+        return None
+    return entry
+
+
+def store_cached_cutting_points(cache_dir, key, entry) -> None:
+    # 여러 작업 프로세스가 동시에 쓸 수 있으므로 임시 파일에 쓴 후 이름을 바꿈
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = os.path.join(cache_dir, "%s.%d.tmp" % (key, os.getpid()))
+        with open(temp_path, "w") as f:
+            json.dump(dict(entry, version=cache_version), f)
+        os.replace(temp_path, os.path.join(cache_dir, key + ".json"))
+        evict_cache(cache_dir, default_cache_size * 1024 * 1024)
+    except OSError as e:
+        sys.stderr.write("Warning: can't write the cache: %s\n" % e)
+
+
+def evict_cache(cache_dir, max_size) -> None:
+    # 캐시 디렉토리가 max_size보다 커지면 오래 사용하지 않은 항목부터 지움
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".json"):
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total_size = sum(size for (_, size, _) in entries)
+    for (_, size, name) in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            pass
+        total_size -= size
+
+
+def clear_cache(cache_dir) -> None:
+    if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            if name.endswith(".json") or name.endswith(".tmp"):
+                os.remove(os.path.join(cache_dir, name))
+
+
+def get_prefix_hash(im, length) -> str:
+    # 이미지의 맨 위부터 length 행까지의 픽셀 (P 모드이면 팔레트도 포함) 해시
+    (width, height) = im.size
+    digest = hashlib.sha256(json.dumps([im.mode, width, length]).encode())
+    if im.mode == "P":
+        digest.update(bytes(im.getpalette() or []))
+    chunk_height = max(1, profile_chunk_pixels // max(width, 1))
+    for y in range(0, length, chunk_height):
+        digest.update(im.crop((0, y, width, min(length, y + chunk_height))).tobytes())
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_file, im, name_prefix, ext, options, log=print) -> Optional[Dict[str, Any]]:
+    # 이전에 자른 결과를 이어서 쓸 수 있으면 그 기록을 반환함
+    # 옵션, 모드, 너비가 같고 세로 이미지가 아래로만 늘어났으며, 마지막 조각 위의 행들과 그 위의 조각 파일들이 그대로여야 함
+    try:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    (width, height) = im.size
+    if manifest.get("version") != manifest_version or manifest["parameters"] != json.loads(json.dumps(get_split_parameters(options))) or manifest["mode"] != im.mode:
+        log("incremental: options or image mode changed, splitting the whole image")
+        return None
+    if manifest["orientation"] != "vertical" or manifest["size"][0] != width or manifest["size"][1] > height or len(manifest["pieces"]) < 2:
+        log("incremental: image did not grow at the bottom, splitting the whole image")
+        return None
+    for (i, piece) in enumerate(manifest["pieces"][:-1]):
+        piece_name = name_prefix + "." + str(i + 1) + ext
+        if piece["file"] != os.path.basename(piece_name) or not os.path.isfile(piece_name) or os.path.getsize(piece_name) != piece["bytes"]:
+            log("incremental: %s is missing or changed, splitting the whole image" % piece_name)
+            return None
+    if get_prefix_hash(im, manifest["pieces"][-1]["box"][1]) != manifest["prefix_hash"]:
+        log("incremental: image changed above the last cut, splitting the whole image")
+        return None
+    return manifest
+
+
+def store_manifest(manifest_file, entry) -> None:
+    # 다른 프로세스가 읽는 중일 수 있으므로 임시 파일에 쓴 후 이름을 바꿈
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hb:n:m:c:t:s:a:vwi")
+        temp_path = "%s.%d.tmp" % (manifest_file, os.getpid())
+        with open(temp_path, "w") as f:
+            json.dump(dict(entry, version=manifest_version), f)
+        os.replace(temp_path, manifest_file)
+    except OSError as e:
+        sys.stderr.write("Warning: can't write the manifest: %s\n" % e)
+
+
+def is_split_piece(path) -> bool:
+    # 이전에 잘라서 저장한 조각(name.N.ext)이나 미리보기(name.N.pSIZE.ext, name.pSIZE.ext)인지 확인 (같은 디렉토리에 원본 name.ext가 있는 경우만)
+    (name_prefix, ext) = os.path.splitext(path)
+    (original_prefix, number) = os.path.splitext(name_prefix)
+    if number[:2] == ".p" and number[2:].isdigit():
+        if os.path.isfile(original_prefix + ext):
+            return True
+        (original_prefix, number) = os.path.splitext(original_prefix)
+    return number[1:].isdigit() and os.path.isfile(original_prefix + ext)
+
+
+def expand_image_files(args) -> List[str]:
+    # 명령행 인자의 파일, glob 패턴, 디렉토리를 이미지 파일 목록으로 바꿈
+    image_files: List[str] = []
+    for arg in args:
+        if os.path.isdir(arg):
+            for name in sorted(os.listdir(arg)):
+                path = os.path.join(arg, name)
+                if os.path.isfile(path) and os.path.splitext(name)[1].lower() in image_extensions and not is_split_piece(path):
+                    image_files.append(path)
+        elif glob.has_magic(arg):
+            image_files.extend(path for path in sorted(glob.glob(arg)) if os.path.isfile(path) and not is_split_piece(path))
+        else:
+            image_files.append(arg)
+    # 같은 파일을 여러 작업 프로세스가 동시에 처리하지 않도록 중복을 제거함
+    return list(dict.fromkeys(image_files))
+
+
+def split_report_file(image_file, options, log=log_nothing, source=None, do_trace=False) -> Dict[str, Any]:
+    # 파일 하나를 처리하고 결과 코드, 픽셀 수, 소요 시간, 오류 메시지, 조각 목록을 담은 결과를 반환함
+    # 예외가 발생해도 결과에 오류로 기록하므로 일괄 처리 중 한 파일의 실패가 나머지 파일의 처리를 막지 않음
+    # do_trace이면 Tracer의 기록을 결과의 "trace"에 담음 (작업 프로세스에서 실행해도 결과와 함께 전달됨)
+    start_time = time.time()
+    report: Dict[str, Any] = {"file": image_file, "error": ""}
+    tracer = Tracer() if do_trace else no_trace
+    try:
+        report["result"] = split_image_file(image_file, options, log, report, source, tracer)
+    except Exception as e:
+        report["result"] = -1
+        report["error"] = "%s: %s" % (type(e).__name__, e)
+    report["pixels"] = report.get("width", 0) * report.get("height", 0)
+    report["elapsed"] = time.time() - start_time
+    if do_trace:
+        report["trace"] = tracer.get_trace()
+    return report
+
+
+def estimate_file_memory(image_file, options) -> int:
+    # 헤더만 읽어서 estimate_split_memory()로 추정함 (읽을 수 없는 파일은 바로 실패하므로 0)
+    try:
+        with Image.open(image_file) as im:
+            return estimate_split_memory(im.size, im.mode, options, options.do_stream and is_strip_decodable(image_file, im))
+    except Exception:
+        return 0
+
+
+def split_batch(image_files, options, num_workers, log=print, do_trace=False) -> Dict[str, Any]:
+    # 여러 이미지를 작업 프로세스 풀에서 나눠서 처리하고 파일별 결과와 전체 처리량을 반환함
+    # options.memory_limit이 주어지면 실행 중인 작업들의 추정 메모리 합이 이를 넘지 않는 동안만 순서대로 다음 작업을 시작함
+    memory_limit = options.memory_limit * 1024 * 1024
+    log("batch: %d files, %d workers%s" % (len(image_files), num_workers, ", memory limit %d MB" % options.memory_limit if memory_limit > 0 else ""))
+    start_time = time.time()
+    reports: Dict[str, Dict[str, Any]] = {}
+    order = {image_file: i for (i, image_file) in enumerate(image_files)}
+    estimates: Dict[str, int] = {}
+    pending = list(image_files)
+    while pending:
+        crashed: List[str] = []
+        waiting = deque(pending)
+        running: Dict[concurrent.futures.Future, str] = {}
+        used_memory = 0
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+            while waiting or running:
+                while waiting and not crashed:
+                    if memory_limit > 0 and waiting[0] not in estimates:
+                        estimates[waiting[0]] = estimate_file_memory(waiting[0], options)
+                    memory = estimates.get(waiting[0], 0)
+                    # 실행 중인 작업이 없으면 한도를 넘는 작업도 혼자 실행함
+                    if memory_limit > 0 and running and (len(running) >= num_workers or used_memory + memory > memory_limit):
+                        break
+                    image_file = waiting.popleft()
+                    # 파일별 진단 메시지는 출력하지 않음
+                    running[executor.submit(split_report_file, image_file, options, log_nothing, None, do_trace)] = image_file
+                    used_memory += memory
+                if not running:
+                    break
+                (done, _) = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in sorted(done, key=lambda future: order[running[future]]):
+                    image_file = running.pop(future)
+                    used_memory -= estimates.get(image_file, 0)
+                    try:
+                        report = future.result()
+                    except concurrent.futures.process.BrokenProcessPool:
+                        crashed.append(image_file)
+                        continue
+                    reports[image_file] = report
+                    status = "ok" if report["result"] == 0 else "error"
+                    log("[%d/%d] %s %s (%.1f MP, %.2fs)%s" % (len(reports), len(image_files), status, image_file, report["pixels"] / 1000000, report["elapsed"], " " + report["error"] if report["error"] else ""))
+        # 풀이 망가진 후에는 시작하지 않은 작업도 결과를 받지 못한 것으로 처리함
+        crashed.extend(waiting)
+        crashed.sort(key=order.__getitem__)
+        if crashed and (len(crashed) == 1 or num_workers == 1):
+            # 작업 프로세스가 하나뿐이면 처음으로 결과를 받지 못한 파일이 프로세스를 죽게 만든 파일임
+            image_file = crashed.pop(0)
+            reports[image_file] = {"file": image_file, "result": -1, "pixels": 0, "elapsed": 0.0, "error": "worker process died"}
+            log("[%d/%d] error %s (worker process died)" % (len(reports), len(image_files), image_file))
+        # 풀이 망가져서 결과를 받지 못한 나머지 파일은 작업 프로세스 하나로 다시 처리함
+        (pending, num_workers) = (crashed, 1)
+    elapsed = time.time() - start_time
+    num_failures = len([report for report in reports.values() if report["result"] != 0])
+    total_pixels = sum(report["pixels"] for report in reports.values())
+    summary: Dict[str, Any] = {
+        "files": [reports[image_file] for image_file in image_files],
+        "num_ok": len(image_files) - num_failures,
+        "num_failed": num_failures,
+        "elapsed": elapsed,
+        "files_per_second": len(image_files) / elapsed if elapsed > 0 else 0,
+        "megapixels_per_second": total_pixels / 1000000 / elapsed if elapsed > 0 else 0,
+    }
+    log("batch: %d ok, %d failed, %.2fs, %.2f files/s, %.1f MP/s" % (summary["num_ok"], num_failures, elapsed, summary["files_per_second"], summary["megapixels_per_second"]))
+    return summary
+
+
+def merge_trace_summaries(summaries) -> Dict[str, Dict[str, Any]]:
+    # 여러 파일의 Tracer.get_summary()를 단계 이름별로 합침
+    merged: Dict[str, Dict[str, Any]] = {}
+    for summary in summaries:
+        for (stage, total) in summary.items():
+            merged_total = merged.setdefault(stage, {})
+            for (key, value) in total.items():
+                merged_total[key] = merged_total.get(key, 0) + value
+    return merged
+
+
+def report_trace(trace, do_print_profile, trace_file) -> None:
+    # --profile이면 단계별 합계를 소요 시간 순서로 출력하고, --trace이면 전체 기록을 JSON으로 저장함
+    if do_print_profile:
+        print("profile: %.3fs" % trace["elapsed"])
+        for (stage, total) in sorted(trace["summary"].items(), key=lambda item: -item[1]["elapsed"]):
+            counters = "".join(" %s=%d" % (key, total[key]) for key in ("pixels", "checks", "scanned", "bytes") if key in total)
+            print("profile: %-12s %5d %9.3fs%s" % (stage, total["count"], total["elapsed"], counters))
+    if trace_file is not None:
+        if trace_file == "-":
+            json.dump(trace, sys.stderr)
+            sys.stderr.write("\n")
+        else:
+            with open(trace_file, "w") as f:
+                json.dump(trace, f)
+
+
+split_short_options = "b:n:m:c:t:s:a:vw" # 자르는 방법에 관한 명령행 옵션 (set_split_option()이 처리함)
+split_long_options = ["stream", "memory-budget=", "memory-limit=", "save-workers=", "dominant-samples=", "coarse=", "max-length=", "max-pixels=", "fit-webp",
+                      "rgb", "incremental", "previews=", "preset=", "archive=", "cbz", "cache", "cache-dir=", "no-cache", "refresh-cache"]
+
+
+def set_split_option(options, o, a) -> bool:
+    # 자르는 방법에 관한 명령행 옵션 하나를 options에 반영함 (그런 옵션이 아니면 False, 값이 잘못되면 ValueError)
+    if o == "-b":
+        options.bandwidth = int(a)
+    elif o == "-m":
+        options.margin = int(a)
+    elif o == "-n":
+        options.num_units = int(a)
+        if options.num_units < 2:
+            raise ValueError("n must be more than 1")
+    elif o == "-c":
+        color_option = determine_color_option(a)
+        if not color_option:
+            raise ValueError("unknown bgcolor or method '%s'" % a)
+        (options.bgcolor, options.is_fuzzy, options.do_use_dominant_color) = color_option
+    elif o == "-t":
+        options.diff_threshold = float(a)
+    elif o == "-s":
+        options.size_threshold = int(a)
+    elif o == "-a":
+        options.acceptable_diff_of_color_value = int(a)
+    elif o == "-v":
+        options.do_split_vertically = True
+    elif o == "-w":
+        options.do_scan_wider = True
+    elif o == "--stream":
+        options.do_stream = True
+    elif o == "--memory-budget":
+        options.memory_budget = int(a)
+    elif o == "--memory-limit":
+        options.memory_limit = int(a)
+    elif o == "--save-workers":
+        options.save_workers = int(a)
+    elif o == "--dominant-samples":
+        options.dominant_samples = int(a)
+    elif o == "--coarse":
+        options.coarse_scale = int(a)
+    elif o == "--max-length":
+        options.max_piece_length = int(a)
+    elif o == "--max-pixels":
+        options.max_piece_pixels = int(a)
+    elif o == "--fit-webp":
+        (options.max_piece_length, options.max_piece_pixels) = (WEBP_MAX_DIMENSION, WEBP_MAX_PIXELS)
+    elif o == "--rgb":
+        options.do_convert_rgb = True
+    elif o == "--incremental":
+        options.do_incremental = True
+    elif o == "--previews":
+        options.preview_sizes = sorted({int(size) for size in a.split(",")}, reverse=True)
+        if not options.preview_sizes or options.preview_sizes[-1] <= 0:
+            raise ValueError("preview sizes must be positive")
+    elif o == "--preset":
+        if a not in output_presets:
+            raise ValueError("unknown preset '%s'" % a)
+        options.output_preset = a
+    elif o == "--archive":
+        options.archive = a
+    elif o == "--cbz":
+        options.archive = ""
+    elif o == "--cache":
+        options.cache_dir = default_cache_dir
+    elif o == "--cache-dir":
+        options.cache_dir = a
+    elif o == "--no-cache":
+        options.cache_dir = None
+    elif o == "--refresh-cache":
+        options.do_refresh_cache = True
+    else:
+        return False
+    return True
+
+
+def main() -> int:
+    # 옵션 처리
+    options = SplitOptions()
+    num_workers: Optional[int] = None
+    is_quiet: bool = False
+    do_print_json: bool = False
+    do_clear_cache: bool = False
+    merge_name: Optional[str] = None
+    do_print_profile: bool = False
+    trace_file: Optional[str] = None
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h" + split_short_options + "ij:q", split_long_options + ["quiet", "json", "merge=", "clear-cache", "profile", "trace="])
     except getopt.GetoptError:
         print_usage(sys.argv[0])
         sys.stderr.write("Error: invaild option definition\n")
         sys.exit(-1)
         
     for o, a in opts:
-        if o == "-b":
-            bandwidth = int(a)
-        elif o == "-m":
-            margin = int(a)
-        elif o == "-n":
-            num_units = int(a)
-            if num_units < 2:
-                print_usage()
-                sys.stderr.write("Error: n must be more than 1\n")
-                sys.exit(-1)
-        elif o == "-c":
-            color_option = determine_color_option(a)
-            if not color_option:
-                print_usage();
-                sys.exit(-1)
-            (bgcolor, is_fuzzy, do_use_dominant_color) = color_option
-        elif o == "-t":
-            diff_threshold = float(a)
-        elif o == "-s":
-            size_threshold = int(a)
-        elif o == "-a":
-            acceptable_diff_of_color_value = int(a)
-        elif o == "-v":
-            do_split_vertically = True
-        elif o == "-w":
-            do_scan_wider = True
+        try:
+            if set_split_option(options, o, a):
+                continue
+        except ValueError as e:
+            print_usage(sys.argv[0])
+            sys.stderr.write("Error: %s\n" % e)
+            sys.exit(-1)
+        if o == "-j":
+            num_workers = int(a)
+        elif o in ("-q", "--quiet"):
+            is_quiet = True
+        elif o == "--json":
+            do_print_json = True
+        elif o == "--merge":
+            merge_name = a
+        elif o == "--clear-cache":
+            do_clear_cache = True
+        elif o == "--profile":
+            do_print_profile = True
+        elif o == "--trace":
+            trace_file = a
         else:
             print_usage(sys.argv[0])
             sys.exit(-1)
+    if do_clear_cache:
+        clear_cache(options.cache_dir or default_cache_dir)
+        if len(args) < 1:
+            return 0
     if len(args) < 1:
-        print_usage()
+        print_usage(sys.argv[0])
         sys.stderr.write("Error: The image file is not specified\n")
         sys.exit(-1)
-    imageFile = args[0]
-    (name_prefix, ext) = os.path.splitext(imageFile)
-    print("bandwidth=", bandwidth)
-    print("num_units=", num_units)
-    print("margin=", margin)
-    print("diff_threshold=", diff_threshold)
-    print("size_threshold=", size_threshold)
-    print("acceptable_diff_of_color_value=", acceptable_diff_of_color_value)
-    print("arg=", args[0])
-
-    im = Image.open(imageFile)
+    # --quiet, --json이면 진단 메시지를 출력하지 않음 (압축 파일을 표준 출력에 쓰면 표준 에러에 출력함)
+    log = log_nothing if is_quiet or do_print_json else log_to_stderr if options.archive == "-" else print
+    image_files = expand_image_files(args)
+    do_trace = do_print_profile or trace_file is not None
+    if len(image_files) == 0:
+        sys.stderr.write("Error: no image files found\n")
+        return -1
+    if options.archive and merge_name is None and (len(image_files) > 1 or num_workers is not None or os.path.isdir(args[0])):
+        sys.stderr.write("Error: --archive takes a single image, use --cbz for several images\n")
+        return -1
+    if options.archive is not None and options.preview_sizes:
+        sys.stderr.write("Error: --previews can't be used with --archive or --cbz\n")
+        return -1
+    if options.archive == "-" and (do_print_json or do_print_profile):
+        sys.stderr.write("Error: --json and --profile can't be printed with --archive -\n")
+        return -1
+    if merge_name is not None or (len(image_files) == 1 and num_workers is None and not os.path.isdir(args[0])):
+        # --merge이면 입력 이미지들을 이어 붙인 이미지를 만들지 않고 바로 잘라서 merge_name.N.ext로 저장함
+        (image_file, source) = (merge_name, image_files) if merge_name is not None else (image_files[0], None)
+        if not do_print_json:
+            tracer = Tracer() if do_trace else no_trace
+            result = split_image_file(image_file, options, log, source=source, trace=tracer)
+            if do_trace:
+                report_trace(tracer.get_trace(), do_print_profile, trace_file)
+            return result
+        report = split_report_file(image_file, options, source=source, do_trace=do_trace)
+        if do_trace:
+            trace = report.pop("trace")
+            report_trace(trace, False, trace_file)
+            if do_print_profile:
+                report["profile"] = trace["summary"]
+        print(json.dumps(report))
+        return report["result"]
+    summary = split_batch(image_files, options, num_workers or os.cpu_count() or 1, log, do_trace)
+    if do_trace:
+        # 파일별 기록은 --trace 파일에만 쓰고, 요약은 모든 파일의 합계로 출력함
+        traces = [dict(file=report["file"], **report.pop("trace")) for report in summary["files"] if "trace" in report]
+        batch_trace = {"elapsed": summary["elapsed"], "files": traces, "summary": merge_trace_summaries([trace["summary"] for trace in traces])}
+        report_trace(batch_trace, do_print_profile and not do_print_json, trace_file)
+        if do_print_profile:
+            summary["profile"] = batch_trace["summary"]
+    if do_print_json:
+        print(json.dumps(summary))
+    return 0 if summary["num_failed"] == 0 else -1
+
+
+def open_image(image, options, trace=no_trace) -> Tuple[Any, Optional[str]]:
+    # 경로, 파일 객체 또는 바이트이면 이미지를 열고 (스트리밍 모드이면 StripImage로), RGB 이미지와 원래 포맷을 반환함
+    # L, P 모드 이미지는 options.do_convert_rgb가 아니면 변환하지 않고 그대로 반환함 (조각도 원래 모드로 저장됨)
+    # 경로의 목록이면 세로로 이어 붙인 하나의 이미지로 취급함 (SliceImage)
+    im: Any
+    with trace.stage("decode"):
+        if isinstance(image, Image.Image):
+            im = image
+        elif isinstance(image, (list, tuple)):
+            im = SliceImage(image)
+        elif isinstance(image, (bytes, bytearray, memoryview)):
+            im = Image.open(io.BytesIO(image))
+        elif options.do_stream:
+            im = StripImage(image, options.memory_budget * 1024 * 1024)
+        else:
+            im = Image.open(image)
+        if isinstance(im, Image.Image):
+            # 처음 픽셀에 접근할 때 디코딩하는 대신 여기서 디코딩해서 소요 시간을 따로 잴 수 있게 함
+            im.load()
     format = im.format
-    print("format=%s" % format)
-    if im.mode != "RGB":
-        im = im.convert("RGB")
+    if im.mode != "RGB" and (options.do_convert_rgb or im.mode not in native_modes):
+        with trace.stage("convert", mode=im.mode):
+            im = im.convert("RGB")
+    return (im, format)
+
+
+def get_split_layout(im, options, log=print, trace=no_trace) -> Tuple[str, int, Tuple[int, int, int]]:
+    # 자르는 방향, 조각의 기준 크기, 배경색을 결정함
     (width, height) = im.size
-    print("width=%d, height=%d" % (width, height))
-    if width > height or do_split_vertically:
+    log("width=%d, height=%d" % (width, height))
+    if width > height or options.do_split_vertically:
         orientation = "horizontal"
     else:
         orientation = "vertical"
-    print("orientation=", orientation)
+    log("orientation=", orientation)
+    unit_width = get_unit_width(im, orientation, options)
+    log("unit_width=", unit_width)
+    bgcolor = options.bgcolor
+    with trace.stage("bgcolor"):
+        if options.do_use_dominant_color == True:
+            bgcolor = determine_dominant_color(im, options.dominant_samples)
+        if bgcolor == None:
+            bgcolor = determine_bgcolor(im, 10)
+    log("bgcolor=", bgcolor)
+    return (orientation, unit_width, bgcolor)
+
+
+def get_unit_width(im, orientation, options) -> int:
+    # -n으로 자를 때 조각의 기준 크기
+    (width, height) = im.size
     if orientation == "horizontal":
-        unit_width = int((width - bandwidth * (num_units - 1)) / num_units)
-    else:
-        unit_width = int((height - bandwidth * (num_units - 1)) / num_units)
-    print("unit_width=", unit_width)
-    if do_use_dominant_color == True:
-        bgcolor = determine_dominant_color(im)
-    if bgcolor == None:
-        bgcolor = determine_bgcolor(im, 10)
-    print("bgcolor=", bgcolor)
+        return int((width - options.bandwidth * (options.num_units - 1)) / options.num_units)
+    return int((height - options.bandwidth * (options.num_units - 1)) / options.num_units)
 
-    # size threshold check
+
+def is_below_size_threshold(im, orientation, size_threshold) -> bool:
+    (width, height) = im.size
     if orientation == "horizontal":
-        if width <= size_threshold:
-            return -1
+        return width <= size_threshold
+    return height <= size_threshold
+
+
+def is_split_requested(options) -> bool:
+    # -n 또는 조각의 최대 크기가 지정되어 잘라야 하는지 확인
+    return options.num_units > 1 or options.max_piece_length > 0 or options.max_piece_pixels > 0
+
+
+def get_max_piece_length(options, breadth) -> int:
+    # 조각의 최대 크기를 자르는 방향의 최대 길이로 바꿈 (제한이 없으면 0)
+    limits = []
+    if options.max_piece_length > 0:
+        limits.append(options.max_piece_length)
+    if options.max_piece_pixels > 0:
+        limits.append(max(1, options.max_piece_pixels // max(breadth, 1)))
+    return min(limits) if limits else 0
+
+
+def get_fitting_cuts(candidates, is_forced, length, max_length) -> List[int]:
+    # 자르는 위치의 후보(0과 length 포함, 간격은 max_length 이하) 중에서 모든 조각이 max_length 이하가 되는 최소한의 위치를 고름
+    # 조각의 갯수는 앞에서부터 가장 멀리 자르는 방법으로 정하고, 각 위치는 남은 길이를 남은 조각 수로 나눈 길이에 가장 가까운 후보로 정함
+    # 강제로 넣은 후보(배경색 띠가 아닌 위치)는 범위 안에 배경색 띠가 없을 때만 고름
+    num_cuts = 0
+    p = 0
+    while length - p > max_length:
+        p = int(candidates[numpy.searchsorted(candidates, p + max_length, side="right") - 1])
+        num_cuts += 1
+    # 뒤에서부터 가장 멀리 자를 때의 위치가 각 자르는 위치의 하한임 (그보다 앞에서 자르면 남은 조각 수로 끝까지 자를 수 없음)
+    lower_bounds = [length] * (num_cuts + 1)
+    for k in range(num_cuts - 1, -1, -1):
+        lower_bounds[k] = int(candidates[numpy.searchsorted(candidates, lower_bounds[k + 1] - max_length)])
+    cuts: List[int] = []
+    p = 0
+    for k in range(num_cuts):
+        i0 = numpy.searchsorted(candidates, max(lower_bounds[k], p + 1))
+        i1 = numpy.searchsorted(candidates, p + max_length, side="right")
+        target = p + (length - p) / (num_cuts - k + 1)
+        (positions, forced) = (candidates[i0:i1], is_forced[i0:i1])
+        if not forced.all():
+            positions = positions[~forced]
+        p = int(positions[numpy.argmin(numpy.abs(positions - target))])
+        cuts.append(p)
+    return cuts
+
+
+def iterate_fitting_cutting_points(im, orientation, bgcolor, max_length, options, log=print, trace=no_trace, origin=0) -> Iterator[Tuple[int, int, int, int]]:
+    # 모든 조각이 max_length 이하가 되도록 이미지 전체의 배경색 띠 중에서 자르는 위치를 골라서 조각의 영역을 반환함
+    # origin은 세로 이미지의 메시지에 출력할 때 y 좌표에 더하는 값 (iterate_cutting_points()와 같음)
+    # 조각을 줄이지 않고 원래 해상도로 한 번에 인코딩할 수 있도록, 배경색 띠가 없는 구간은 강제로 자름
+    bandwidth = options.bandwidth
+    (width, height) = im.size
+    length = height if orientation == "vertical" else width
+    log("max_piece_length=", max_length)
+    with trace.stage("band_index", method="profile"):
+        diff_limit = get_diff_limit(im, orientation, options.margin, options.diff_threshold)
+        profile = get_mismatch_profile(im, orientation, bgcolor, options.margin, options.acceptable_diff_of_color_value, options.is_fuzzy, trace, int(max(diff_limit, 0)))
+        band_index = get_band_index(profile, bandwidth, diff_limit)
+    # 띠의 시작 위치 s에 대해 find_bgcolor_band()와 같이 s + bandwidth / 2에서 자름
+    band_cuts = numpy.flatnonzero(band_index[:length] == numpy.arange(length)) + bandwidth // 2
+    points = numpy.concatenate(([0], band_cuts[(band_cuts > 0) & (band_cuts < length)], [length]))
+    candidates: List[numpy.ndarray] = [points]
+    for i in numpy.flatnonzero(numpy.diff(points) > max_length):
+        # 띠가 없는 구간은 max_length 이하의 같은 길이로 나누는 위치들을 후보로 넣음
+        (gap_start, gap) = (int(points[i]), int(points[i + 1] - points[i]))
+        num_parts = -(-gap // max_length)
+        candidates.append(gap_start + numpy.arange(1, num_parts) * gap // num_parts)
+    forced_points = numpy.concatenate(candidates[1:]) if len(candidates) > 1 else numpy.zeros(0, dtype=points.dtype)
+    all_points = numpy.concatenate((points, forced_points))
+    order = numpy.argsort(all_points, kind="stable")
+    is_forced = (numpy.arange(len(all_points)) >= len(points))[order]
+    with trace.stage("fit", candidates=len(all_points)):
+        cuts = get_fitting_cuts(all_points[order], is_forced, length, max_length)
+    log("num_pieces=", len(cuts) + 1)
+    forced_cuts = set(int(p) for p in forced_points)
+    p0 = 0
+    for p1 in cuts + [length]:
+        if p1 in forced_cuts:
+            log("No background band within the max piece length, using forced cutting point=", p1 + origin if orientation == "vertical" else p1)
+        if orientation == "vertical":
+            log("crop: x0=%d, y0=%d, width=%d, y1=%d" % (0, p0 + origin, width, p1 + origin))
+            yield (0, p0, width, p1)
+        else:
+            log("crop: x0=%d, y0=%d, x1=%d, height=%d" % (p0, 0, p1, height))
+            yield (p0, 0, p1, height)
+        p0 = p1
+
+
+def iterate_cutting_points(im, orientation, unit_width, bgcolor, options, log=print, trace=no_trace, origin=0) -> Iterator[Tuple[int, int, int, int]]:
+    # 마지막 조각을 포함한 각 조각의 영역 (x0, y0, x1, y1)을 자르는 순서대로 반환함
+    # origin은 메시지에 출력할 때 y 좌표에 더하는 값 (이어서 자를 때 잘라낸 아랫부분의 좌표를 전체 이미지의 좌표로 출력함)
+    # 스트리밍 모드에서는 띠를 찾는 데 필요한 행까지만 읽으므로, 조각의 영역이 정해지는 대로 바로 잘라서 저장할 수 있음
+    bandwidth = options.bandwidth
+    num_units = options.num_units
+    margin = options.margin
+    diff_threshold = options.diff_threshold
+    acceptable_diff_of_color_value = options.acceptable_diff_of_color_value
+    is_fuzzy = options.is_fuzzy
+    do_scan_wider = options.do_scan_wider
+    (width, height) = im.size
+    (x0, y0) = (0, 0)
+    max_length = get_max_piece_length(options, width if orientation == "vertical" else height)
+    if max_length > 0:
+        yield from iterate_fitting_cutting_points(im, orientation, bgcolor, max_length, options, log, trace, origin)
+        return
+
+    # 배경색 띠의 위치를 한 번만 계산해서 모든 띠 탐색에 사용함
+    band_index: Any
+    coarse_scale = get_coarse_scale(options.coarse_scale, bandwidth, (width if orientation == "vertical" else height) - 2 * margin, get_diff_limit(im, orientation, margin, diff_threshold))
+    # 스트리밍, 축소 이미지 방식은 띠를 찾을 때 필요한 줄만 검사하므로 검사한 픽셀 수가 각 띠 탐색에 기록됨
+    if (options.do_stream or isinstance(im, SliceImage)) and orientation == "vertical":
+        with trace.stage("band_index", method="stream"):
+            band_index = StreamingBandIndex(im, bgcolor, margin, acceptable_diff_of_color_value, is_fuzzy, bandwidth, get_diff_limit(im, orientation, margin, diff_threshold), trace)
+    elif coarse_scale > 1 and isinstance(im, Image.Image) and im.mode != "P" and bgcolor != (-1, -1, -1) and not is_fuzzy:
+        with trace.stage("band_index", method="coarse", scale=coarse_scale):
+            band_index = CoarseBandIndex(im, orientation, bgcolor, margin, acceptable_diff_of_color_value, bandwidth, get_diff_limit(im, orientation, margin, diff_threshold), coarse_scale, trace)
     else:
-        if height <= size_threshold:
-            return -1
+        with trace.stage("band_index", method="profile"):
+            diff_limit = get_diff_limit(im, orientation, margin, diff_threshold)
+            profile = get_mismatch_profile(im, orientation, bgcolor, margin, acceptable_diff_of_color_value, is_fuzzy, trace, int(max(diff_limit, 0)))
+            band_index = get_band_index(profile, bandwidth, diff_limit)
+    for i in range(0, num_units - 1):  # Changed: only go up to num_units - 1
+        log("\ni=%d, num_units=%d" % (i, num_units))
+        if orientation == "horizontal":
+            (x1, y1) = (int(max((unit_width + bandwidth) * (i + 1), x0 + unit_width)), y0)
+            if do_scan_wider:
+                (x1, y1) = (int(x1 * 0.9), y1)
+        else:
+            (x1, y1) = (x0, int(max((unit_width + bandwidth) * (i + 1), y0 + unit_width)))
+            if do_scan_wider:
+                (x1, y1) = (x1, int(y1 * 0.9))
+        log("(x0, y0)=", (x0, y0 + origin))
+        log("(x1, y1)=", (x1, y1 + origin))
         
-    (x0, y0) = (0, 0)
-    cutting_points = []  # Store all cutting points
-    actual_units_created = 0  # Track actual number of units created
-    
-    if num_units > 1:
-        for i in range(0, num_units - 1):  # Changed: only go up to num_units - 1
-            print("\ni=%d, num_units=%d" % (i, num_units))
-            if orientation == "horizontal":
-                (x1, y1) = (int(max((unit_width + bandwidth) * (i + 1), x0 + unit_width)), y0)
-                if do_scan_wider:
-                    (x1, y1) = (int(x1 * 0.9), y1)
-            else:
-                (x1, y1) = (x0, int(max((unit_width + bandwidth) * (i + 1), y0 + unit_width)))
-                if do_scan_wider:
-                    (x1, y1) = (x1, int(y1 * 0.9))
-            print("(x0, y0)=", (x0, y0))
-            print("(x1, y1)=", (x1, y1))
-            
-            # Ensure we don't exceed image boundaries
-            if orientation == "horizontal":
-                if x1 >= width - bandwidth:
-                    x1 = width
-                if x0 >= width - bandwidth:
-                    print(f"Reached end of image at x0={x0}, width={width}")
-                    break
-            else:
-                if y1 >= height - bandwidth:
-                    y1 = height
-                if y0 >= height - bandwidth:
-                    print(f"Reached end of image at y0={y0}, height={height}")
-                    break
-                    
-            # 배경색으로만 구성된 띠를 찾아냄
-            (x1, y1) = find_bgcolor_band(im, bgcolor, orientation, bandwidth, x1, y1, margin, diff_threshold, acceptable_diff_of_color_value, is_fuzzy)
-            print("cutting point=", (x1, y1))
-            
-            # If no suitable cutting point found, use calculated position
-            if (x1, y1) == (-1, -1):
-                if orientation == "horizontal":
-                    x1 = min(width, int((width * (i + 1)) / num_units))
-                else:
-                    y1 = min(height, int((height * (i + 1)) / num_units))
-                print("Using fallback cutting point=", (x1, y1))
-
-            # Ensure coordinates are valid and within image bounds
-            if orientation == "horizontal":
-                if x1 <= x0:
-                    x1 = width
-                if x0 < 0:
-                    x0 = 0
-                if x1 > width:
-                    x1 = width
-            else:
-                if y1 <= y0:
-                    y1 = height
-                if y0 < 0:
-                    y0 = 0
-                if y1 > height:
-                    y1 = height
-
-            # Additional safety check: if we're at the end of the image, break
+        # Ensure we don't exceed image boundaries
+        if orientation == "horizontal":
+            if x1 >= width - bandwidth:
+                x1 = width
+            if x0 >= width - bandwidth:
+                log(f"Reached end of image at x0={x0}, width={width}")
+                break
+        else:
+            if y1 >= height - bandwidth:
+                y1 = height
+            if y0 >= height - bandwidth:
+                log(f"Reached end of image at y0={y0 + origin}, height={height + origin}")
+                break
+                
+        # 배경색으로만 구성된 띠를 찾아냄
+        with trace.stage("band", i=i, position=x1 if orientation == "horizontal" else y1) as event:
+            (x1, y1) = find_bgcolor_band(im, bgcolor, orientation, bandwidth, x1, y1, margin, diff_threshold, acceptable_diff_of_color_value, is_fuzzy, band_index, log, trace, origin)
+            event["cut"] = x1 if orientation == "horizontal" else y1
+        log("cutting point=", (x1, y1 + origin if y1 >= 0 else y1))
+        
+        # If no suitable cutting point found, use calculated position
+        if (x1, y1) == (-1, -1):
             if orientation == "horizontal":
-                if x0 >= width:
-                    print(f"Reached end of image at x0={x0}, width={width}")
-                    break
+                x1 = min(width, int((width * (i + 1)) / num_units))
             else:
-                if y0 >= height:
-                    print(f"Reached end of image at y0={y0}, height={height}")
-                    break
+                y1 = min(height, int((height * (i + 1)) / num_units))
+            log("Using fallback cutting point=", (x1, y1 + origin))
 
-            cutting_points.append((x0, y0, x1, y1))
-            sub_img_name = name_prefix + "." + str(i + 1) + ext
-                    
-            # 잘라서 저장
-            if orientation == "horizontal":
-                print("crop: x0=%d, y0=%d, x1=%d, height=%d" % (x0, y0, x1, height))
-                # Ensure valid crop coordinates
-                if x1 > x0 and x0 >= 0 and x1 <= width:
-                    subIm = im.crop((x0, y0, x1, height))
-                else:
-                    print(f"Invalid crop coordinates: x0={x0}, x1={x1}, width={width}")
-                    sys.stderr.write("Error: invalid crop coordinates\n")
-                    return -1
-            else:
-                print("crop: x0=%d, y0=%d, width=%d, y1=%d" % (x0, y0, width, y1))
-                # Ensure valid crop coordinates
-                if y1 > y0 and y0 >= 0 and y1 <= height:
-                    subIm = im.crop((x0, y0, width, y1))
-                else:
-                    print(f"Invalid crop coordinates: y0={y0}, y1={y1}, height={height}")
-                    sys.stderr.write("Error: invalid crop coordinates\n")
-                    return -1
-
-            # Check if cropped image is valid
-            if subIm.size[0] <= 0 or subIm.size[1] <= 0:
-                print(f"Invalid cropped image size: {subIm.size}")
-                sys.stderr.write("Error: cropped image has zero size\n")
-                return -1
-
-            # Save with WebP fallback
-            try:
-                subIm.save(sub_img_name, quality=default_quality, format=format)
-            except Exception as e:
-                print(f"Failed to save as {format}: {e}")
-                # Try WebP with lower quality
-                try:
-                    subIm.save(sub_img_name, quality=80, format='WEBP')
-                except Exception as e2:
-                    print(f"Failed to save as WebP: {e2}")
-                    # Final fallback to JPEG
-                    try:
-                        subIm.save(sub_img_name, quality=85, format='JPEG')
-                    except Exception as e3:
-                        print(f"All save methods failed: {e3}")
-                        sys.stderr.write("Error: can't save the split image\n")
-                        return -1
-            
-            print("save: " + sub_img_name)
-            actual_units_created += 1
-            (x0, y0) = (x1, y1)
+        # Ensure coordinates are valid and within image bounds
+        if orientation == "horizontal":
+            if x1 <= x0:
+                x1 = width
+            if x0 < 0:
+                x0 = 0
+            if x1 > width:
+                x1 = width
+        else:
+            if y1 <= y0:
+                y1 = height
+            if y0 < 0:
+                y0 = 0
+            if y1 > height:
+                y1 = height
 
-        # 마지막 조각 저장 (필요한 경우에만)
-        print("Checking if final piece is needed...")
-        
-        # Check if we need a final piece
-        needs_final_piece = False
+        # Additional safety check: if we're at the end of the image, break
         if orientation == "horizontal":
-            if x0 < width:
-                needs_final_piece = True
+            if x0 >= width:
+                log(f"Reached end of image at x0={x0}, width={width}")
+                break
         else:
-            if y0 < height:
-                needs_final_piece = True
-        
-        if needs_final_piece:
-            print("Creating final piece...")
-            sub_img_name = name_prefix + "." + str(actual_units_created + 1) + ext
+            if y0 >= height:
+                log(f"Reached end of image at y0={y0 + origin}, height={height + origin}")
+                break
 
-            # 마지막 조각 저장
-            if orientation == "horizontal":
-                print("crop: x0=%d, y0=%d, width=%d, height=%d" % (x0, y0, width, height))
-                if x0 < width:
-                    subIm = im.crop((x0, y0, width, height))
-                else:
-                    print("Final crop would result in empty image")
-                    sys.stderr.write("Error: final crop would be empty\n")
-                    return -1
-            else:
-                print("crop: x0=%d, y0=%d, width=%d, height=%d" % (x0, y0, width, height))
-                if y0 < height:
-                    subIm = im.crop((x0, y0, width, height))
-                else:
-                    print("Final crop would result in empty image")
-                    sys.stderr.write("Error: final crop would be empty\n")
-                    return -1
-                
-            # Check if final cropped image is valid
-            if subIm.size[0] <= 0 or subIm.size[1] <= 0:
-                print(f"Invalid final cropped image size: {subIm.size}")
-                sys.stderr.write("Error: final cropped image has zero size\n")
-                return -1
-                
-            # Save with WebP fallback
-            try:
-                subIm.save(sub_img_name, quality=default_quality, format=format)
-            except Exception as e:
-                print(f"Failed to save as {format}: {e}")
-                # Try WebP with lower quality
-                try:
-                    subIm.save(sub_img_name, quality=80, format='WEBP')
-                except Exception as e2:
-                    print(f"Failed to save as WebP: {e2}")
-                    # Final fallback to JPEG
-                    try:
-                        subIm.save(sub_img_name, quality=85, format='JPEG')
-                    except Exception as e3:
-                        print(f"All save methods failed: {e3}")
-                        sys.stderr.write("Error: can't save the split image\n")
-                        return -1
-            
-            print("save: " + sub_img_name)
-            actual_units_created += 1
+        # 잘라낼 영역
+        if orientation == "horizontal":
+            log("crop: x0=%d, y0=%d, x1=%d, height=%d" % (x0, y0, x1, height))
+            # Ensure valid crop coordinates
+            if not (x1 > x0 and x0 >= 0 and x1 <= width):
+                log(f"Invalid crop coordinates: x0={x0}, x1={x1}, width={width}")
+                raise SplitError("invalid crop coordinates")
+            yield (x0, y0, x1, height)
         else:
-            print("No final piece needed - image already fully processed")
+            log("crop: x0=%d, y0=%d, width=%d, y1=%d" % (x0, y0 + origin, width, y1 + origin))
+            # Ensure valid crop coordinates
+            if not (y1 > y0 and y0 >= 0 and y1 <= height):
+                log(f"Invalid crop coordinates: y0={y0 + origin}, y1={y1 + origin}, height={height + origin}")
+                raise SplitError("invalid crop coordinates")
+            yield (x0, y0, width, y1)
+        (x0, y0) = (x1, y1)
+
+    # 마지막 조각 (필요한 경우에만)
+    log("Checking if final piece is needed...")
+    
+    # Check if we need a final piece
+    needs_final_piece = False
+    if orientation == "horizontal":
+        if x0 < width:
+            needs_final_piece = True
+    else:
+        if y0 < height:
+            needs_final_piece = True
+    
+    if needs_final_piece:
+        log("Creating final piece...")
+        log("crop: x0=%d, y0=%d, width=%d, height=%d" % (x0, y0 + origin, width, height + origin))
+        yield (x0, y0, width, height)
+    else:
+        log("No final piece needed - image already fully processed")
+
+
+def get_preview_name(image_name, size) -> str:
+    (name_prefix, ext) = os.path.splitext(image_name)
+    return "%s.p%d%s" % (name_prefix, size, ext)
+
+
+def make_previews(im, orientation, sizes) -> List[Image.Image]:
+    # 자르는 방향과 수직인 길이(세로 이미지는 너비)가 sizes의 각 크기(큰 것부터)가 되도록 줄인 미리보기들
+    # 앞 단계의 결과를 reduce()로 정수 배씩 줄여 가며 만들고 남은 비율만 resize()로 맞춤 (원래보다 크게 하지는 않음)
+    if im.mode not in ("L", "LA", "RGB", "RGBA"):
+        im = im.convert("RGB")
+    previews: List[Image.Image] = []
+    for size in sizes:
+        axis = 0 if orientation == "vertical" else 1
+        factor = im.size[axis] // size
+        if factor >= 2:
+            im = im.reduce(factor)
+        preview = im
+        if im.size[axis] > size:
+            scale = size / im.size[axis]
+            preview = im.resize((max(1, round(im.size[0] * scale)), max(1, round(im.size[1] * scale))), Image.Resampling.BILINEAR)
+        previews.append(preview)
+    return previews
+
+
+def stack_previews(tiles, orientation) -> Image.Image:
+    # 조각들의 미리보기를 자른 순서대로 이어 붙인 전체 이미지의 개요
+    if orientation == "vertical":
+        size = (max(tile.size[0] for tile in tiles), sum(tile.size[1] for tile in tiles))
+    else:
+        size = (sum(tile.size[0] for tile in tiles), max(tile.size[1] for tile in tiles))
+    overview = Image.new(tiles[0].mode, size, "white")
+    offset = 0
+    for tile in tiles:
+        overview.paste(tile, (0, offset) if orientation == "vertical" else (offset, 0))
+        offset += tile.size[1] if orientation == "vertical" else tile.size[0]
+    return overview
+
+
+def submit_previews(saver, subIm, sub_img_name, format, orientation, sizes, trace=no_trace, do_keep_existing=False) -> Tuple[List[Dict[str, Any]], Image.Image]:
+    # 조각의 미리보기들을 만들어서 saver로 조각과 함께 저장하고 (미리보기별 결과, 개요에 쓸 가장 작은 미리보기)를 반환함
+    # do_keep_existing이면 이미 있는 미리보기 파일은 다시 저장하지 않음 (이어서 자를 때 그대로 둔 조각)
+    with trace.stage("preview"):
+        previews = make_previews(subIm, orientation, sizes)
+    reports: List[Dict[str, Any]] = []
+    for (size, preview) in zip(sizes, previews):
+        preview_report: Dict[str, Any] = {"file": get_preview_name(sub_img_name, size), "size": list(preview.size)}
+        if not (do_keep_existing and os.path.isfile(preview_report["file"])):
+            if not saver.submit(preview, preview_report["file"], format, preview_report):
+                raise SplitError("can't save the preview image")
+        reports.append(preview_report)
+    return (reports, previews[-1])
+
+
+def iterate_tail_cutting_points(im, start, unit_width, bgcolor, num_reused, options, log=print, trace=no_trace) -> Iterator[Tuple[int, int, int, int]]:
+    # 이어서 자를 때 세로 이미지의 start 행부터 늘어난 부분만 이전과 같은 조각의 기준 크기로 잘라서 조각의 영역을 반환함
+    (width, height) = im.size
+    num_units = max(options.num_units, int((height + options.bandwidth) / max(unit_width + options.bandwidth, 1)))
+    tail = im.crop((0, start, width, height))
+    tail_options = replace(options, num_units=max(1, num_units - num_reused), do_stream=False)
+    for (x0, y0, x1, y1) in iterate_cutting_points(tail, "vertical", unit_width, bgcolor, tail_options, log, trace, start):
+        yield (x0, y0 + start, x1, y1 + start)
+
+
+def split_image(image, options=None, piece_type=None, trace=no_trace) -> SplitResult:
+    # 파일을 저장하거나 메시지를 출력하지 않고 조각의 영역 목록을 반환함
+    # piece_type이 "image"이면 잘라낸 이미지를, "bytes"이면 split.py와 같은 포맷으로 인코딩한 바이트를 함께 반환함
+    # trace에 Tracer를 주면 단계별 소요 시간 등을 기록함
+    if options is None:
+        options = SplitOptions()
+    (im, format) = open_image(image, options, trace)
+    (orientation, unit_width, bgcolor) = get_split_layout(im, options, log_nothing, trace)
+    result = SplitResult(im.size, format, orientation, bgcolor)
+    if not is_split_requested(options) or is_below_size_threshold(im, orientation, options.size_threshold):
+        return result
+    for box in iterate_cutting_points(im, orientation, unit_width, bgcolor, options, log_nothing, trace):
+        result.cutting_points.append(box)
+        if piece_type == "image":
+            with trace.stage("crop"):
+                result.pieces.append(crop_piece(im, box))
+        elif piece_type == "bytes":
+            buffer = io.BytesIO()
+            with trace.stage("crop"):
+                piece = crop_piece(im, box)
+            if not save_piece(piece, buffer, format, trace, preset=options.output_preset)[0]:
+                raise SplitError("can't encode the split image")
+            result.pieces.append(buffer.getvalue())
+    return result
+
+
+def split_image_file(imageFile, options, log=print, report=None, source=None, trace=no_trace) -> int:
+    # report가 주어지면 조각의 영역과 파일 이름 등의 결과를 채움
+    # source가 입력 이미지의 목록이면 이어 붙인 이미지를 imageFile로 저장하지 않고 바로 잘라서 imageFile.N.ext로 저장함
+    (name_prefix, ext) = os.path.splitext(imageFile)
+    log("bandwidth=", options.bandwidth)
+    log("num_units=", options.num_units)
+    log("margin=", options.margin)
+    log("diff_threshold=", options.diff_threshold)
+    log("size_threshold=", options.size_threshold)
+    log("acceptable_diff_of_color_value=", options.acceptable_diff_of_color_value)
+    log("arg=", imageFile)
+    if report is None:
+        report = {}
+    report["file"] = imageFile
+    report["pieces"] = []
+
+    (im, format) = open_image(imageFile if source is None else source, options, trace)
+    if source is not None:
+        # 조각은 imageFile의 확장자에 맞는 포맷으로 (알 수 없으면 merge.py처럼 마지막 입력 이미지의 포맷으로) 저장함
+        format = Image.registered_extensions().get(ext.lower(), format)
+    log("format=%s" % format)
+    # --incremental이면 이전에 자른 이미지가 아래로 늘어났을 때 마지막 조각 위의 조각들은 그대로 두고 늘어난 부분만 자름
+    manifest_file = name_prefix + manifest_suffix if options.do_incremental and is_split_requested(options) and source is None and options.archive is None else None
+    manifest: Optional[Dict[str, Any]] = None
+    if manifest_file is not None:
+        with trace.stage("incremental") as event:
+            manifest = load_manifest(manifest_file, im, name_prefix, ext, options, log) if not options.do_refresh_cache else None
+            event["hit"] = manifest is not None
+    # 같은 이미지를 같은 옵션으로 자른 적이 있으면 띠 탐색을 건너뛰고 캐시된 위치에서 자름
+    with trace.stage("cache") as event:
+        cache_key = get_cache_key(imageFile, options) if options.cache_dir and is_split_requested(options) and source is None and manifest is None else None
+        cached = load_cached_cutting_points(options.cache_dir, cache_key) if cache_key and not options.do_refresh_cache else None
+        event["hit"] = cached is not None
+    layout_recorder = MessageRecorder(log)
+    if manifest is not None:
+        (orientation, unit_width, bgcolor) = (manifest["orientation"], manifest["unit_width"], (manifest["bgcolor"][0], manifest["bgcolor"][1], manifest["bgcolor"][2]))
+    elif cached is not None:
+        for message in cached["layout"]:
+            log(message)
+        (orientation, bgcolor) = (cached["orientation"], (cached["bgcolor"][0], cached["bgcolor"][1], cached["bgcolor"][2]))
+        unit_width = get_unit_width(im, orientation, options)
+    else:
+        (orientation, unit_width, bgcolor) = get_split_layout(im, options, layout_recorder, trace)
+    report.update({"width": im.size[0], "height": im.size[1], "format": format, "orientation": orientation, "bgcolor": list(bgcolor), "cached": cached is not None})
+
+    # size threshold check
+    if is_below_size_threshold(im, orientation, options.size_threshold):
+        return -1
+        
+    actual_units_created = 0  # Track actual number of units created
+    
+    if is_split_requested(options):
+        # --archive, --cbz이면 조각을 파일로 저장하지 않고 하나의 ZIP(CBZ) 파일에 씀
+        archive_file = None if options.archive is None else options.archive or name_prefix + ".cbz"
+        archive = open_archive(archive_file) if archive_file is not None else None
+        if archive_file is not None:
+            report["archive"] = archive_file
+        # --memory-limit이면 한도에서 디코딩과 프로파일 계산에 쓰고 남은 메모리 안에서만 조각들을 동시에 인코딩함
+        saver = PieceSaver(options.save_workers, log, trace, archive, get_encode_budget(im, options), options.output_preset)
+        is_saved = False
+        try:
+            # --previews이면 디코딩한 조각에서 바로 미리보기를 만들어서 조각과 함께 저장함 (압축 파일에는 넣지 않음)
+            do_preview = len(options.preview_sizes) > 0 and archive is None
+            tiles: List[Image.Image] = []
+            cut_recorder = MessageRecorder(log)
+            if manifest is not None:
+                # 마지막 조각 위의 조각 파일들은 다시 인코딩하지 않고 그대로 사용함
+                reused_pieces = manifest["pieces"][:-1]
+                for piece in reused_pieces:
+                    report["pieces"].append({"file": name_prefix + "." + str(actual_units_created + 1) + ext, "box": piece["box"], "reused": True})
+                    actual_units_created += 1
+                start = manifest["pieces"][-1]["box"][1]
+                log("incremental: reusing %d pieces above y=%d" % (len(reused_pieces), start))
+                boxes = iterate_tail_cutting_points(im, start, unit_width, bgcolor, len(reused_pieces), options, cut_recorder, trace)
+            elif cached is not None:
+                boxes = replay_cutting_points(cached["cuts"], log)
+            else:
+                boxes = record_cutting_points(iterate_cutting_points(im, orientation, unit_width, bgcolor, options, cut_recorder, trace), cut_recorder)
+            if do_preview:
+                # 그대로 둔 조각도 개요에 넣을 미리보기가 필요함
+                for piece_report in report["pieces"]:
+                    with trace.stage("crop"):
+                        subIm = crop_piece(im, piece_report["box"])
+                    (piece_report["previews"], tile) = submit_previews(saver, subIm, piece_report["file"], format, orientation, options.preview_sizes, trace, True)
+                    tiles.append(tile)
+            for box in boxes:
+                sub_img_name = name_prefix + "." + str(actual_units_created + 1) + ext
+                with trace.stage("crop"):
+                    subIm = crop_piece(im, box)
+
+                # Check if cropped image is valid
+                if subIm.size[0] <= 0 or subIm.size[1] <= 0:
+                    log(f"Invalid cropped image size: {subIm.size}")
+                    raise SplitError("cropped image has zero size")
+
+                # 인코딩과 저장은 스레드 풀에서 다음 띠 탐색과 동시에 진행함
+                piece_report = {"file": sub_img_name if archive is None else os.path.basename(sub_img_name), "box": list(box)}
+                if not saver.submit(subIm, sub_img_name, format, piece_report):
+                    raise SplitError("can't save the split image")
+                report["pieces"].append(piece_report)
+                actual_units_created += 1
+                if do_preview:
+                    (piece_report["previews"], tile) = submit_previews(saver, subIm, sub_img_name, format, orientation, options.preview_sizes, trace)
+                    tiles.append(tile)
+            if tiles:
+                # 가장 작은 미리보기들을 이어 붙여서 전체 이미지의 개요를 만듦 (전체 이미지를 다시 줄이지 않음)
+                with trace.stage("preview"):
+                    overview = stack_previews(tiles, orientation)
+                report["overview"] = {"file": get_preview_name(imageFile, options.preview_sizes[-1]), "size": list(overview.size)}
+                if not saver.submit(overview, report["overview"]["file"], format, report["overview"]):
+                    raise SplitError("can't save the overview image")
+            if cache_key and cached is None:
+                store_cached_cutting_points(options.cache_dir, cache_key, {"orientation": orientation, "bgcolor": list(bgcolor), "layout": layout_recorder.events, "cuts": cut_recorder.events})
+            # 저장 중인 조각을 모두 기다림
+            with trace.stage("wait_saves"):
+                is_saved = saver.close()
+        except SplitError as e:
+            sys.stderr.write("Error: %s\n" % e)
+            return -1
+        finally:
+            # 어떤 예외로 끝나도 스레드 풀을 정리하고, 모든 조각을 저장하지 못했으면 쓰던 임시 압축 파일을 지움
+            saver.close()
+            close_archive(archive, archive_file, is_saved)
+        if not is_saved:
+            sys.stderr.write("Error: can't save the split image\n")
+            return -1
+        if manifest_file is not None and orientation == "vertical" and len(report["pieces"]) >= 2:
+            with trace.stage("manifest"):
+                pieces = [{"file": os.path.basename(piece["file"]), "box": list(piece["box"]), "bytes": os.path.getsize(piece["file"])} for piece in report["pieces"]]
+                store_manifest(manifest_file, {"parameters": get_split_parameters(options), "mode": im.mode, "size": list(im.size), "orientation": orientation,
+                                               "bgcolor": list(bgcolor), "unit_width": unit_width, "pieces": pieces, "prefix_hash": get_prefix_hash(im, pieces[-1]["box"][1])})
         
-    print(f"Total units created: {actual_units_created}")
+    log(f"Total units created: {actual_units_created}")
     return 0
 
         
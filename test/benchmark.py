@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import io
+import glob
+import json
+import time
+import getopt
+import platform
+import subprocess
+from PIL import Image
+import numpy
+from typing import Any, Callable, Tuple, List, Dict, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import split
+
+
+default_repeat = 3 # 각 시나리오를 반복해서 측정하는 횟수 (단계별 최솟값을 기록함)
+default_tolerance = 0.1 # 10%, 비교 시 느려졌다고 판단하는 비율
+stages = ["decode", "bgcolor", "band", "crop", "save"]
+
+# 측정할 옵션 조합 (split.py의 명령행 옵션과 같은 형식)
+option_variants = [
+    "",
+    "-c dominant",
+    "-c fuzzy",
+    "-c blackorwhite",
+    "-w",
+    "-a 4",
+    "-c fuzzy -a 4 -w",
+    "--coarse 4",
+    "-c dominant --coarse 8",
+]
+
+# 합성 이미지 (이름, 너비, 높이, 칸의 높이, 칸 사이 여백, 배경색, 배경 잡음, JPEG 품질 (0이면 무손실))
+synthetic_strips = [
+    ("white", 800, 30000, 1200, 60, (255, 255, 255), 0, 0),
+    ("white-jpeg", 800, 30000, 1200, 60, (255, 255, 255), 0, 85),
+    ("black-noise", 800, 30000, 1200, 60, (0, 0, 0), 3, 90),
+    ("colored-jpeg", 800, 30000, 1200, 60, (235, 225, 200), 2, 85),
+    ("dense-gutters", 800, 20000, 300, 25, (255, 255, 255), 0, 85),
+    ("wide-tall", 1600, 60000, 2000, 80, (255, 255, 255), 1, 90),
+]
+
+
+def make_strip(width, height, panel_height, gutter, bgcolor, noise, seed=0) -> Image.Image:
+    # 배경색 여백으로 구분된 칸이 세로로 이어진 웹툰 형태의 이미지를 만듦
+    rng = numpy.random.default_rng(seed)
+    pixels = numpy.empty((height, width, 3), dtype=numpy.uint8)
+    pixels[:] = bgcolor
+    if noise > 0:
+        pixels[:] = numpy.clip(pixels.astype(numpy.int16) + rng.integers(-noise, noise + 1, size=(height, width, 3), dtype=numpy.int16), 0, 255)
+    side = max(1, width // 40)
+    y = gutter
+    while y < height - gutter:
+        y1 = min(height - gutter, y + int(panel_height * rng.uniform(0.6, 1.4)))
+        # 칸의 내용은 무작위 색의 블록과 잡음으로 채움
+        blocks = rng.integers(0, 256, size=((y1 - y + 15) // 16, (width - 2 * side + 15) // 16, 3), dtype=numpy.uint8)
+        panel = numpy.repeat(numpy.repeat(blocks, 16, axis=0), 16, axis=1)[:y1 - y, :width - 2 * side]
+        pixels[y:y1, side:width - side] = panel ^ rng.integers(0, 32, size=panel.shape, dtype=numpy.uint8)
+        y = y1 + int(gutter * rng.uniform(0.5, 1.5))
+    return Image.fromarray(pixels, "RGB")
+
+
+def encode_strip(im, quality) -> Tuple[bytes, str]:
+    # JPEG 품질이 주어지면 JPEG으로, 아니면 PNG로 인코딩해서 실제 파일처럼 디코딩 단계를 측정할 수 있게 함
+    buffer = io.BytesIO()
+    if quality > 0:
+        im.save(buffer, format="JPEG", quality=quality)
+        return (buffer.getvalue(), "JPEG")
+    im.save(buffer, format="PNG", compress_level=1)
+    return (buffer.getvalue(), "PNG")
+
+
+def get_num_units(width, height) -> int:
+    # 긴 변이 짧은 변의 두 배가 될 만큼씩 자름
+    return max(2, max(width, height) // (2 * min(width, height)))
+
+
+def parse_variant(variant, num_units) -> split.SplitOptions:
+    # 옵션 조합 문자열을 split.py와 같은 방식으로 해석함
+    options = split.SplitOptions(num_units=num_units)
+    opts, _ = getopt.getopt(variant.split(), "c:a:w", ["coarse="])
+    for o, a in opts:
+        if o == "-c":
+            color_option = split.determine_color_option(a)
+            assert color_option is not None
+            (options.bgcolor, options.is_fuzzy, options.do_use_dominant_color) = color_option
+        elif o == "-a":
+            options.acceptable_diff_of_color_value = int(a)
+        elif o == "-w":
+            options.do_scan_wider = True
+        elif o == "--coarse":
+            options.coarse_scale = int(a)
+    return options
+
+
+def measure(data, options) -> Tuple[Dict[str, float], List[Tuple[int, int, int, int]]]:
+    # 한 번 자르는 동안 디코딩, 배경색 결정, 띠 탐색, 잘라내기, 인코딩 단계의 소요 시간을 따로 잼
+    # 인코딩한 조각은 파일로 저장하지 않고 메모리에 씀
+    timings: Dict[str, float] = {}
+    start_time = time.perf_counter()
+    (im, format) = split.open_image(data, options)
+    im.load()
+    timings["decode"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    (orientation, unit_width, bgcolor) = split.get_split_layout(im, options, split.log_nothing)
+    timings["bgcolor"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    boxes = list(split.iterate_cutting_points(im, orientation, unit_width, bgcolor, options, split.log_nothing))
+    timings["band"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    pieces = [im.crop(box) for box in boxes]
+    for piece in pieces:
+        piece.load()
+    timings["crop"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for piece in pieces:
+        if not split.save_piece(piece, io.BytesIO(), format)[0]:
+            raise split.SplitError("can't encode the split image")
+    timings["save"] = time.perf_counter() - start_time
+    return (timings, boxes)
+
+
+def get_scenario_images(do_use_synthetic, do_use_fixtures, scale) -> List[Tuple[str, Callable[[], Tuple[bytes, Dict[str, Any]]]]]:
+    # (이름, 인코딩한 이미지와 이미지 정보를 만드는 함수) 목록
+    images: List[Tuple[str, Callable[[], Tuple[bytes, Dict[str, Any]]]]] = []
+    if do_use_fixtures:
+        test_dir = os.path.dirname(os.path.abspath(__file__))
+        for path in sorted(glob.glob(os.path.join(test_dir, "*.jpg"))):
+            def load_fixture(path=path) -> Tuple[bytes, Dict[str, Any]]:
+                with open(path, "rb") as f:
+                    return (f.read(), {"source": os.path.basename(path)})
+            images.append((os.path.basename(path), load_fixture))
+    if do_use_synthetic:
+        for (name, width, height, panel_height, gutter, bgcolor, noise, quality) in synthetic_strips:
+            def make_synthetic(width=width, height=int(height * scale), panel_height=panel_height, gutter=gutter, bgcolor=bgcolor, noise=noise, quality=quality) -> Tuple[bytes, Dict[str, Any]]:
+                (data, format) = encode_strip(make_strip(width, height, panel_height, gutter, bgcolor, noise), quality)
+                return (data, {"source": "synthetic", "panel_height": panel_height, "gutter": gutter, "bgcolor": list(bgcolor), "noise": noise, "quality": quality})
+            images.append(("synthetic-" + name, make_synthetic))
+    return images
+
+
+def run_benchmark(images, variants, repeat, log=print) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    for (image_name, make_image) in images:
+        (data, info) = make_image()
+        with Image.open(io.BytesIO(data)) as im:
+            (width, height) = im.size
+        num_units = get_num_units(width, height)
+        for variant in variants:
+            options = parse_variant(variant, num_units)
+            best: Dict[str, float] = {}
+            boxes: List[Tuple[int, int, int, int]] = []
+            for _ in range(repeat):
+                (timings, boxes) = measure(data, options)
+                for stage in stages:
+                    best[stage] = min(best.get(stage, timings[stage]), timings[stage])
+            best["total"] = sum(best[stage] for stage in stages)
+            name = "%s [-n %d %s]" % (image_name, num_units, variant) if variant else "%s [-n %d]" % (image_name, num_units)
+            results.append({"name": name, "width": width, "height": height, "num_units": num_units, "options": variant, "image": info, "stages": best, "cutting_points": [list(box) for box in boxes]})
+            log("%-48s %s total=%7.1fms pieces=%d" % (name, " ".join("%s=%7.1fms" % (stage, best[stage] * 1000) for stage in stages), best["total"] * 1000, len(boxes)))
+    return results
+
+
+def get_environment() -> Dict[str, Any]:
+    # 비교할 때 참고할 버전 정보
+    try:
+        revision = subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        revision = ""
+    return {"revision": revision, "python": platform.python_version(), "pillow": Image.__version__, "numpy": numpy.__version__, "machine": platform.machine(), "cpus": os.cpu_count()}
+
+
+def compare_results(old, new, tolerance) -> int:
+    # 같은 이름의 시나리오끼리 단계별 소요 시간을 비교하고, 느려졌거나 자르는 위치가 달라진 시나리오의 수를 반환함
+    old_results = {result["name"]: result for result in old["results"]}
+    print("old: %s, new: %s" % (old["environment"].get("revision"), new["environment"].get("revision")))
+    num_regressions = 0
+    for result in new["results"]:
+        old_result = old_results.get(result["name"])
+        if old_result is None:
+            continue
+        ratios = {stage: result["stages"][stage] / old_result["stages"][stage] if old_result["stages"][stage] > 0 else 1.0 for stage in stages + ["total"]}
+        notes = []
+        if ratios["total"] > 1 + tolerance:
+            notes.append("SLOWER")
+        if result["cutting_points"] != old_result["cutting_points"]:
+            notes.append("CUTTING POINTS CHANGED")
+        if notes:
+            num_regressions += 1
+        print("%-48s %s total=%.2fx %s" % (result["name"], " ".join("%s=%.2fx" % (stage, ratios[stage]) for stage in stages), ratios["total"], " ".join(notes)))
+    return num_regressions
+
+
+def print_usage(program_name: str) -> None:
+    print("usage: %s [-r <repeat>] [-o <result file>] [-c <old result file>]" % program_name)
+    print("          [--quick] [--no-synthetic] [--no-fixtures] [--filter <substring>]")
+    print("\t-r <repeat>: runs per scenario, the minimum time of each stage is recorded (default %d)" % (default_repeat))
+    print("\t-o <result file>: save the results as JSON")
+    print("\t-c <old result file>: compare with the results of another version")
+    print("\t-t <tolerance>: ratio of slowdown reported as a regression (default %f)" % (default_tolerance))
+    print("\t--quick: shorter synthetic images and only the default options")
+    print("\t--no-synthetic: don't generate synthetic images")
+    print("\t--no-fixtures: don't use test/*.jpg")
+    print("\t--filter <substring>: only scenarios whose image name contains the substring")
+
+
+def main() -> int:
+    repeat = default_repeat
+    tolerance = default_tolerance
+    output_file: Optional[str] = None
+    compare_file: Optional[str] = None
+    do_use_synthetic = True
+    do_use_fixtures = True
+    scale = 1.0
+    variants = option_variants
+    name_filter = ""
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hr:o:c:t:", ["quick", "no-synthetic", "no-fixtures", "filter="])
+    except getopt.GetoptError:
+        print_usage(sys.argv[0])
+        sys.stderr.write("Error: invaild option definition\n")
+        return -1
+    for o, a in opts:
+        if o == "-r":
+            repeat = max(1, int(a))
+        elif o == "-o":
+            output_file = a
+        elif o == "-c":
+            compare_file = a
+        elif o == "-t":
+            tolerance = float(a)
+        elif o == "--quick":
+            scale = 0.25
+            variants = option_variants[:1]
+        elif o == "--no-synthetic":
+            do_use_synthetic = False
+        elif o == "--no-fixtures":
+            do_use_fixtures = False
+        elif o == "--filter":
+            name_filter = a
+        else:
+            print_usage(sys.argv[0])
+            return -1
+
+    images = [(name, make_image) for (name, make_image) in get_scenario_images(do_use_synthetic, do_use_fixtures, scale) if name_filter in name]
+    new = {"environment": get_environment(), "repeat": repeat, "results": run_benchmark(images, variants, repeat)}
+    if output_file:
+        with open(output_file, "w") as f:
+            json.dump(new, f, indent=1)
+    if compare_file:
+        with open(compare_file) as f:
+            old = json.load(f)
+        if compare_results(old, new, tolerance) > 0:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,705 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import sys
+import json
+import time
+import signal
+import shutil
+import zipfile
+import tempfile
+import contextlib
+import threading
+import traceback
+import subprocess
+import multiprocessing
+import urllib.error
+import urllib.request
+from dataclasses import replace
+from PIL import Image
+import numpy
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import split
+from benchmark import make_strip
+
+
+# 기본 경로와 같은 자르는 위치를 내야 하는 옵션들을 비교하는 스크립트 (test.sh는 메시지 출력을, 이 스크립트는 결과를 비교함)
+test_dir = os.path.dirname(os.path.abspath(__file__))
+fixtures = ["vertical.jpg", "vertical2.jpg", "vertical6.jpg", "horizontal.jpg", "horizontal4.jpg"]
+color_options = ["", "dominant", "fuzzy", "blackorwhite"]
+max_preview_difference = 4 # 미리보기와 조각을 BOX 필터로 줄인 이미지의 픽셀 값 차이의 평균 한도 (다른 조각이면 60이 넘음)
+
+
+def print_usage(program_name: str) -> None:
+    print("usage: %s [case...]" % program_name)
+    print("\tcompares the cutting points and pieces of the optimized paths with the default path")
+    print("\tcases: %s (default: all)" % ", ".join(name for (name, _) in cases))
+
+
+def get_options(num_units, color="", **fields) -> split.SplitOptions:
+    options = replace(split.SplitOptions(num_units=num_units), **fields)
+    if color:
+        color_option = split.determine_color_option(color)
+        assert color_option is not None
+        (options.bgcolor, options.is_fuzzy, options.do_use_dominant_color) = color_option
+    return options
+
+
+def get_cuts(image, options) -> List[Tuple[int, int, int, int]]:
+    return split.split_image(image, options).cutting_points
+
+
+def get_fixture_images() -> List[Tuple[str, Any]]:
+    # (이름, 이미지) 목록 (합성 이미지 하나와 test/*.jpg 일부)
+    images: List[Tuple[str, Any]] = [("synthetic", make_strip(800, 12000, 900, 40, (255, 255, 255), 0))]
+    images += [(name, os.path.join(test_dir, name)) for name in fixtures]
+    return images
+
+
+def assert_same(name, expected, actual) -> None:
+    if expected != actual:
+        raise AssertionError("%s: expected %s, got %s" % (name, expected, actual))
+
+
+def assert_same_pixels(name, expected, actual) -> None:
+    if expected.size != actual.size or not numpy.array_equal(numpy.asarray(expected.convert("RGB")), numpy.asarray(actual.convert("RGB"))):
+        raise AssertionError("%s: pixels differ" % name)
+
+
+def check_coarse(work_dir) -> None:
+    # --coarse는 축소 이미지에서 후보만 찾으므로 자르는 위치가 기본 경로와 같아야 함
+    for (name, image) in get_fixture_images():
+        for color in ["", "dominant", "white"]:
+            expected = get_cuts(image, get_options(10, color))
+            for scale in [2, 4, 8]:
+                assert_same("%s -c '%s' --coarse %d" % (name, color, scale), expected, get_cuts(image, get_options(10, color, coarse_scale=scale)))
+
+
+def check_native_modes(work_dir) -> None:
+    # L, P 이미지를 원래 모드로 자른 결과가 --rgb로 RGB로 변환해서 자른 결과와 같고, 조각은 원래 모드로 남아야 함
+    for (name, image) in get_fixture_images()[:3]:
+        im = image if isinstance(image, Image.Image) else Image.open(image)
+        for (mode, converted) in [("L", im.convert("L")), ("P", im.convert("RGB").quantize(64))]:
+            for color in color_options:
+                expected = get_cuts(converted, get_options(10, color, do_convert_rgb=True))
+                result = split.split_image(converted, get_options(10, color), "image")
+                assert_same("%s %s -c '%s'" % (name, mode, color), expected, result.cutting_points)
+                assert_same("%s %s piece mode" % (name, mode), [mode] * len(result.pieces), [piece.mode for piece in result.pieces])
+    # 배경색 띠가 없어서 기본 자르는 위치를 쓰면 다음 조각은 x0 = -1부터 잘리므로, 이미지 밖은 --rgb처럼 검은색이어야 함
+    # (팔레트 0번이 검은색이 아니고, 검은색이 다른 번호에 있거나 팔레트에 없는 경우)
+    rng = numpy.random.default_rng(11)
+    noise = Image.fromarray(rng.integers(1, 4, size=(2000, 300), dtype=numpy.uint8), "P")
+    for (name, palette) in [("black in palette", [255, 255, 255, 200, 30, 30, 30, 200, 30, 0, 0, 0]), ("no black in palette", [255, 255, 255, 200, 30, 30, 30, 200, 30, 30, 30, 200])]:
+        noise.putpalette(palette)
+        expected = split.split_image(noise, get_options(4, do_convert_rgb=True), "image")
+        result = split.split_image(noise, get_options(4), "image")
+        assert_same("%s cutting points" % name, expected.cutting_points, result.cutting_points)
+        if not any(box[0] < 0 for box in result.cutting_points):
+            raise AssertionError("%s: no piece from the fallback cutting point" % name)
+        for (i, (expected_piece, piece)) in enumerate(zip(expected.pieces, result.pieces)):
+            assert_same("%s piece %d mode" % (name, i + 1), "P", piece.mode)
+            assert_same_pixels("%s piece %d" % (name, i + 1), expected_piece, piece)
+
+
+def get_fewest_pieces(pixels, bgcolor, bandwidth, max_length) -> int:
+    # 배경색으로만 된 띠의 가운데에서만 자를 때 max_length 이하로 자를 수 있는 최소 조각 수 (띠가 없으면 0)
+    is_background = numpy.all(pixels == bgcolor, axis=(1, 2))
+    length = len(is_background)
+    band_starts = numpy.flatnonzero(numpy.convolve(is_background, numpy.ones(bandwidth, dtype=int), "valid") == bandwidth)
+    cuts = band_starts + bandwidth // 2
+    (p0, num_pieces) = (0, 1)
+    while length - p0 > max_length:
+        reachable = cuts[(cuts > p0) & (cuts <= p0 + max_length)]
+        if len(reachable) == 0:
+            return 0
+        (p0, num_pieces) = (int(reachable[-1]), num_pieces + 1)
+    return num_pieces
+
+
+def check_max_length(work_dir) -> None:
+    # --max-length는 모든 조각이 한도 이하이고, 배경색 띠에서만 잘라서 만들 수 있는 최소 갯수의 조각으로 잘라야 함
+    im = make_strip(800, 12000, 900, 40, (255, 255, 255), 0)
+    pixels = numpy.asarray(im)
+    for max_length in [1400, 2000, 3500]:
+        options = get_options(1, "white", max_piece_length=max_length)
+        cuts = get_cuts(im, options)
+        lengths = [y1 - y0 for (x0, y0, x1, y1) in cuts]
+        if max(lengths) > max_length:
+            raise AssertionError("--max-length %d: piece of %d rows" % (max_length, max(lengths)))
+        for (x0, y0, x1, y1) in cuts[1:]:
+            band = pixels[y0 - options.bandwidth // 2:y0 - options.bandwidth // 2 + options.bandwidth]
+            if not numpy.all(band == 255):
+                raise AssertionError("--max-length %d: cut at %d is not in a background band" % (max_length, y0))
+        assert_same("--max-length %d pieces" % max_length, get_fewest_pieces(pixels, (255, 255, 255), options.bandwidth, max_length), len(cuts))
+    # 배경색 띠가 없는 긴 칸은 한도 이하로 강제로 잘라야 함
+    solid = make_strip(800, 9000, 6000, 40, (255, 255, 255), 0)
+    cuts = get_cuts(solid, get_options(1, "white", max_piece_length=2500))
+    if max(y1 - y0 for (x0, y0, x1, y1) in cuts) > 2500:
+        raise AssertionError("--max-length 2500 without bands: piece too long")
+    # --fit-webp는 WebP 권장 한도 안에 들어가야 함
+    wide = make_strip(5000, 20000, 1500, 60, (255, 255, 255), 0)
+    for (x0, y0, x1, y1) in get_cuts(wide, get_options(1, "white", max_piece_length=split.WEBP_MAX_DIMENSION, max_piece_pixels=split.WEBP_MAX_PIXELS)):
+        if y1 - y0 > split.WEBP_MAX_DIMENSION or (x1 - x0) * (y1 - y0) > split.WEBP_MAX_PIXELS:
+            raise AssertionError("--fit-webp: piece %s is over the WebP limits" % ((x0, y0, x1, y1),))
+
+
+def check_merge(work_dir) -> None:
+    # --merge로 입력 이미지들을 바로 자른 결과가 merge.py로 이어 붙인 이미지를 자른 결과와 같아야 함 (입력 경계에 걸친 띠 포함)
+    strip = make_strip(700, 9000, 900, 40, (255, 255, 255), 0, seed=3)
+    slices = []
+    for (i, (y0, y1, width)) in enumerate([(0, 2950, 700), (2950, 6010, 640), (6010, 9000, 700)]):
+        path = os.path.join(work_dir, "slice%d.png" % i)
+        strip.crop((0, y0, width, y1)).save(path)
+        slices.append(path)
+    merged = os.path.join(work_dir, "merged.png")
+    process = subprocess.run([sys.executable, os.path.join(test_dir, "..", "merge.py"), "-f", "png", merged] + slices, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    assert_same("merge.py -f png warning", "", process.stderr)
+    # JPEG은 캔버스 전체에 붙여서 저장하므로, 마지막 입력 이미지의 포맷을 따른 경우에도 경고해야 함
+    jpeg_slices = []
+    for (i, path) in enumerate(slices):
+        jpeg_path = os.path.join(work_dir, "slice%d.jpg" % i)
+        Image.open(path).save(jpeg_path)
+        jpeg_slices.append(jpeg_path)
+    process = subprocess.run([sys.executable, os.path.join(test_dir, "..", "merge.py"), os.path.join(work_dir, "merged.jpg")] + jpeg_slices, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if "JPEG output (the format of the last input)" not in process.stderr or "700x9000 canvas" not in process.stderr:
+        raise AssertionError("merge.py: no canvas warning for JPEG output: %r" % process.stderr)
+    assert_same("merge.py JPEG size", (700, 9000), Image.open(os.path.join(work_dir, "merged.jpg")).size)
+    for color in ["", "dominant", "fuzzy"]:
+        expected = split.split_image(merged, get_options(8, color), "image")
+        result = split.split_image(slices, get_options(8, color), "image")
+        assert_same("--merge -c '%s'" % color, expected.cutting_points, result.cutting_points)
+        for (i, (expected_piece, piece)) in enumerate(zip(expected.pieces, result.pieces)):
+            assert_same_pixels("--merge -c '%s' piece %d" % (color, i + 1), expected_piece, piece)
+
+
+def check_stream(work_dir) -> None:
+    # --stream으로 띠 단위로 디코딩해도 자르는 위치와 조각이 같아야 함 (비압축 이미지, 8비트 PNG)
+    strip = make_strip(600, 8000, 700, 40, (255, 255, 255), 0, seed=5)
+    for (name, im) in [("strip.png", strip), ("strip.ppm", strip), ("strip.bmp", strip), ("gray.png", strip.convert("L")), ("palette.png", strip.quantize(64))]:
+        path = os.path.join(work_dir, name)
+        im.save(path)
+        for color in ["", "fuzzy"]:
+            expected = split.split_image(path, get_options(8, color), "image")
+            result = split.split_image(path, get_options(8, color, do_stream=True, memory_budget=1), "image")
+            assert_same("%s --stream -c '%s'" % (name, color), expected.cutting_points, result.cutting_points)
+            for (i, (expected_piece, piece)) in enumerate(zip(expected.pieces, result.pieces)):
+                assert_same_pixels("%s --stream piece %d" % (name, i + 1), expected_piece, piece)
+
+
+def check_incremental(work_dir) -> None:
+    # --incremental로 아래로 늘어난 이미지를 다시 자르면 마지막 조각 위의 조각 파일은 그대로 두고,
+    # 나머지 조각은 늘어난 이미지의 해당 영역과 같아야 함
+    strip = make_strip(600, 12000, 900, 40, (255, 255, 255), 0, seed=7)
+    path = os.path.join(work_dir, "episode.png")
+    options = get_options(4, "white", do_incremental=True)
+    strip.crop((0, 0, 600, 7000)).save(path)
+    first: dict = {}
+    assert_same("first split", 0, split.split_image_file(path, options, split.log_nothing, first))
+    stats = [os.stat(piece["file"]) for piece in first["pieces"]]
+    strip.save(path)
+    second: dict = {}
+    assert_same("incremental split", 0, split.split_image_file(path, options, split.log_nothing, second))
+    num_reused = len(first["pieces"]) - 1
+    assert_same("reused pieces", [True] * num_reused, [piece.get("reused", False) for piece in second["pieces"][:num_reused]])
+    for (piece, stat) in zip(second["pieces"][:num_reused], stats):
+        assert_same("%s untouched" % piece["file"], (stat.st_mtime_ns, stat.st_size), (os.stat(piece["file"]).st_mtime_ns, os.stat(piece["file"]).st_size))
+    boxes = [piece["box"] for piece in second["pieces"]]
+    assert_same("pieces cover the image", [0] + [box[3] for box in boxes[:-1]] + [12000], [box[1] for box in boxes] + [boxes[-1][3]])
+    for piece in second["pieces"]:
+        with Image.open(piece["file"]) as saved:
+            assert_same_pixels(piece["file"], strip.crop(tuple(piece["box"])), saved)
+
+
+def check_archive(work_dir) -> None:
+    # --cbz, --archive의 항목은 파일로 저장한 조각과 이름, 순서, 내용이 같고, 이미 압축된 조각은 다시 압축하지 않아야 함
+    os.mkdir(os.path.join(work_dir, "files"))
+    os.mkdir(os.path.join(work_dir, "cbz"))
+    path = os.path.join(work_dir, "files", "episode.jpg")
+    shutil.copy(os.path.join(test_dir, "vertical2.jpg"), path)
+    shutil.copy(path, os.path.join(work_dir, "cbz", "episode.jpg"))
+    report: dict = {}
+    assert_same("file split", 0, split.split_image_file(path, get_options(10), split.log_nothing, report))
+    expected = []
+    for piece in report["pieces"]:
+        with open(piece["file"], "rb") as f:
+            expected.append((os.path.basename(piece["file"]), f.read()))
+    archive_path = os.path.join(work_dir, "pieces.zip")
+    for (archive, archive_file) in [("", os.path.join(work_dir, "cbz", "episode.cbz")), (archive_path, archive_path)]:
+        assert_same("archive split", 0, split.split_image_file(os.path.join(work_dir, "cbz", "episode.jpg"), get_options(10, archive=archive), split.log_nothing))
+        with zipfile.ZipFile(archive_file) as f:
+            assert_same("%s entries" % archive_file, expected, [(entry.filename, f.read(entry)) for entry in f.infolist()])
+            assert_same("%s stored" % archive_file, [zipfile.ZIP_STORED] * len(expected), [entry.compress_type for entry in f.infolist()])
+    assert_same("leftover files", ["episode.cbz", "episode.jpg"], sorted(os.listdir(os.path.join(work_dir, "cbz"))))
+
+
+def split_cached(image_file, options) -> Tuple[bool, List[Any], List[bytes]]:
+    # 캐시를 쓰면서 잘라서 (캐시에서 읽었는지 여부, 조각의 영역, 조각 파일의 내용)을 반환함
+    report: dict = {}
+    assert_same("split with the cache", 0, split.split_image_file(image_file, options, split.log_nothing, report))
+    pieces = []
+    for piece in report["pieces"]:
+        with open(piece["file"], "rb") as f:
+            pieces.append(f.read())
+    return (report["cached"], [piece["box"] for piece in report["pieces"]], pieces)
+
+
+def check_cache(work_dir) -> None:
+    # 캐시에서 읽은 결과가 새로 자른 결과와 같고, 옵션이나 이미지 내용이 바뀌거나 --refresh-cache이면 다시 잘라야 함
+    cache_dir = os.path.join(work_dir, "cache")
+    path = os.path.join(work_dir, "episode.png")
+    strip = make_strip(600, 9000, 900, 40, (255, 255, 255), 0, seed=11)
+    strip.save(path)
+    (is_cached, boxes, pieces) = split_cached(path, get_options(6, cache_dir=cache_dir))
+    assert_same("first split cached", False, is_cached)
+    assert_same("cache hit", (True, boxes, pieces), split_cached(path, get_options(6, cache_dir=cache_dir)))
+    assert_same("cache refreshed", (False, boxes, pieces), split_cached(path, get_options(6, cache_dir=cache_dir, do_refresh_cache=True)))
+    for (name, options) in [("-n 5", get_options(5, cache_dir=cache_dir)), ("-c fuzzy", get_options(6, "fuzzy", cache_dir=cache_dir)), ("-b 30", get_options(6, bandwidth=30, cache_dir=cache_dir))]:
+        expected = split_cached(path, replace(options, cache_dir=None))
+        assert_same("%s after another split" % name, expected, split_cached(path, options))
+    assert_same("cache entries", 4, len(os.listdir(cache_dir)))
+    strip.paste((0, 0, 0), (0, 3000, 600, 3400))
+    strip.save(path)
+    expected = split_cached(path, get_options(6))
+    assert_same("changed content", expected, split_cached(path, get_options(6, cache_dir=cache_dir)))
+    # 캐시가 한도를 넘으면 가장 오래 사용하지 않은 항목부터 지움 (읽은 항목은 최근에 사용한 것으로 봄)
+    entries = sorted(os.listdir(cache_dir))
+    for (i, name) in enumerate(entries):
+        os.utime(os.path.join(cache_dir, name), (1000000 + i, 1000000 + i))
+    split_cached(path, get_options(6, cache_dir=cache_dir))
+    used = split.get_cache_key(path, get_options(6)) + ".json"
+    newest = [name for name in entries if name != used][-1]
+    split.evict_cache(cache_dir, sum(os.path.getsize(os.path.join(cache_dir, name)) for name in [used, newest]))
+    assert_same("entries after eviction", sorted([used, newest]), sorted(os.listdir(cache_dir)))
+    # 캐시는 옵션을 줄 때만 씀
+    home = os.path.join(work_dir, "home")
+    subprocess.run([sys.executable, os.path.join(test_dir, "..", "split.py"), "-q", "-n", "6", path], check=True, stdout=subprocess.DEVNULL,
+                   env=dict(os.environ, XDG_CACHE_HOME=home, HOME=home))
+    assert_same("cache without --cache", False, os.path.exists(home))
+    subprocess.run([sys.executable, os.path.join(test_dir, "..", "split.py"), "-q", "-n", "6", "--cache", path], check=True, stdout=subprocess.DEVNULL,
+                   env=dict(os.environ, XDG_CACHE_HOME=home, HOME=home))
+    assert_same("cache entries with --cache", 1, len(os.listdir(os.path.join(home, "cartoonsplit"))))
+
+
+def request_server(url, job=None) -> Tuple[int, Dict[str, Any], Dict[str, str]]:
+    # job이 주어지면 POST, 아니면 GET으로 요청해서 (상태 코드, JSON 본문, 헤더)를 반환함
+    data = json.dumps(job).encode() if job is not None else None
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data), timeout=120) as response:
+            return (response.status, json.loads(response.read()), dict(response.headers))
+    except urllib.error.HTTPError as e:
+        return (e.code, json.loads(e.read()), dict(e.headers))
+
+
+def check_server(work_dir) -> None:
+    # server.py의 작업 처리, 잘못된 요청(400), 큐가 찼을 때의 거절(503)과 /stats의 통계를 확인함
+    path = os.path.join(work_dir, "episode.png")
+    make_strip(1000, 12000, 900, 40, (255, 255, 255), 0, seed=13).save(path)
+    server = subprocess.Popen([sys.executable, os.path.join(test_dir, "..", "server.py"), "-p", "0", "-j", "1", "-Q", "1"],
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        assert server.stdout is not None
+        url = server.stdout.readline().split()[2]
+        (status, report, _) = request_server(url + "split", {"file": path, "args": ["-n", "8", "-c", "white"]})
+        assert_same("good job", (200, 0), (status, report["result"]))
+        assert_same("cutting points of the job", get_cuts(path, get_options(8, "white")), [tuple(piece["box"]) for piece in report["pieces"]])
+        assert_same("pieces of the job", [True] * len(report["pieces"]), [os.path.exists(piece["file"]) for piece in report["pieces"]])
+        for (name, job) in [("no file", {"args": ["-n", "8"]}), ("unknown option", {"file": path, "args": ["--bogus"]}),
+                            ("bad value", {"file": path, "args": ["-n", "1"]}), ("extra argument", {"file": path, "args": ["-n", "8", path]}),
+                            ("archive to stdout", {"file": path, "args": ["--archive", "-"]})]:
+            (status, body, _) = request_server(url + "split", job)
+            assert_same("%s status" % name, 400, status)
+            assert_same("%s error" % name, True, bool(body.get("error")))
+        (status, report, _) = request_server(url + "split", {"file": os.path.join(work_dir, "missing.png"), "args": ["-n", "8"]})
+        assert_same("missing file", (200, True), (status, report["result"] != 0 and bool(report["error"])))
+        # 큐 크기가 1이면 처리 중인 작업이 있는 동안 들어온 작업은 바로 거절해야 함
+        responses: List[Tuple[int, Dict[str, Any], Dict[str, str]]] = []
+        def post() -> None:
+            responses.append(request_server(url + "split", {"file": path, "args": ["-n", "8", "-c", "white"]}))
+        threads = [threading.Thread(target=post) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        num_accepted = sum(1 for (status, _, _) in responses if status == 200)
+        num_rejected = sum(1 for (status, _, _) in responses if status == 503)
+        if num_accepted < 1 or num_rejected < 1 or num_accepted + num_rejected != 4:
+            raise AssertionError("burst: %d accepted, %d rejected" % (num_accepted, num_rejected))
+        assert_same("Retry-After", ["1"] * num_rejected, [headers.get("Retry-After") for (status, _, headers) in responses if status == 503])
+        (status, stats, _) = request_server(url + "stats")
+        assert_same("stats", (200, 0, 2 + num_accepted, 1, num_rejected),
+                    (status, stats["queue_depth"], stats["completed"], stats["failed"], stats["rejected"]))
+        if not 0 < stats["latency_p50"] <= stats["latency_max"]:
+            raise AssertionError("stats: latency %s" % stats)
+        assert_same("unknown path", 404, request_server(url + "unknown")[0])
+    finally:
+        server.send_signal(signal.SIGINT)
+        server.communicate(timeout=60)
+
+
+def get_max_concurrent_saves(image_file, options) -> int:
+    # 조각을 저장하는 동안 동시에 인코딩 중인 조각의 최대 갯수 (인코딩을 조금씩 늦춰서 겹치는지 확인함)
+    save_piece = split.save_piece
+    lock = threading.Lock()
+    counts = [0, 0]
+    def slow_save_piece(*args, **kwargs) -> Any:
+        with lock:
+            counts[0] += 1
+            counts[1] = max(counts[1], counts[0])
+        try:
+            time.sleep(0.05)
+            return save_piece(*args, **kwargs)
+        finally:
+            with lock:
+                counts[0] -= 1
+    split.save_piece = slow_save_piece
+    try:
+        assert_same("split with --memory-limit %d" % options.memory_limit, 0, split.split_image_file(image_file, options, split.log_nothing))
+    finally:
+        split.save_piece = save_piece
+    return counts[1]
+
+
+def check_memory_limit(work_dir) -> None:
+    # --memory-limit이 디코딩과 프로파일 계산에 쓰고 남은 메모리로 조각 인코딩을 제한해야 함 (작은 한도이면 하나씩 인코딩함)
+    path = os.path.join(work_dir, "episode.jpg")
+    shutil.copy(os.path.join(test_dir, "vertical2.jpg"), path)
+    assert_same("concurrent saves with --memory-limit 1", 1, get_max_concurrent_saves(path, get_options(10, save_workers=4, memory_limit=1)))
+    if get_max_concurrent_saves(path, get_options(10, save_workers=4, memory_limit=100000)) < 2:
+        raise AssertionError("--memory-limit 100000: pieces were not encoded concurrently")
+
+
+def check_piece_previews(name, piece, orientation, sizes) -> Image.Image:
+    # 조각의 미리보기 파일들이 조각을 줄인 이미지이고 크기가 맞는지 확인하고 가장 작은 미리보기를 반환함
+    with Image.open(piece["file"]) as im:
+        im.load()
+    assert_same("%s previews" % name, [split.get_preview_name(piece["file"], size) for size in sizes], [preview["file"] for preview in piece["previews"]])
+    axis = 0 if orientation == "vertical" else 1
+    for (size, preview_report) in zip(sizes, piece["previews"]):
+        with Image.open(preview_report["file"]) as preview:
+            preview.load()
+        assert_same("%s size in the report" % preview_report["file"], list(preview.size), preview_report["size"])
+        length = min(size, im.size[axis])
+        other = im.size[1 - axis] * length / im.size[axis]
+        if preview.size[axis] != length or abs(preview.size[1 - axis] - other) > 2:
+            raise AssertionError("%s: size %s for a %s piece" % (preview_report["file"], preview.size, im.size))
+        reference = numpy.asarray(im.resize(preview.size, Image.Resampling.BOX), dtype=numpy.int16)
+        difference = numpy.abs(numpy.asarray(preview, dtype=numpy.int16) - reference).mean()
+        if difference > max_preview_difference:
+            raise AssertionError("%s: differs from the reduced piece by %.1f" % (preview_report["file"], difference))
+    return preview
+
+
+def check_overview(name, report, tiles, orientation) -> None:
+    # 개요가 가장 작은 미리보기들을 자른 순서대로 이어 붙인 이미지인지 확인함
+    with Image.open(report["overview"]["file"]) as overview:
+        overview.load()
+    assert_same("%s overview size in the report" % name, list(overview.size), report["overview"]["size"])
+    offset = 0
+    for tile in tiles:
+        box = (0, offset, tile.size[0], offset + tile.size[1]) if orientation == "vertical" else (offset, 0, offset + tile.size[0], tile.size[1])
+        assert_same_pixels("%s overview at %d" % (name, offset), tile, overview.crop(box))
+        offset += tile.size[1] if orientation == "vertical" else tile.size[0]
+    assert_same("%s overview length" % name, offset, overview.size[1] if orientation == "vertical" else overview.size[0])
+
+
+def make_gradient_strip(width, height, panel_height, gutter) -> Image.Image:
+    # 줄이는 방법에 따라 결과가 크게 달라지지 않도록 칸을 완만한 그라데이션으로 채운 이미지 (여백은 흰색)
+    (y, x) = numpy.mgrid[0:height, 0:width]
+    pixels = numpy.stack([x * 255 // width, 128 + 127 * numpy.sin(y / 150), 128 + 127 * numpy.cos(x / 90 + y / 400)], axis=2).astype(numpy.uint8)
+    pixels[y % panel_height < gutter] = 255
+    pixels[:, :width // 40] = 255
+    pixels[:, width - width // 40:] = 255
+    return Image.fromarray(pixels, "RGB")
+
+
+def check_previews(work_dir) -> None:
+    # --previews의 미리보기는 조각을 줄인 것이고, 개요는 가장 작은 미리보기를 이어 붙인 것이어야 함
+    strip = make_gradient_strip(1000, 9000, 1500, 60)
+    for (name, im, orientation, sizes) in [("vertical.png", strip, "vertical", [480, 120]), ("horizontal.png", strip.transpose(Image.Transpose.ROTATE_90), "horizontal", [300, 64]),
+                                           ("small.png", strip.crop((0, 0, 100, 9000)), "vertical", [480, 50])]:
+        path = os.path.join(work_dir, name)
+        im.save(path)
+        report: dict = {}
+        assert_same("%s split" % name, 0, split.split_image_file(path, get_options(6, "white", preview_sizes=sizes), split.log_nothing, report))
+        assert_same("%s orientation" % name, orientation, report["orientation"])
+        tiles = [check_piece_previews(name, piece, orientation, sizes) for piece in report["pieces"]]
+        assert_same("%s overview" % name, split.get_preview_name(path, sizes[-1]), report["overview"]["file"])
+        check_overview(name, report, tiles, orientation)
+    # --incremental은 그대로 둔 조각의 미리보기는 다시 저장하지 않고, 개요는 모든 조각으로 다시 만듦
+    path = os.path.join(work_dir, "episode.png")
+    strip.crop((0, 0, 1000, 6000)).save(path)
+    first: dict = {}
+    assert_same("first split", 0, split.split_image_file(path, get_options(4, "white", preview_sizes=[240], do_incremental=True), split.log_nothing, first))
+    stats = [os.stat(piece["previews"][0]["file"]).st_mtime_ns for piece in first["pieces"][:-1]]
+    strip.save(path)
+    second: dict = {}
+    assert_same("incremental split", 0, split.split_image_file(path, get_options(4, "white", preview_sizes=[240], do_incremental=True), split.log_nothing, second))
+    assert_same("kept previews", stats, [os.stat(piece["previews"][0]["file"]).st_mtime_ns for piece in second["pieces"][:len(stats)]])
+    tiles = [check_piece_previews("episode.png", piece, "vertical", [240]) for piece in second["pieces"]]
+    check_overview("episode.png", second, tiles, "vertical")
+
+
+def check_output_plan(work_dir) -> None:
+    # 조각마다 원래 포맷, WebP, JPEG, PNG 중 저장할 수 있는 첫 번째 포맷을 미리 정해서 한 번만 인코딩해야 함
+    # (크기, 모드, 원래 포맷, preset, 정해야 할 포맷, 인코더 옵션)
+    plans = [((800, 1000), "RGB", "JPEG", "balanced", "JPEG", {"quality": 90}),
+             ((800, 1000), "RGB", "JPEG", "small", "JPEG", {"quality": 90, "optimize": True, "progressive": True}),
+             ((1, 60000), "RGB", "JPEG", "balanced", "JPEG", {"quality": 90}),
+             ((1, 70000), "RGB", "JPEG", "fast", "PNG", {"compress_level": 1}),
+             ((1, 10000), "RGBA", "JPEG", "balanced", "WEBP", {"quality": 80}),
+             ((1, 10000), "RGBA", "JPEG", "fast", "WEBP", {"quality": 80, "method": 0}),
+             ((1, 20000), "RGBA", "JPEG", "small", "PNG", {"optimize": True}),
+             ((1, 1000), "P", "JPEG", "balanced", "WEBP", {"quality": 80}),
+             ((1, 1000), "P", "GIF", "small", "GIF", {"quality": 90, "optimize": True}),
+             ((1, 1000), "LA", "BMP", "balanced", "WEBP", {"quality": 80}),
+             ((1, 1000), "RGB", "PNG", "fast", "PNG", {"quality": 90, "compress_level": 1}),
+             ((1, 1000), "RGB", None, "balanced", "WEBP", {"quality": 80})]
+    for (size, mode, format, preset, expected_format, expected_params) in plans:
+        name = "%dx%d %s %s --preset %s" % (size[0], size[1], mode, format, preset)
+        plan = split.plan_piece_output(size, mode, format, preset)
+        assert_same(name, (expected_format, expected_params), (plan.format, plan.params))
+        assert_same("%s reason" % name, expected_format != format, bool(plan.reason))
+        # 정한 포맷으로 실제로 한 번에 저장되어야 함
+        trace = split.Tracer()
+        output = io.BytesIO()
+        (succeeded, messages, stats) = split.save_piece(Image.new(mode, size), output, format, trace, "piece", preset)
+        assert_same("%s saved" % name, (True, expected_format), (succeeded, stats.get("format")))
+        assert_same("%s encodes" % name, [(expected_format, False)], [(event["format"], event.get("failed", False)) for event in trace.events if event["stage"] == "encode"])
+        assert_same("%s messages" % name, ["Saving as %s: %s" % (plan.format, plan.reason)] * bool(plan.reason) + ["save: piece"], messages)
+        output.seek(0)
+        with Image.open(output) as saved:
+            assert_same("%s saved image" % name, (expected_format, size), (saved.format, saved.size))
+    # 저장할 수 있는 포맷이 없으면 인코딩하지 않고 실패해야 함
+    trace = split.Tracer()
+    (succeeded, messages, stats) = split.save_piece(Image.new("CMYK", (1, 70000)), io.BytesIO(), "JPEG", trace, "piece")
+    assert_same("unsavable piece", (False, []), (succeeded, [event for event in trace.events if event["stage"] == "encode"]))
+    assert_same("unsavable piece message", ["Failed to save piece: no output format can store 1x70000 CMYK"], messages)
+
+
+def check_library_api(work_dir) -> None:
+    # split_image()는 경로, 바이트, 파일 객체, PIL 이미지, 경로의 목록을 받아서 파일을 쓰거나 출력하지 않고 같은 결과를 내야 함
+    path = os.path.join(work_dir, "episode.jpg")
+    shutil.copy(os.path.join(test_dir, "vertical2.jpg"), path)
+    options = get_options(10, "white")
+    expected = split.split_image(path, options)
+    with open(path, "rb") as f:
+        data = f.read()
+    with Image.open(path) as im:
+        im.load()
+    (top, bottom) = (os.path.join(work_dir, "top.png"), os.path.join(work_dir, "bottom.png"))
+    im.crop((0, 0, im.size[0], 5000)).save(top)
+    im.crop((0, 5000, im.size[0], im.size[1])).save(bottom)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        with open(path, "rb") as f:
+            results = [("bytes", split.split_image(data, options), "JPEG"), ("file", split.split_image(f, options), "JPEG"),
+                       ("opened image", split.split_image(im, options), "JPEG"), ("new image", split.split_image(im.copy(), options), None),
+                       ("list", split.split_image([top, bottom], options), "PNG")]
+    assert_same("printed messages", "", output.getvalue())
+    assert_same("written files", ["bottom.png", "episode.jpg", "top.png"], sorted(os.listdir(work_dir)))
+    assert_same("path result", (im.size, "JPEG", "vertical", (255, 255, 255)), (expected.size, expected.format, expected.orientation, expected.bgcolor))
+    if len(expected.cutting_points) < 2 or expected.pieces:
+        raise AssertionError("path result: %d cutting points, %d pieces" % (len(expected.cutting_points), len(expected.pieces)))
+    for (name, result, format) in results:
+        assert_same(name, (expected.size, format, expected.orientation, expected.bgcolor, expected.cutting_points),
+                    (result.size, result.format, result.orientation, result.bgcolor, result.cutting_points))
+    # piece_type이 "image"이면 잘라낸 이미지를, "bytes"이면 split.py가 저장하는 파일과 같은 바이트를 반환해야 함
+    images = split.split_image(path, options, "image").pieces
+    for (i, (box, piece)) in enumerate(zip(expected.cutting_points, images)):
+        assert_same_pixels("image piece %d" % (i + 1), im.crop(box), piece)
+    report: dict = {}
+    assert_same("file split", 0, split.split_image_file(path, options, split.log_nothing, report))
+    saved = []
+    for piece in report["pieces"]:
+        with open(piece["file"], "rb") as f:
+            saved.append(f.read())
+    assert_same("bytes pieces", saved, split.split_image(path, options, "bytes").pieces)
+    # --json은 다른 메시지 없이 JSON 문서 하나만 출력해야 함
+    completed = subprocess.run([sys.executable, os.path.join(test_dir, "..", "split.py"), "-n", "10", "-c", "white", "--json", path],
+                               check=True, capture_output=True, text=True)
+    document = json.loads(completed.stdout)
+    assert_same("--json keys", ["bgcolor", "cached", "elapsed", "error", "file", "format", "height", "orientation", "pieces", "pixels", "result", "width"], sorted(document))
+    assert_same("--json result", (path, 0, "", im.size[0], im.size[1], im.size[0] * im.size[1], "JPEG", "vertical", [255, 255, 255]),
+                (document["file"], document["result"], document["error"], document["width"], document["height"], document["pixels"], document["format"],
+                 document["orientation"], document["bgcolor"]))
+    assert_same("--json pieces", [(piece["file"], list(box), "JPEG", len(data)) for (piece, box, data) in zip(report["pieces"], expected.cutting_points, saved)],
+                [(piece["file"], piece["box"], piece["format"], piece["bytes"]) for piece in document["pieces"]])
+    # 여러 파일이면 파일별 결과를 담은 요약 하나를 출력함
+    completed = subprocess.run([sys.executable, os.path.join(test_dir, "..", "split.py"), "-n", "10", "-c", "white", "--json", "-j", "1", path, os.path.join(work_dir, "missing.jpg")],
+                               capture_output=True, text=True)
+    summary = json.loads(completed.stdout)
+    assert_same("--json batch keys", ["elapsed", "files", "files_per_second", "megapixels_per_second", "num_failed", "num_ok"], sorted(summary))
+    assert_same("--json batch", (1, 1, [path, os.path.join(work_dir, "missing.jpg")], [0, -1]),
+                (summary["num_ok"], summary["num_failed"], [report["file"] for report in summary["files"]], [report["result"] for report in summary["files"]]))
+    assert_same("--json batch pieces", [piece["box"] for piece in document["pieces"]], [piece["box"] for piece in summary["files"][0]["pieces"]])
+
+
+def check_batch(work_dir) -> None:
+    # 일괄 처리는 디렉토리와 glob을 펼치고, 실패한 파일이나 작업 프로세스를 죽인 파일이 있어도 나머지 파일을 모두 처리해야 함
+    os.mkdir(os.path.join(work_dir, "episodes"))
+    for name in ["a.jpg", "crash.jpg", "c.jpg"]:
+        shutil.copy(os.path.join(test_dir, "vertical.jpg"), os.path.join(work_dir, "episodes", name))
+    with open(os.path.join(work_dir, "episodes", "broken.jpg"), "w") as f:
+        f.write("not an image")
+    with open(os.path.join(work_dir, "episodes", "notes.txt"), "w") as f:
+        f.write("not listed")
+    shutil.copy(os.path.join(test_dir, "horizontal.jpg"), os.path.join(work_dir, "d.jpg"))
+    image_files = split.expand_image_files([os.path.join(work_dir, "episodes"), os.path.join(work_dir, "*.jpg")])
+    assert_same("expanded files", [os.path.join(work_dir, "episodes", name) for name in ["a.jpg", "broken.jpg", "c.jpg", "crash.jpg"]] + [os.path.join(work_dir, "d.jpg")], image_files)
+    expected = {image_file: get_cuts(image_file, get_options(5)) for image_file in image_files if "crash" not in image_file and "broken" not in image_file}
+    # crash.jpg를 처리하는 작업 프로세스는 바로 종료됨 (fork로 만든 작업 프로세스가 바꿔 둔 함수를 물려받음)
+    split_image_file = split.split_image_file
+    def crashing_split_image_file(image_file, *args, **kwargs) -> int:
+        if os.path.basename(image_file) == "crash.jpg":
+            os._exit(1)
+        return split_image_file(image_file, *args, **kwargs)
+    start_method = multiprocessing.get_start_method()
+    multiprocessing.set_start_method("fork", force=True)
+    split.split_image_file = crashing_split_image_file
+    try:
+        for num_workers in [1, 3]:
+            summary = split.split_batch(image_files, get_options(5), num_workers, split.log_nothing)
+            name = "-j %d" % num_workers
+            assert_same("%s files" % name, image_files, [report["file"] for report in summary["files"]])
+            assert_same("%s results" % name, [0, -1, 0, -1, 0], [report["result"] for report in summary["files"]])
+            assert_same("%s counts" % name, (3, 2), (summary["num_ok"], summary["num_failed"]))
+            assert_same("%s dead worker" % name, "worker process died", summary["files"][3]["error"])
+            if not summary["files"][1]["error"]:
+                raise AssertionError("%s: no error for broken.jpg" % name)
+            for report in summary["files"]:
+                if report["file"] in expected:
+                    assert_same("%s %s" % (name, report["file"]), expected[report["file"]], [tuple(piece["box"]) for piece in report["pieces"]])
+    finally:
+        split.split_image_file = split_image_file
+        multiprocessing.set_start_method(start_method, force=True)
+
+
+def get_stage_counts(events) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for event in events:
+        counts[event["stage"]] = counts.get(event["stage"], 0) + 1
+    return counts
+
+
+def check_trace(work_dir) -> None:
+    # --profile, --trace의 단계 이름과 횟수, 카운터가 실제로 한 일과 맞아야 함
+    path = os.path.join(work_dir, "episode.jpg")
+    shutil.copy(os.path.join(test_dir, "vertical2.jpg"), path)
+    trace = split.Tracer()
+    report: dict = {}
+    assert_same("traced split", 0, split.split_image_file(path, get_options(10), split.log_nothing, report, trace=trace))
+    num_pieces = len(report["pieces"])
+    expected = {"decode": 1, "cache": 1, "bgcolor": 1, "band_index": 1, "band": num_pieces - 1, "crop": num_pieces, "save": num_pieces, "encode": num_pieces, "wait_saves": 1}
+    assert_same("stages", expected, get_stage_counts(trace.events))
+    bands = [event for event in trace.events if event["stage"] == "band"]
+    assert_same("band cuts", [piece["box"][3] for piece in report["pieces"][:-1]], [event["cut"] for event in sorted(bands, key=lambda event: event["i"])])
+    saves = [event for event in trace.events if event["stage"] == "save"]
+    assert_same("saved files", sorted(piece["file"] for piece in report["pieces"]), sorted(event["file"] for event in saves))
+    encodes = [event for event in trace.events if event["stage"] == "encode"]
+    assert_same("encodes", [(1, "JPEG")] * num_pieces, [(event["depth"], event["format"]) for event in encodes])
+    assert_same("encoded bytes", sum(os.path.getsize(piece["file"]) for piece in report["pieces"]), trace.get_summary()["encode"]["bytes"])
+    # 변환, 미리보기, 압축 파일 단계는 그 옵션을 쓸 때만 기록됨
+    palette = os.path.join(work_dir, "palette.png")
+    with Image.open(path) as im:
+        im.convert("RGB").quantize(64).save(palette)
+    for (name, options, stages) in [("--rgb", get_options(10, do_convert_rgb=True), {"convert": 1}), ("--previews", get_options(10, preview_sizes=[240, 60]), {"preview": num_pieces + 1}),
+                                    ("--cbz", get_options(10, archive=""), {"archive": num_pieces})]:
+        trace = split.Tracer()
+        assert_same("%s split" % name, 0, split.split_image_file(palette, options, split.log_nothing, trace=trace))
+        counts = get_stage_counts(trace.events)
+        assert_same("%s stages" % name, stages, {stage: counts.get(stage, 0) for stage in stages})
+        if "convert" in counts and name != "--rgb":
+            raise AssertionError("%s: palette image converted" % name)
+    # 명령행의 --trace는 같은 기록을 JSON으로 쓰고, --profile은 단계마다 한 줄씩 출력함
+    trace_file = os.path.join(work_dir, "trace.json")
+    completed = subprocess.run([sys.executable, os.path.join(test_dir, "..", "split.py"), "-n", "10", "--profile", "--trace", trace_file, path],
+                               check=True, capture_output=True, text=True)
+    with open(trace_file) as f:
+        assert_same("--trace stages", expected, get_stage_counts(json.load(f)["events"]))
+    # "profile: <단계> <횟수> <시간>s ..." (첫 줄은 전체 시간)
+    profiled = {fields[1]: int(fields[2]) for fields in (line.split() for line in completed.stdout.splitlines()) if fields[:1] == ["profile:"] and len(fields) >= 4}
+    assert_same("--profile stages", expected, {stage: count for (stage, count) in profiled.items() if stage in expected})
+
+
+def get_split_messages(image_file, options, delays) -> List[str]:
+    # 자르면서 출력한 메시지 목록 (앞 조각의 인코딩을 delays만큼 늦춰서 뒤 조각의 인코딩이 먼저 끝나게 함)
+    messages: List[str] = []
+    save_piece = split.save_piece
+    lock = threading.Lock()
+    remaining_delays = list(delays)
+    def delayed_save_piece(*args, **kwargs) -> Any:
+        with lock:
+            delay = remaining_delays.pop(0) if remaining_delays else 0
+        time.sleep(delay)
+        return save_piece(*args, **kwargs)
+    def log(*args) -> None:
+        messages.append(" ".join(str(arg) for arg in args))
+    split.save_piece = delayed_save_piece
+    try:
+        assert_same("split with --save-workers %d" % options.save_workers, 0, split.split_image_file(image_file, options, log))
+    finally:
+        split.save_piece = save_piece
+    return messages
+
+
+def check_save_messages(work_dir) -> None:
+    # 여러 스레드로 저장해도 인코딩이 끝나는 순서와 상관없이 메시지가 동기 저장과 같은 순서로 나와야 함
+    for (name, num_units) in [("vertical.jpg", 5), ("vertical2.jpg", 10), ("horizontal.jpg", 4)]:
+        path = os.path.join(work_dir, name)
+        shutil.copy(os.path.join(test_dir, name), path)
+        expected = get_split_messages(path, get_options(num_units, save_workers=1), [])
+        assert_same("%s --save-workers 4" % name, expected, get_split_messages(path, get_options(num_units, save_workers=4), [0.3, 0.2, 0.1]))
+
+
+cases: List[Tuple[str, Callable[[str], None]]] = [
+    ("cache", check_cache),
+    ("server", check_server),
+    ("previews", check_previews),
+    ("output-plan", check_output_plan),
+    ("library-api", check_library_api),
+    ("batch", check_batch),
+    ("trace", check_trace),
+    ("save-messages", check_save_messages),
+    ("coarse", check_coarse),
+    ("native-modes", check_native_modes),
+    ("max-length", check_max_length),
+    ("merge", check_merge),
+    ("stream", check_stream),
+    ("incremental", check_incremental),
+    ("archive", check_archive),
+    ("memory-limit", check_memory_limit),
+]
+
+
+def main() -> int:
+    names = [name for (name, _) in cases]
+    selected = sys.argv[1:] or names
+    if any(name not in names for name in selected):
+        print_usage(sys.argv[0])
+        return -1
+    num_failed = 0
+    for (name, check) in cases:
+        if name not in selected:
+            continue
+        work_dir = tempfile.mkdtemp(prefix="split-compare-")
+        try:
+            check(work_dir)
+            print("ok %s" % name)
+        except Exception:
+            num_failed += 1
+            print("failure in %s" % name)
+            traceback.print_exc()
+        finally:
+            shutil.rmtree(work_dir)
+    if num_failed > 0:
+        return -1
+    print("success")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())